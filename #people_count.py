@@ -1,7 +1,15 @@
+import os
+import sys
+import time
+
 import cv2
 import numpy as np
 from ultralytics import YOLO
 
+# The batch sizing and people classes come from the web app's detector module
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Milestone2'))
+from people_detection import PEOPLE_CLASSES, BatchSizer
+
 zone = []
 drawing = False
 zone_defined = False
@@ -28,13 +36,14 @@ def draw_zone(event, x, y, flags, param):
         zone_defined = True
 
 
-# --- Check if point inside zone ---
+# --- Check if points inside zone ---
 def point_in_zone(x, y):
+    """Element-wise: True where (x, y) lies strictly inside the zone rectangle."""
     if len(zone) < 2:
-        return False
+        return np.zeros(np.shape(x), dtype=bool)
     x1, y1 = zone[0]
     x2, y2 = zone[-1]
-    return min(x1, x2) < x < max(x1, x2) and min(y1, y2) < y < max(y1, y2)
+    return (min(x1, x2) < x) & (x < max(x1, x2)) & (min(y1, y2) < y) & (y < max(y1, y2))
 
 
 # --- Draw Zone Window ---
@@ -56,42 +65,46 @@ def draw_zone_window(frame):
             break
 
 
-# --- Process Frame ---
-def process_frame(frame, model):
-    global use_zone
+# --- Batched Inference ---
+def people_class_ids(model):
+    """Model class ids whose names are in PEOPLE_CLASSES."""
+    return np.array([i for i, name in model.names.items() if name in PEOPLE_CLASSES], dtype=np.int64)
 
-    results = model(frame, verbose=False)
-    total_detected = 0
-    inside_zone = 0
 
-    # Draw zone
-    if use_zone and len(zone) >= 2:
-        cv2.rectangle(frame, zone[0], zone[-1], (255, 0, 0), 2)
-        cv2.putText(frame, "ZONE", (zone[0][0], zone[0][1] - 5),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+def detect_batch(frames, model, class_ids):
+    """Run one model call over frames. Returns [(boxes, classes)] per frame.
 
+    boxes is an (N, 4) int32 array of x1, y1, x2, y2 and classes the matching
+    class ids, already filtered to people with a vectorized mask.
+    """
+    results = model(frames, verbose=False)
+    detections = []
     for result in results:
-        boxes = result.boxes.xyxy
-        classes = result.boxes.cls
-        for i, box in enumerate(boxes):
-            cls_id = int(classes[i])
-            name = model.names[cls_id]
+        xyxy = result.boxes.xyxy.cpu().numpy().astype(np.int32)
+        classes = result.boxes.cls.cpu().numpy().astype(np.int64)
+        keep = np.isin(classes, class_ids)
+        detections.append((xyxy[keep], classes[keep]))
+    return detections
 
-            # Only consider person and face if available
-            if name in ["person", "face"]:
-                x1, y1, x2, y2 = map(int, box)
-                cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
 
-                total_detected += 1
-                color = (0, 255, 0)
+# --- Process Frame ---
+def draw_frame(frame, boxes, classes, names):
+    total_detected = len(boxes)
+    inside = np.zeros(total_detected, dtype=bool)
 
-                if use_zone and point_in_zone(cx, cy):
-                    color = (0, 0, 255)
-                    inside_zone += 1
+    # Draw zone
+    if use_zone and len(zone) >= 2:
+        cv2.rectangle(frame, zone[0], zone[-1], (255, 0, 0), 2)
+        cv2.putText(frame, "ZONE", (zone[0][0], zone[0][1] - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+        inside = point_in_zone((boxes[:, 0] + boxes[:, 2]) // 2, (boxes[:, 1] + boxes[:, 3]) // 2)
+    inside_zone = int(inside.sum())
 
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                cv2.putText(frame, name, (x1, y1 - 5),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    for (x1, y1, x2, y2), cls_id, is_inside in zip(boxes.tolist(), classes.tolist(), inside.tolist()):
+        color = (0, 0, 255) if is_inside else (0, 255, 0)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, names[cls_id], (x1, y1 - 5),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
 
     # Display counts
     cv2.putText(frame, f"Total Detected: {total_detected}", (20, 40),
@@ -103,12 +116,29 @@ def process_frame(frame, model):
     cv2.imshow("YOLO People Detection", frame)
 
 
+def process_frame(frame, model, class_ids=None):
+    if class_ids is None:
+        class_ids = people_class_ids(model)
+    boxes, classes = detect_batch([frame], model, class_ids)[0]
+    draw_frame(frame, boxes, classes, model.names)
+
+
+# --- Model (loaded once, reused by every run from the menu) ---
+_model = None
+
+
+def get_model():
+    global _model
+    if _model is None:
+        _model = YOLO(os.getenv('PEOPLE_MODEL', "yolov8n.pt"))  # lightweight & fast; .onnx/_openvino_model exports also load
+    return _model
+
+
 # --- Detection Function ---
 def detect_people(source):
     global use_zone
 
-    # Load YOLOv8 model
-    model = YOLO("yolov8n.pt")  # lightweight & fast
+    model = get_model()
 
     choice_zone = input("Do you want to add a zone? (y/n): ").lower()
     use_zone = (choice_zone == 'y')
@@ -135,27 +165,44 @@ def detect_people(source):
     cap = cv2.VideoCapture(0 if source == 0 else source)
     print("\n🎮 Controls:\nZ - Draw Zone | A - Toggle Zone Counting | Q - Quit\n")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
+    class_ids = people_class_ids(model)
+    sizer = BatchSizer()
+    running = True
+
+    while running:
+        # Collect up to sizer.size frames; the time spent filling counts toward the batch latency
+        started = time.perf_counter()
+        frames = []
+        while len(frames) < sizer.size:
+            ret, frame = cap.read()
+            if not ret:
+                running = False
+                break
+
+            # Resize for better display
+            max_width = 800
+            if frame.shape[1] > max_width:
+                scale = max_width / frame.shape[1]
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            frames.append(frame)
+        if not frames:
             break
 
-        # Resize for better display
-        max_width = 800
-        if frame.shape[1] > max_width:
-            scale = max_width / frame.shape[1]
-            frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-
-        process_frame(frame, model)
-
-        key = cv2.waitKey(1) & 0xFF
-        if key == ord('z'):
-            draw_zone_window(frame)
-        elif key == ord('a'):
-            use_zone = not use_zone
-            print(f"🟢 Zone {'Enabled' if use_zone else 'Disabled'}")
-        elif key == ord('q'):
-            break
+        detections = detect_batch(frames, model, class_ids)
+        sizer.record(time.perf_counter() - started)
+
+        for frame, (boxes, classes) in zip(frames, detections):
+            draw_frame(frame, boxes, classes, model.names)
+
+            key = cv2.waitKey(1) & 0xFF
+            if key == ord('z'):
+                draw_zone_window(frame)
+            elif key == ord('a'):
+                use_zone = not use_zone
+                print(f"🟢 Zone {'Enabled' if use_zone else 'Disabled'}")
+            elif key == ord('q'):
+                running = False
+                break
 
     cap.release()
     cv2.destroyAllWindows()
@@ -3,6 +3,7 @@ import os
 import pyrebase
 from firebase_config import firebase_config
 import requests
+from token_verifier import InvalidToken, get_verifier
 
 
 app = Flask(__name__)
@@ -13,6 +14,34 @@ auth = firebase.auth()
 
 # ========== ROUTES ==========
 
+def _email_verified(id_token):
+    """email_verified from the locally verified ID token; falls back to an account lookup."""
+    try:
+        return get_verifier().verify(id_token).get('email_verified', False)
+    except (InvalidToken, OSError):
+        user_info = auth.get_account_info(id_token)
+        return user_info['users'][0].get('emailVerified', False)
+
+def _session_user():
+    """session['user'], re-checked against its cached, locally verified ID token when one is stored."""
+    user = session.get('user')
+    token = session.get('id_token')
+    if user is None or token is None:
+        return user
+    try:
+        # Expiry is left to the Flask session; the signature and subject are still checked
+        claims = get_verifier().verify(token, check_expiry=False)
+    except InvalidToken:
+        claims = {}
+    except OSError:
+        return user
+    # Firebase stores emails lowercased; the session may hold the address as typed
+    if str(claims.get('email', '')).casefold() != user.casefold():
+        session.pop('user', None)
+        session.pop('id_token', None)
+        return None
+    return user
+
 @app.route('/')
 def home():
     return render_template('home.html')
@@ -68,12 +97,13 @@ def login():
         password = request.form['password']
         try:
             user = auth.sign_in_with_email_and_password(email, password)
-            user_info = auth.get_account_info(user['idToken'])
-            verified = user_info['users'][0].get('emailVerified', False)
+            verified = _email_verified(user['idToken'])
             if not verified:
                 flash("Please verify your email before logging in.")
                 return redirect(url_for('login'))
-            session['user'] = email
+            # The address as Firebase stores it, which is what the ID token carries
+            session['user'] = user.get('email') or email
+            session['id_token'] = user['idToken']
             return redirect(url_for('index'))
         except requests.exceptions.HTTPError as e:
             error_message = 'UNKNOWN_ERROR'
@@ -113,14 +143,21 @@ def forgot_password():
 def google_login():
     id_token = request.json.get('idToken')
     try:
-        req_url = f"https://identitytoolkit.googleapis.com/v1/accounts:lookup?key={firebase_config['apiKey']}"
-        headers = {'Content-Type': 'application/json'}
-        res = requests.post(req_url, json={'idToken': id_token}, headers=headers)
-        res.raise_for_status()
-        user_info = res.json()
-        email = user_info['users'][0]['email']
+        try:
+            email = get_verifier().verify(id_token)['email']
+        except OSError:
+            # Google's keys unreachable: fall back to asking Firebase
+            req_url = f"https://identitytoolkit.googleapis.com/v1/accounts:lookup?key={firebase_config['apiKey']}"
+            headers = {'Content-Type': 'application/json'}
+            res = requests.post(req_url, json={'idToken': id_token}, headers=headers)
+            res.raise_for_status()
+            user_info = res.json()
+            email = user_info['users'][0]['email']
         session['user'] = email
+        session['id_token'] = id_token
         return redirect(url_for('index'))
+    except (InvalidToken, KeyError):
+        return {"error": "Google sign-in failed."}, 400
     except requests.exceptions.HTTPError:
         return {"error": "Google sign-in failed."}, 400
     except Exception:
@@ -129,13 +166,17 @@ def google_login():
 # -------- Index (Dashboard) --------
 @app.route('/index')
 def index():
-    if 'user' not in session:
+    user = _session_user()
+    if user is None:
         return redirect(url_for('login'))
-    return render_template('index.html', user=session.get('user'))
+    return render_template('index.html', user=user)
 
 # -------- Logout --------
 @app.route('/logout')
 def logout():
+    token = session.pop('id_token', None)
+    if token:
+        get_verifier().forget(token)
     session.pop('user', None)
     return redirect(url_for('home'))
 
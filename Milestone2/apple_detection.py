@@ -0,0 +1,168 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from metrics import stage
+
+# Kept free of Flask/Firebase imports so video worker processes can load it cheaply.
+
+APPLE_HUE_LUT = os.getenv('APPLE_HUE_LUT', '0') == '1'
+# Minimum contour area (pixels) for a blob to count as an apple
+APPLE_MIN_AREA = 500
+
+
+def _build_hue_lut(hue_ranges):
+    """256-entry table mapping an 8-bit hue to 255 inside any of hue_ranges, else 0."""
+    lut = np.zeros(256, np.uint8)
+    for lo, hi in hue_ranges:
+        lut[lo:hi + 1] = 255
+    return lut
+
+
+class AppleDetector:
+    """HSV red-mask apple detector with precomputed constants and reusable buffers.
+
+    Scratch arrays are allocated once per frame shape and every OpenCV call
+    writes into them via dst=, so a stream of same-sized frames allocates
+    almost nothing. With use_lut=True the per-range inRange calls and the OR
+    are replaced by one hue table lookup plus a single S/V threshold, which
+    costs the same however many hue ranges are configured.
+    Instances are not thread-safe; use one per thread.
+    """
+
+    def __init__(self, min_area=APPLE_MIN_AREA, use_lut=APPLE_HUE_LUT):
+        self.min_area = min_area
+        self.use_lut = use_lut
+        self.lower_red1 = np.array([0, 100, 100], np.uint8)
+        self.upper_red1 = np.array([10, 255, 255], np.uint8)
+        self.lower_red2 = np.array([160, 100, 100], np.uint8)
+        self.upper_red2 = np.array([180, 255, 255], np.uint8)
+        self.kernel = np.ones((5, 5), np.uint8)
+        self._hue_lut = _build_hue_lut([(0, 10), (160, 180)])
+        self._lower_sv = np.array([0, 100, 100], np.uint8)
+        self._upper_sv = np.array([255, 255, 255], np.uint8)
+        self._shape = None
+
+    def params(self):
+        """The settings that determine this detector's results (e.g. for result cache keys)."""
+        return {
+            "ranges": [r.tolist() for r in (self.lower_red1, self.upper_red1, self.lower_red2, self.upper_red2)],
+            "kernel": list(self.kernel.shape),
+            "min_area": self.min_area,
+        }
+
+    def _ensure_buffers(self, shape):
+        if shape == self._shape:
+            return
+        h, w = shape[:2]
+        self._hsv = np.empty((h, w, 3), np.uint8)
+        self._mask1 = np.empty((h, w), np.uint8)
+        self._mask2 = np.empty((h, w), np.uint8)
+        self._mask = np.empty((h, w), np.uint8)
+        self._shape = shape
+
+    def mask(self, bgr_image: np.ndarray) -> np.ndarray:
+        """Return the cleaned red mask. The array is reused by the next call."""
+        self._ensure_buffers(bgr_image.shape)
+        with stage('hsv'):
+            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=self._hsv)
+        with stage('mask'):
+            if self.use_lut:
+                cv2.extractChannel(hsv, 0, dst=self._mask1)
+                cv2.LUT(self._mask1, self._hue_lut, dst=self._mask1)
+                cv2.inRange(hsv, self._lower_sv, self._upper_sv, dst=self._mask2)
+                cv2.bitwise_and(self._mask1, self._mask2, dst=self._mask)
+            else:
+                cv2.inRange(hsv, self.lower_red1, self.upper_red1, dst=self._mask1)
+                cv2.inRange(hsv, self.lower_red2, self.upper_red2, dst=self._mask2)
+                cv2.bitwise_or(self._mask1, self._mask2, dst=self._mask)
+        with stage('morphology'):
+            cv2.morphologyEx(self._mask, cv2.MORPH_OPEN, self.kernel, dst=self._mask1)
+            cv2.morphologyEx(self._mask1, cv2.MORPH_CLOSE, self.kernel, dst=self._mask)
+        return self._mask
+
+    def find(self, bgr_image: np.ndarray, min_area=None):
+        """Return detections as dicts with center, radius, area and bbox (x, y, w, h)."""
+        if bgr_image is None or bgr_image.size == 0:
+            return []
+        if min_area is None:
+            min_area = self.min_area
+        mask = self.mask(bgr_image)
+        with stage('contours'):
+            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            detections = []
+            for contour in contours:
+                area = cv2.contourArea(contour)
+                if area > min_area:
+                    (x, y), radius = cv2.minEnclosingCircle(contour)
+                    bx, by, bw, bh = cv2.boundingRect(contour)
+                    detections.append({
+                        "center": [int(x), int(y)],
+                        "radius": int(radius),
+                        "area": float(area),
+                        "bbox": [int(bx), int(by), int(bw), int(bh)],
+                    })
+        return detections
+
+    def detect(self, bgr_image: np.ndarray, in_place=False, min_area=None):
+        """Return (count, annotated_bgr). in_place draws on bgr_image instead of a copy."""
+        if bgr_image is None or bgr_image.size == 0:
+            return 0, None
+        detections = self.find(bgr_image, min_area)
+        annotated = bgr_image if in_place else bgr_image.copy()
+        draw_detections(annotated, detections)
+        return len(detections), annotated
+
+
+def _label(det, number):
+    if "id" in det:
+        return str(det["id"])
+    # Tracked but not confirmed yet: an ordinal here could repeat a real track ID
+    if "track" in det:
+        return "?"
+    return str(number)
+
+
+def draw_detections(bgr_image: np.ndarray, detections):
+    """Draw labelled circles and the total count onto bgr_image.
+
+    Tracked detections show their track ID ("?" until the track is
+    confirmed); untracked ones are numbered in order.
+    """
+    with stage('annotate'):
+        for number, det in enumerate(detections, 1):
+            x, y = det["center"]
+            cv2.circle(bgr_image, (x, y), det["radius"], (0, 255, 0), 3)
+            cv2.putText(bgr_image, _label(det, number), (x - 10, y - 10),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 3)
+        cv2.putText(bgr_image, f"Total Apples: {len(detections)}", (10, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 3)
+    return bgr_image
+
+
+_local = threading.local()
+
+
+def get_detector() -> AppleDetector:
+    """Return this thread's detector, creating it on first use."""
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = AppleDetector()
+    return detector
+
+
+def detect_apples_in_bgr_image(bgr_image: np.ndarray, in_place=False, min_area=None):
+    """Return (count, annotated_bgr) for apples detected using HSV red mask."""
+    return get_detector().detect(bgr_image, in_place=in_place, min_area=min_area)
+
+
+def find_apples_in_bgr_image(bgr_image: np.ndarray, min_area=None):
+    """Return the list of detections without drawing or copying the image."""
+    return get_detector().find(bgr_image, min_area)
+
+
+def detector_params():
+    """params() of this thread's detector."""
+    return get_detector().params()
@@ -0,0 +1,308 @@
+import io
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+from importlib import import_module
+
+from app import app as flask_app
+from metrics import STREAM_DROPPED, STREAM_FRAMES, STREAMS_ACTIVE, QueuedExecutor, register_collector
+
+# ASGI entry point for long-lived streams. Serve with any ASGI server, e.g.
+#
+#     uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+#
+# The MJPEG feeds are served natively as async generators: the webcam feed
+# awaits the camera thread's broadcast, and file feeds run each frame's
+# decode/detect/encode on a small worker pool and await the pacing delay.
+# An open or slow viewer therefore costs one coroutine instead of a WSGI
+# worker thread. /apple/ws is a WebSocket carrying binary webcam frames (see
+# frame_channel.py). Every other request goes to the Flask app unchanged
+# through a WSGI bridge on a thread pool.
+
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 32))
+ASGI_STREAM_WORKERS = int(os.getenv('ASGI_STREAM_WORKERS', os.cpu_count() or 2))
+# Request bodies larger than this are spooled to a temporary file
+ASGI_BODY_SPOOL_BYTES = int(os.getenv('ASGI_BODY_SPOOL_BYTES', 1024 * 1024))
+
+# Feed path -> detection_views function returning (source, error response)
+STREAM_ROUTES = {
+    '/apple/stream-webcam/feed': 'open_apple_webcam_stream',
+    '/apple/video_feed': 'open_apple_webcam_stream',
+    '/apple/video_feed_file': 'open_apple_video_stream',
+    '/people/video_feed_file': 'open_people_video_stream',
+}
+
+# WebSocket path -> detection_views function returning (FrameChannel, error response)
+WEBSOCKET_ROUTES = {
+    '/apple/ws': 'open_apple_frame_channel',
+}
+
+_MJPEG_HEADERS = [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                  (b'cache-control', b'no-cache')]
+
+
+def _environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP or WebSocket scope; body is a readable file."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope.get('method', 'GET'),
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'https' if scope.get('scheme') in ('https', 'wss') else 'http',
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        value = value.decode('latin-1')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+
+async def _read_body(receive):
+    """The whole request body as a rewound file, or None if the client went away."""
+    body = tempfile.SpooledTemporaryFile(max_size=ASGI_BODY_SPOOL_BYTES)
+    more = True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None
+        body.write(message.get('body', b''))
+        more = message.get('more_body', False)
+    body.seek(0)
+    return body
+
+
+async def _wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+class StreamingApp:
+    """ASGI app serving the MJPEG feeds natively and everything else through a Flask app."""
+
+    def __init__(self, flask_app, stream_routes=STREAM_ROUTES, websocket_routes=WEBSOCKET_ROUTES,
+                 wsgi_threads=ASGI_WSGI_THREADS, stream_workers=ASGI_STREAM_WORKERS):
+        self.flask_app = flask_app
+        self.stream_routes = stream_routes
+        self.websocket_routes = websocket_routes
+        self._wsgi_pool = QueuedExecutor(wsgi_threads, thread_name_prefix='asgi-wsgi')
+        self._stream_pool = QueuedExecutor(stream_workers, thread_name_prefix='asgi-stream')
+        self.active_streams = 0
+        register_collector(self._collect_metrics)
+
+    def _collect_metrics(self):
+        return [
+            ('asgi_active_streams', 'gauge', 'MJPEG feeds being served by the ASGI app.', [({}, self.active_streams)]),
+            ('executor_queue_depth', 'gauge', 'Work items waiting for a pool thread.',
+             [({"pool": "asgi_wsgi"}, self._wsgi_pool.queue_depth()),
+              ({"pool": "asgi_stream"}, self._stream_pool.queue_depth())]),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            opener = self.stream_routes.get(scope['path']) if scope['method'] == 'GET' else None
+            if opener is not None:
+                await self._stream(opener, scope, receive, send)
+            else:
+                await self._wsgi(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            opener = self.websocket_routes.get(scope['path'])
+            if opener is not None:
+                await self._websocket(opener, scope, receive, send)
+            else:
+                await send({'type': 'websocket.close'})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._wsgi_pool.shutdown(wait=False)
+                self._stream_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # -------- WSGI bridge --------
+
+    async def _wsgi(self, scope, receive, send):
+        body = await _read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        gone = threading.Event()
+        watcher = asyncio.ensure_future(_wait_disconnect(receive))
+        watcher.add_done_callback(lambda _: gone.set())
+        try:
+            await loop.run_in_executor(self._wsgi_pool, self._run_wsgi, _environ(scope, body), send, loop, gone)
+        finally:
+            watcher.cancel()
+            body.close()
+
+    def _run_wsgi(self, environ, send, loop, gone):
+        """Call the Flask app and send its response, all on one pool thread.
+
+        Keeping the whole iteration on one thread matters for streamed
+        responses, whose generators may rely on a pushed request context.
+        """
+        def call(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]),
+                          [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+
+        result = self.flask_app(environ, start_response)
+        try:
+            call({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+            for chunk in result:
+                if gone.is_set():
+                    return
+                if chunk:
+                    call({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            call({'type': 'http.response.body', 'body': b''})
+        finally:
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+
+    # -------- Native MJPEG feeds --------
+
+    def _open(self, name, environ):
+        # Session, auth and query options go through Flask exactly as for the WSGI views
+        with self.flask_app.request_context(environ):
+            source, error = getattr(import_module('detection_views'), name)()
+            if error is not None:
+                return None, self.flask_app.make_response(error)
+            return source, None
+
+    async def _stream(self, name, scope, receive, send):
+        body = await _read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            source, error = await loop.run_in_executor(self._wsgi_pool, self._open, name,
+                                                       _environ(scope, body))
+        finally:
+            body.close()
+        if error is not None:
+            headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in error.headers.to_wsgi_list()]
+            await send({'type': 'http.response.start', 'status': error.status_code, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': error.get_data()})
+            return
+
+        frames = source.aframes(self._stream_pool)
+        await send({'type': 'http.response.start', 'status': 200, 'headers': _MJPEG_HEADERS})
+        self.active_streams += 1
+        pump = asyncio.ensure_future(self._pump(frames, send))
+        watcher = asyncio.ensure_future(_wait_disconnect(receive))
+        try:
+            await asyncio.wait({pump, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.active_streams -= 1
+            pump.cancel()
+            watcher.cancel()
+            outcome, _ = await asyncio.gather(pump, watcher, return_exceptions=True)
+            await frames.aclose()
+        # A failed send just means the viewer left; anything else is a real error
+        if isinstance(outcome, Exception) and not isinstance(outcome, OSError):
+            raise outcome
+
+    @staticmethod
+    async def _pump(frames, send):
+        async for part in frames:
+            await send({'type': 'http.response.body', 'body': part, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+    # -------- WebSocket frame channel --------
+
+    async def _websocket(self, name, scope, receive, send):
+        if (await receive())['type'] != 'websocket.connect':
+            return
+        loop = asyncio.get_running_loop()
+        channel, error = await loop.run_in_executor(self._wsgi_pool, self._open, name, _environ(scope, io.BytesIO()))
+        await send({'type': 'websocket.accept'})
+        if error is not None:
+            # 4000 + HTTP status, e.g. 4401 when not logged in
+            reason = (error.get_json(silent=True) or {}).get('error', '')
+            await send({'type': 'websocket.close', 'code': 4000 + error.status_code, 'reason': reason})
+            return
+
+        # Drop-if-busy: while one frame is being processed, a newer one replaces
+        # the frame waiting behind it, so replies never fall behind the camera
+        waiting = None
+        wake = asyncio.Event()
+
+        async def reply(messages):
+            for kind, payload in messages:
+                await send({'type': 'websocket.send', kind: payload})
+
+        async def work():
+            nonlocal waiting
+            while True:
+                await wake.wait()
+                wake.clear()
+                data, waiting = waiting, None
+                if data is not None:
+                    await reply(await loop.run_in_executor(self._stream_pool, channel.process, data))
+                    STREAM_FRAMES.inc('websocket')
+
+        worker = asyncio.ensure_future(work())
+        STREAMS_ACTIVE.add('websocket', 1)
+        try:
+            while not worker.done():
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('bytes') is not None:
+                    channel.received += 1
+                    if waiting is not None:
+                        channel.dropped += 1
+                        STREAM_DROPPED.inc('websocket')
+                    waiting = message['bytes']
+                    wake.set()
+                elif message.get('text'):
+                    try:
+                        channel.configure(json.loads(message['text']))
+                    except ValueError as e:
+                        await reply(channel.encode({"error": str(e)}))
+        finally:
+            STREAMS_ACTIVE.add('websocket', -1)
+            worker.cancel()
+            outcome, = await asyncio.gather(worker, return_exceptions=True)
+        if isinstance(outcome, Exception) and not isinstance(outcome, OSError):
+            raise outcome
+
+
+app = StreamingApp(flask_app)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 8000)))
@@ -0,0 +1,383 @@
+"""Detection and streaming benchmark suite.
+
+Measures per-frame latency (p50/p95/mean), throughput, allocations and peak
+RSS for three layers, all in one process:
+
+  detector       apple detection (detect + annotate) on seeded synthetic
+                 scenes at several resolutions and apple densities, and on
+                 frames of Practice1(apple detection)/apple.mp4
+  endpoints      each /apple/* route through the Flask test client,
+                 including the MJPEG file feed
+  process_video  POST /apple/process-video on apple.mp4, polled until the
+                 job finishes
+
+The result cache is disabled unless --cache is given, so repeated requests
+measure the real work. Scenes are generated from --seed, so two runs on the
+same machine see identical inputs. Save a run as a baseline, then compare
+later runs against it. Any metric worse than --threshold (after a small
+absolute noise floor) is reported as a regression, and the exit status is 1:
+
+    python benchmarks/detection.py --output baseline.json
+    python benchmarks/detection.py --compare baseline.json --output after.json
+
+Allocations are the tracemalloc peak above the starting point during one
+call (NumPy and OpenCV arrays included), measured on a separate, untimed
+pass. rss_peak_mb is the process high-water mark once a case has run, so it
+only grows through a run; compare it between runs rather than between cases.
+"""
+import io
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_VIDEO = os.path.join(os.path.dirname(APP_DIR), 'Practice1(apple detection)', 'apple.mp4')
+
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+DENSITIES = (0, 5, 25, 100)
+SECTIONS = ('detector', 'endpoints', 'process_video')
+
+# metric -> (True if lower is better, absolute change ignored as noise)
+COMPARED_METRICS = {
+    'p50_ms': (True, 0.1),
+    'p95_ms': (True, 0.25),
+    'mean_ms': (True, 0.1),
+    'first_part_ms': (True, 5.0),
+    'alloc_peak_kb': (True, 16.0),
+    'rss_peak_mb': (True, 8.0),
+    'fps': (False, 0.5),
+}
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _summarize(seconds):
+    ordered = sorted(seconds)
+    total = sum(ordered)
+    return {
+        "iterations": len(ordered),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "fps": round(len(ordered) / total, 2) if total else None,
+    }
+
+
+def _measure(call, iterations, warmup=2):
+    """Time call() iterations times after warmup calls, then one traced call for allocations."""
+    for _ in range(warmup):
+        call()
+    seconds = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        seconds.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        base, _ = tracemalloc.get_traced_memory()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    report = _summarize(seconds)
+    report["alloc_peak_kb"] = round((peak - base) / 1024, 1)
+    report["rss_peak_mb"] = _peak_rss_mb()
+    return report
+
+
+# -------- Inputs --------
+
+def synthetic_scene(width, height, apples, seed=0):
+    """BGR orchard-like scene: textured green background, red apples, a few non-red decoys."""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng([seed, width, height, apples])
+    scene = np.empty((height, width, 3), np.uint8)
+    scene[:] = (40, 110, 60)
+    noise = rng.integers(-25, 26, (height, width, 3), dtype=np.int16)
+    scene = np.clip(scene.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    scale = min(width, height) / 480
+    for _ in range(max(apples // 5, 3)):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(10, 40) * scale) + 1
+        cv2.circle(scene, center, radius, (30, 180, 200), -1)  # yellow-green leaves and fruit
+    for _ in range(apples):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        radius = int(rng.integers(14, 36) * scale) + 4
+        red = (int(rng.integers(0, 40)), int(rng.integers(0, 40)), int(rng.integers(170, 250)))
+        cv2.circle(scene, center, radius, red, -1)
+        cv2.circle(scene, (center[0] - radius // 3, center[1] - radius // 3), max(radius // 5, 1),
+                   (120, 140, 255), -1)  # highlight
+    return scene
+
+
+def _video_frames(path, limit):
+    import cv2
+
+    cap = cv2.VideoCapture(path)
+    frames = []
+    try:
+        while len(frames) < limit:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    return frames
+
+
+def _encode(image, ext='.png'):
+    import cv2
+
+    ok, buf = cv2.imencode(ext, image)
+    if not ok:
+        raise RuntimeError(f'Cannot encode {ext}')
+    return buf.tobytes()
+
+
+# -------- Sections --------
+
+def bench_detector(args):
+    from apple_detection import detect_apples_in_bgr_image
+
+    cases = {}
+    for width, height in RESOLUTIONS:
+        for apples in DENSITIES:
+            scene = synthetic_scene(width, height, apples, args.seed)
+            report = _measure(lambda: detect_apples_in_bgr_image(scene), args.iterations)
+            report["apples_found"] = detect_apples_in_bgr_image(scene)[0]
+            cases[f'synthetic_{width}x{height}_d{apples}'] = report
+            print(f'detector {width}x{height} d{apples}: {report["p50_ms"]} ms', file=sys.stderr)
+    frames = _video_frames(args.video, args.video_frames)
+    if frames:
+        position = iter(range(sys.maxsize))
+        report = _measure(lambda: detect_apples_in_bgr_image(frames[next(position) % len(frames)]),
+                          max(args.iterations, len(frames)))
+        report["frames"] = len(frames)
+        cases['video_apple_mp4'] = report
+        print(f'detector apple.mp4: {report["p50_ms"]} ms', file=sys.stderr)
+    return cases
+
+
+def _client():
+    from app import app
+
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user'] = 'benchmark@example.com'
+    return client
+
+
+def _check(response):
+    if response.status_code >= 400:
+        raise RuntimeError(f'{response.request.path} returned {response.status_code}: '
+                           f'{response.get_data(as_text=True)[:200]}')
+    return response
+
+
+def bench_endpoints(args):
+    client = _client()
+    scene = synthetic_scene(640, 480, 25, args.seed)
+    png = _encode(scene)
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(_encode(scene, '.jpg')).decode('ascii')
+    batch = [_encode(synthetic_scene(640, 480, apples, args.seed)) for apples in (0, 5, 25, 100) * 2]
+    with open(args.video, 'rb') as f:
+        video = f.read()
+
+    def post_file(path, field, content, name):
+        return lambda: _check(client.post(path, data={field: (io.BytesIO(content), name)}))
+
+    requests = {
+        'detect_image': post_file('/apple/detect-image', 'image', png, 'scene.png'),
+        'detect_image_jpeg': post_file('/apple/detect-image?format=jpeg&quality=80', 'image', png, 'scene.png'),
+        'detect_webcam': lambda: _check(client.post('/apple/detect-webcam', json={'image': data_url})),
+        'detect_video': post_file('/apple/detect-video', 'video', video, 'apple.mp4'),
+        'count': post_file('/apple/count', 'image', png, 'scene.png'),
+        'count_data_url': lambda: _check(client.post('/apple/count', json={'image': data_url})),
+        'detect_batch': lambda: _check(client.post('/apple/detect-batch', data={
+            'images': [(io.BytesIO(content), f'{i}.png') for i, content in enumerate(batch)]})).get_data(),
+        'video_start': post_file('/apple/video/start', 'video', video, 'apple.mp4'),
+    }
+    cases = {}
+    for name, call in requests.items():
+        cases[name] = _measure(call, args.requests)
+        print(f'endpoint {name}: {cases[name]["p50_ms"]} ms', file=sys.stderr)
+    cases["detect_batch"]["images_per_request"] = len(batch)
+
+    # The feed is paced to the video's own FPS, so this reports delivered FPS and time to first frame
+    _check(client.post('/apple/video/start', data={'video': (io.BytesIO(video), 'apple.mp4')}))
+    started = time.perf_counter()
+    response = _check(client.get('/apple/video_feed_file'))
+    stamps = []
+    try:
+        for chunk in response.response:
+            if chunk.startswith(b'--frame'):
+                stamps.append(time.perf_counter())
+                if len(stamps) >= args.stream_parts:
+                    break
+    finally:
+        response.close()
+    gaps = [b - a for a, b in zip(stamps, stamps[1:])]
+    feed = _summarize(gaps) if gaps else {"iterations": 0}
+    feed["first_part_ms"] = round((stamps[0] - started) * 1000, 1) if stamps else None
+    feed["parts"] = len(stamps)
+    feed["rss_peak_mb"] = _peak_rss_mb()
+    cases['video_feed_file'] = feed
+    cases['video_snapshot'] = _measure(lambda: _check(client.get('/apple/video/snapshot')), args.requests)
+    _check(client.post('/apple/video/stop'))
+    print(f'endpoint video_feed_file: {feed.get("fps")} fps', file=sys.stderr)
+    return cases
+
+
+def bench_process_video(args):
+    import cv2
+
+    client = _client()
+    with open(args.video, 'rb') as f:
+        video = f.read()
+    cap = cv2.VideoCapture(args.video)
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    runs = []
+    for _ in range(args.video_runs):
+        started = time.perf_counter()
+        job = _check(client.post('/apple/process-video', data={'video': (io.BytesIO(video), 'apple.mp4')})).json
+        while True:
+            status = _check(client.get(job["status_url"])).json
+            if status["status"] not in ('queued', 'running'):
+                break
+            time.sleep(0.05)
+        runs.append(time.perf_counter() - started)
+        if status["status"] != 'done':
+            raise RuntimeError(f'process-video job ended as {status["status"]}: {status.get("error")}')
+        if status.get("video_url"):
+            # Benchmark outputs are not kept in static/outputs
+            try:
+                os.remove(status["video_url"].lstrip('/'))
+            except OSError:
+                pass
+    report = _summarize(runs)
+    report["frames"] = frames
+    report["fps"] = round(frames * len(runs) / sum(runs), 2)
+    report["rss_peak_mb"] = _peak_rss_mb()
+    print(f'process_video: {report["p50_ms"]} ms, {report["fps"]} fps', file=sys.stderr)
+    return {'apple_mp4': report}
+
+
+# -------- Baseline comparison --------
+
+def compare(current, baseline, threshold):
+    """Per-metric changes of current against baseline; regressions listed separately."""
+    changes, regressions = [], []
+    for section, cases in current.get("results", {}).items():
+        for case, metrics in cases.items():
+            before = baseline.get("results", {}).get(section, {}).get(case)
+            if before is None:
+                continue
+            for metric, (lower_is_better, floor) in COMPARED_METRICS.items():
+                old, new = before.get(metric), metrics.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                worse = change > threshold if lower_is_better else change < -threshold
+                entry = {"case": f'{section}/{case}', "metric": metric, "baseline": old, "current": new,
+                         "change": round(change, 3)}
+                changes.append(entry)
+                if worse and abs(new - old) > floor:
+                    regressions.append(entry)
+    return {"threshold": threshold, "compared": len(changes), "regressions": regressions}
+
+
+def _environment():
+    import cv2
+    import numpy as np
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "numpy": np.__version__,
+        "apple_hue_lut": os.getenv('APPLE_HUE_LUT', '0') == '1',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', default=','.join(SECTIONS), help='comma-separated subset of ' + ', '.join(SECTIONS))
+    parser.add_argument('--iterations', type=int, default=50, help='timed detector calls per case')
+    parser.add_argument('--requests', type=int, default=20, help='timed requests per endpoint')
+    parser.add_argument('--stream-parts', type=int, default=50, help='MJPEG parts read from the file feed')
+    parser.add_argument('--video', default=SAMPLE_VIDEO)
+    parser.add_argument('--video-frames', type=int, default=100, help='apple.mp4 frames in the detector section')
+    parser.add_argument('--video-runs', type=int, default=3, help='process-video jobs run end to end')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true', help='leave the result cache enabled')
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    sections = [s for s in args.sections.split(',') if s]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f'unknown sections: {", ".join(sorted(unknown))}')
+    if not os.path.exists(args.video):
+        parser.error(f'video not found: {args.video}')
+    if not args.cache:
+        # Read when the app is imported below
+        os.environ['RESULT_CACHE_MAX_BYTES'] = '0'
+        os.environ['RESULT_CACHE_DISK_MAX_BYTES'] = '0'
+        os.environ['RESULT_CACHE_DIR'] = tempfile.mkdtemp(prefix='bench_cache_')
+    # The app resolves static/ and its imports relative to its own directory
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    runners = {'detector': bench_detector, 'endpoints': bench_endpoints, 'process_video': bench_process_video}
+    report = {
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "environment": _environment(),
+        "options": {"iterations": args.iterations, "requests": args.requests, "seed": args.seed,
+                    "cache": args.cache, "video": os.path.basename(args.video)},
+        "results": {},
+    }
+    for section in sections:
+        report["results"][section] = runners[section](args)
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f), args.threshold)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+    if report.get("comparison", {}).get("regressions"):
+        for entry in report["comparison"]["regressions"]:
+            print(f'REGRESSION {entry["case"]} {entry["metric"]}: {entry["baseline"]} -> {entry["current"]} '
+                  f'({entry["change"]:+.0%})', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
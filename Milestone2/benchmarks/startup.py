@@ -0,0 +1,76 @@
+"""Cold-start benchmark for the web app.
+
+Each measurement runs in a fresh interpreter so nothing is cached between
+runs: the import time of app.py, then the latency of the first request to
+each route group (auth pages, apple detection, people service) right after
+import. Prints JSON; run from anywhere:
+
+    python benchmarks/startup.py --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_PROBE = r'''
+import io, json, sys, time
+sys.path.insert(0, {app_dir!r})
+started = time.perf_counter()
+import app as web
+imported = time.perf_counter() - started
+client = web.app.test_client()
+with client.session_transaction() as s:
+    s['user'] = 'benchmark@example.com'
+group = {group!r}
+started = time.perf_counter()
+if group == 'auth':
+    response = client.get('/login')
+elif group == 'apple':
+    import base64
+    # 1x1 red PNG
+    png = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4z8AAAAMBAQDJ/pLvAAAAAElFTkSuQmCC')
+    response = client.post('/apple/count', data={{'image': (io.BytesIO(png), 'a.png')}})
+else:
+    response = client.get('/people/models')
+first = time.perf_counter() - started
+print(json.dumps({{"import": imported, "first_request": first, "status": response.status_code,
+                  "modules": sorted(m for m in ('cv2', 'numpy', 'pyrebase', 'requests') if m in sys.modules)}}))
+'''
+
+GROUPS = ('auth', 'apple', 'people')
+
+
+def _probe(group, env):
+    code = _PROBE.format(app_dir=APP_DIR, group=group)
+    out = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, env=env,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--preload', action='store_true', help='set DETECTION_PRELOAD=1')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if args.preload:
+        env['DETECTION_PRELOAD'] = '1'
+    report = {"preload": args.preload, "runs": args.runs, "groups": {}}
+    for group in GROUPS:
+        samples = [_probe(group, env) for _ in range(args.runs)]
+        report["groups"][group] = {
+            "import_ms": round(statistics.median(s["import"] for s in samples) * 1000, 1),
+            "first_request_ms": round(statistics.median(s["first_request"] for s in samples) * 1000, 1),
+            "status": samples[-1]["status"],
+            "modules_loaded": samples[-1]["modules"],
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
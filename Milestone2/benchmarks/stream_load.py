@@ -0,0 +1,148 @@
+"""Concurrent MJPEG stream load test.
+
+Opens N simultaneous viewers of one feed for --duration seconds at each
+level in --levels, and reports how many were served, how many failed or
+never got a response, and the frames per second each viewer received.
+Point it at either serving mode to compare them:
+
+    gunicorn -w 1 --threads 8 -b 127.0.0.1:8000 app:app   # WSGI: a thread per viewer
+    uvicorn asgi_app:app --port 8000                       # ASGI: a coroutine per viewer
+
+    python benchmarks/stream_load.py http://127.0.0.1:8000/apple/video_feed_file \\
+        --video "../Practice1(apple detection)/apple.mp4" --levels 1,10,50,200
+
+The session cookie is minted with FLASK_SECRET_KEY (as the server uses) unless
+--cookie is given; --video uploads a file to the feed's /video/start route
+first. Raise the open-files limit (ulimit -n) for high levels.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import statistics
+import urllib.request
+from urllib.parse import urlsplit
+
+_BOUNDARY = b'--frame'
+
+# Feed -> route that prepares its video
+_START_ROUTES = {
+    '/apple/video_feed_file': '/apple/video/start',
+    '/people/video_feed_file': '/people/video/start',
+}
+
+
+def _mint_cookie(user):
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.secret_key = os.getenv('FLASK_SECRET_KEY', 'change-this-in-env')
+    return 'session=' + app.session_interface.get_signing_serializer(app).dumps({'user': user})
+
+
+def _upload(url, cookie, path):
+    boundary = uuid.uuid4().hex
+    with open(path, 'rb') as f:
+        content = f.read()
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="video"; filename="{os.path.basename(path)}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': f'multipart/form-data; boundary={boundary}', 'Cookie': cookie})
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+async def _viewer(host, port, target, cookie, duration, connect_timeout):
+    """One viewer. Returns {status, frames, seconds, first_frame_ms}; status 0 means no response."""
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), connect_timeout)
+    except (OSError, asyncio.TimeoutError):
+        return {"status": 0, "frames": 0, "seconds": 0.0, "first_frame_ms": None}
+    try:
+        writer.write(f'GET {target} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n'
+                     f'Connection: close\r\n\r\n'.encode())
+        try:
+            status_line = await asyncio.wait_for(reader.readline(), connect_timeout)
+            status = int(status_line.split()[1])
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+        except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+            return {"status": 0, "frames": 0, "seconds": 0.0, "first_frame_ms": None}
+        frames, first_frame, tail = 0, None, b''
+        deadline = started + duration
+        while status == 200:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                chunk = await asyncio.wait_for(reader.read(65536), remaining)
+            except (OSError, asyncio.TimeoutError):
+                break
+            if not chunk:
+                break
+            # Keep a short tail so a boundary split across reads is still counted once
+            seen = (tail + chunk).count(_BOUNDARY)
+            if seen and first_frame is None:
+                first_frame = time.perf_counter() - started
+            frames += seen
+            tail = chunk[-(len(_BOUNDARY) - 1):]
+        return {"status": status, "frames": frames, "seconds": time.perf_counter() - started,
+                "first_frame_ms": round(first_frame * 1000, 1) if first_frame is not None else None}
+    finally:
+        writer.close()
+
+
+async def _level(n, host, port, target, cookie, duration, connect_timeout):
+    results = await asyncio.gather(*[_viewer(host, port, target, cookie, duration, connect_timeout)
+                                     for _ in range(n)])
+    served = [r for r in results if r["status"] == 200]
+    fps = sorted(r["frames"] / r["seconds"] for r in served if r["seconds"])
+    first = [r["first_frame_ms"] for r in served if r["first_frame_ms"] is not None]
+    return {
+        "viewers": n,
+        "served": len(served),
+        "no_response": sum(r["status"] == 0 for r in results),
+        "errors": sum(r["status"] not in (0, 200) for r in results),
+        "starved": sum(r["frames"] == 0 for r in served),
+        "fps_median": round(statistics.median(fps), 2) if fps else 0.0,
+        "fps_p5": round(fps[int(len(fps) * 0.05)], 2) if fps else 0.0,
+        "total_fps": round(sum(fps), 1),
+        "first_frame_ms_median": round(statistics.median(first), 1) if first else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('url', help='feed URL, e.g. http://127.0.0.1:8000/apple/video_feed_file')
+    parser.add_argument('--levels', default='1,10,50,100', help='comma-separated viewer counts')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds each level holds its viewers')
+    parser.add_argument('--connect-timeout', type=float, default=5.0)
+    parser.add_argument('--cookie', help='Cookie header value; minted from FLASK_SECRET_KEY if omitted')
+    parser.add_argument('--user', default='loadtest@example.com', help='session user for a minted cookie')
+    parser.add_argument('--video', help='video file to upload to the feed\'s start route first')
+    args = parser.parse_args()
+
+    parts = urlsplit(args.url)
+    host, port = parts.hostname, parts.port or 80
+    target = parts.path + (f'?{parts.query}' if parts.query else '')
+    cookie = args.cookie or _mint_cookie(args.user)
+    if args.video and parts.path not in _START_ROUTES:
+        parser.error(f'--video needs one of: {", ".join(_START_ROUTES)}')
+
+    report = {"url": args.url, "duration": args.duration, "levels": []}
+    for n in (int(v) for v in args.levels.split(',')):
+        if args.video:
+            # Re-uploaded per level so every level plays from the start
+            _upload(f'{parts.scheme}://{parts.netloc}{_START_ROUTES[parts.path]}', cookie, args.video)
+        report["levels"].append(asyncio.run(_level(n, host, port, target, cookie, args.duration,
+                                                   args.connect_timeout)))
+        print(json.dumps(report["levels"][-1]), file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""Offline apple counting over folders of images and videos.
+
+Walks directories (recursively), single files and glob patterns, and counts
+apples with the app's detector across a pool of worker processes. Images
+are handed out in chunks of --chunk-size and each video is one task,
+largest first. Results go to --out:
+
+  files.csv       one row per file: status, size, frames, counts
+  frames.csv      one row per image or video frame: the apples visible in it
+  manifest.jsonl  one line per finished file (path, size, mtime and outcome)
+  annotated/      annotated copies when --annotate is given, mirroring the inputs
+
+Runs are resumable. A file already recorded as done in the manifest, with
+the same size and mtime, is skipped, so an interrupted or repeated run only
+processes what is new or changed. Rows of files that were not finished are
+dropped from the CSVs on the next start. --format parquet also converts the
+CSVs to Parquet at the end; this needs pyarrow.
+
+    python bulk_detect.py /data/orchard "/mnt/footage/**/*.mp4" --out results --workers 8
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import shutil
+import hashlib
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# Stage timers only matter inside the web app
+os.environ.setdefault('METRICS_ENABLED', '0')
+
+import cv2
+
+from apple_detection import APPLE_MIN_AREA, draw_detections, find_apples_in_bgr_image
+from tracking import KeyframeTracker, VideoCountSummary
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.m4v', '.wmv', '.mpg', '.mpeg')
+
+FILE_FIELDS = ('path', 'kind', 'status', 'width', 'height', 'frames', 'fps', 'count', 'unique_total',
+               'max_count', 'mean_count', 'seconds', 'error')
+FRAME_FIELDS = ('path', 'frame', 'seconds', 'count')
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+# -------- Input discovery --------
+
+def _kind(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in IMAGE_EXTENSIONS:
+        return 'image'
+    if ext in VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+
+def discover(inputs):
+    """[(absolute path, path relative to its input root, kind)] for every image/video under inputs."""
+    found = {}
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = (os.path.join(d, name) for d, _, names in os.walk(pattern) for name in names)
+        elif glob.has_magic(pattern):
+            # Relative paths start below the first wildcard
+            prefix = pattern[:min(pattern.find(c) for c in '*?[' if c in pattern)]
+            root = os.path.dirname(prefix) or '.'
+            paths = glob.iglob(pattern, recursive=True)
+        else:
+            root = os.path.dirname(pattern) or '.'
+            paths = [pattern]
+        for path in paths:
+            kind = _kind(path)
+            if kind is None or not os.path.isfile(path):
+                continue
+            absolute = os.path.abspath(path)
+            found.setdefault(absolute, (absolute, os.path.relpath(path, root), kind))
+    return sorted(found.values())
+
+
+def _identity(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+# -------- Work done in the pool --------
+
+def _init_worker():
+    # Parallelism comes from the processes; one OpenCV thread each avoids oversubscription
+    try:
+        cv2.setNumThreads(1)
+    except Exception:
+        pass
+
+
+def _annotated_path(annotate_dir, relative, ext=None):
+    base, original_ext = os.path.splitext(relative)
+    path = os.path.join(annotate_dir, base + (ext or original_ext))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _failed(path, kind, started, error):
+    return {"path": path, "kind": kind, "status": STATUS_FAILED, "seconds": round(time.perf_counter() - started, 3),
+            "error": error}, []
+
+
+def process_image(path, relative, min_area, annotate_dir):
+    """Count apples in one image. Returns (file row, frame rows)."""
+    started = time.perf_counter()
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None:
+        return _failed(path, 'image', started, "Cannot read image")
+    detections = find_apples_in_bgr_image(image, min_area)
+    if annotate_dir:
+        cv2.imwrite(_annotated_path(annotate_dir, relative), draw_detections(image, detections))
+    count = len(detections)
+    row = {"path": path, "kind": 'image', "status": STATUS_DONE, "width": image.shape[1], "height": image.shape[0],
+           "frames": 1, "count": count, "unique_total": count, "max_count": count, "mean_count": count,
+           "seconds": round(time.perf_counter() - started, 3)}
+    return row, [{"path": path, "frame": 0, "seconds": 0, "count": count}]
+
+
+def process_images(items, min_area, annotate_dir):
+    """One chunk of images: [(path, relative)] -> [(file row, frame rows)]."""
+    return [process_image(path, relative, min_area, annotate_dir) for path, relative in items]
+
+
+def _part_path(parts_dir, path):
+    return os.path.join(parts_dir, hashlib.sha1(path.encode('utf-8')).hexdigest() + '.csv')
+
+
+def process_video_file(path, relative, min_area, annotate_dir, parts_dir, detect_every=1):
+    """Count apples in every frame of one video and track unique apples across it.
+
+    Returns (file row, path of a CSV part file with the frame rows). The frame
+    rows are written to the part file as the video plays, so a long clip
+    neither holds them in memory nor sends them back through the pool.
+    With detect_every > 1 only keyframes run the detector and apples are
+    moved by optical flow in between, as in the app's streams.
+    """
+    started = time.perf_counter()
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        return _failed(path, 'video', started, "Cannot open video")
+    writer = None
+    part_path = _part_path(parts_dir, path)
+    part = open(part_path, 'w', newline='')
+    try:
+        frames_out = csv.DictWriter(part, FRAME_FIELDS)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if annotate_dir:
+            writer = cv2.VideoWriter(_annotated_path(annotate_dir, relative, '.mp4'),
+                                     cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+        summary = VideoCountSummary(fps)
+        keyframes = KeyframeTracker(detect_every, tracker=summary.tracker) if detect_every > 1 else None
+        max_count = 0
+        total_count = 0
+        index = 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if keyframes is not None:
+                detections = keyframes.update(frame, min_area=min_area, frame_index=index)
+                summary.observe(index, detections)
+            else:
+                detections = summary.update(index, find_apples_in_bgr_image(frame, min_area))
+            if writer is not None:
+                writer.write(draw_detections(frame, detections))
+            frames_out.writerow({"path": path, "frame": index, "seconds": round(index / fps, 3),
+                                 "count": len(detections)})
+            max_count = max(max_count, len(detections))
+            total_count += len(detections)
+            index += 1
+    finally:
+        cap.release()
+        part.close()
+        if writer is not None:
+            writer.release()
+    unique_total = summary.result()["unique_total"]
+    # A video's count is the apples tracked across it; per-frame counts are in frames.csv
+    row = {"path": path, "kind": 'video', "status": STATUS_DONE, "width": width, "height": height,
+           "frames": index, "fps": round(fps, 3), "count": unique_total,
+           "unique_total": unique_total, "max_count": max_count,
+           "mean_count": round(total_count / index, 3) if index else 0,
+           "seconds": round(time.perf_counter() - started, 3)}
+    return row, part_path
+
+
+def process_videos(items, min_area, annotate_dir, parts_dir, detect_every):
+    return [process_video_file(path, relative, min_area, annotate_dir, parts_dir, detect_every)
+            for path, relative in items]
+
+
+# -------- Output and manifest --------
+
+def read_manifest(path):
+    """{path: entry} of the latest line per file; a torn last line from a crash is ignored."""
+    entries = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[entry["path"]] = entry
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _keep_rows(csv_path, fields, keep):
+    """Rewrite csv_path with only the rows whose path is in keep (no-op when nothing would go)."""
+    if not os.path.exists(csv_path):
+        return
+    with open(csv_path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    kept = [row for row in rows if row["path"] in keep]
+    if len(kept) == len(rows):
+        return
+    staging = csv_path + '.tmp'
+    with open(staging, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(kept)
+    os.replace(staging, csv_path)
+
+
+class ResultWriter:
+    """Appends result rows to the CSVs, then marks the file done in the manifest."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.files_csv = os.path.join(out_dir, 'files.csv')
+        self.frames_csv = os.path.join(out_dir, 'frames.csv')
+        self.manifest = os.path.join(out_dir, 'manifest.jsonl')
+        self._handles = []
+
+    def prepare(self, done):
+        """Drop rows of files not in done (interrupted or changed since) before appending."""
+        _keep_rows(self.files_csv, FILE_FIELDS, done)
+        _keep_rows(self.frames_csv, FRAME_FIELDS, done)
+
+    def _open(self, path, fields):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        handle = open(path, 'a', newline='')
+        self._handles.append(handle)
+        writer = csv.DictWriter(handle, fields, extrasaction='ignore')
+        if new:
+            writer.writeheader()
+        return handle, writer
+
+    def __enter__(self):
+        self._files = self._open(self.files_csv, FILE_FIELDS)
+        self._frames = self._open(self.frames_csv, FRAME_FIELDS)
+        self._manifest = open(self.manifest, 'a')
+        self._handles.append(self._manifest)
+        return self
+
+    def __exit__(self, *exc):
+        for handle in self._handles:
+            handle.close()
+        return False
+
+    def write(self, row, frame_rows, identity):
+        """Record one file; frame_rows is a list of rows or the path of a worker's part file."""
+        # Rows reach the disk before the manifest line, so a crash never marks a file done without them
+        if isinstance(frame_rows, str):
+            with open(frame_rows, newline='') as part:
+                shutil.copyfileobj(part, self._frames[0])
+            os.remove(frame_rows)
+        else:
+            self._frames[1].writerows(frame_rows)
+        self._files[1].writerow(row)
+        self._frames[0].flush()
+        self._files[0].flush()
+        entry = dict(identity, path=row["path"], status=row["status"], count=row.get("unique_total"),
+                     error=row.get("error"), finished=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        self._manifest.write(json.dumps(entry) + '\n')
+        self._manifest.flush()
+        os.fsync(self._manifest.fileno())
+
+
+def write_parquet(out_dir):
+    """Convert files.csv and frames.csv to Parquet files beside them."""
+    from pyarrow import csv as pa_csv, parquet
+
+    for name in ('files', 'frames'):
+        source = os.path.join(out_dir, name + '.csv')
+        if os.path.exists(source):
+            parquet.write_table(pa_csv.read_csv(source), os.path.join(out_dir, name + '.parquet'))
+
+
+# -------- Command line --------
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='directories, files or glob patterns (quote ** patterns)')
+    parser.add_argument('--out', default='bulk_results', help='output directory (default: bulk_results)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=32, help='images per task')
+    parser.add_argument('--min-area', type=float, default=APPLE_MIN_AREA, help='smallest blob counted, in pixels')
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help='run the detector every Nth video frame and track apples in between')
+    parser.add_argument('--annotate', action='store_true', help='write annotated images and videos to OUT/annotated')
+    parser.add_argument('--format', choices=('csv', 'parquet'), default='csv')
+    parser.add_argument('--retry-failed', action='store_true', help='process files that failed last time again')
+    args = parser.parse_args(argv)
+    if args.format == 'parquet' and pyarrow is None:
+        parser.error('--format parquet needs pyarrow (pip install pyarrow)')
+
+    os.makedirs(args.out, exist_ok=True)
+    writer = ResultWriter(args.out)
+    manifest = read_manifest(writer.manifest)
+    annotate_dir = os.path.join(os.path.abspath(args.out), 'annotated') if args.annotate else None
+    # Workers stream video frame rows here; parts left by an interrupted run are stale
+    parts_dir = os.path.join(os.path.abspath(args.out), '.parts')
+    shutil.rmtree(parts_dir, ignore_errors=True)
+    os.makedirs(parts_dir)
+
+    images, videos, skipped, identities = [], [], 0, {}
+    for path, relative, kind in discover(args.inputs):
+        identity = identities[path] = _identity(path)
+        entry = manifest.get(path)
+        unchanged = entry is not None and entry["size"] == identity["size"] and entry["mtime_ns"] == identity["mtime_ns"]
+        if unchanged and (entry["status"] == STATUS_DONE or not args.retry_failed):
+            skipped += 1
+            continue
+        (images if kind == 'image' else videos).append((path, relative))
+    pending = {path for path, _ in images + videos}
+    writer.prepare({path for path in manifest if path not in pending})
+
+    # Largest videos first so the pool does not end on one long straggler
+    videos.sort(key=lambda item: identities[item[0]]["size"], reverse=True)
+    total = len(images) + len(videos)
+    print(f'{total} files to process, {skipped} already done', file=sys.stderr)
+    if not total:
+        os.rmdir(parts_dir)
+        if args.format == 'parquet':
+            write_parquet(args.out)
+        return 0
+
+    failed = 0
+    finished = 0
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker)
+    completed = False
+    try:
+        tasks = {pool.submit(process_videos, [item], args.min_area, annotate_dir, parts_dir,
+                             args.detect_every): ('video', [item])
+                 for item in videos}
+        tasks.update({pool.submit(process_images, chunk, args.min_area, annotate_dir): ('image', chunk)
+                      for chunk in _chunks(images, max(1, args.chunk_size))})
+        with writer:
+            for future in as_completed(tasks):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    # A crashed worker loses its whole task; record the files as failed for --retry-failed
+                    kind, items = tasks[future]
+                    error = str(e) or e.__class__.__name__
+                    results = [_failed(path, kind, time.perf_counter(), error) for path, _ in items]
+                for row, frame_rows in results:
+                    writer.write(row, frame_rows, identities[row["path"]])
+                    finished += 1
+                    failed += row["status"] != STATUS_DONE
+                    detail = row.get("error") or f'{row.get("unique_total")} apples'
+                    print(f'[{finished}/{total}] {row["path"]}: {detail} ({row["seconds"]}s)', file=sys.stderr)
+        completed = True
+    except KeyboardInterrupt:
+        print('Interrupted; finished files are kept in the manifest and skipped next time.', file=sys.stderr)
+        return 130
+    finally:
+        # After an interrupt or error, drop the queued tasks instead of waiting for them
+        pool.shutdown(wait=completed, cancel_futures=not completed)
+        if completed:
+            # Only parts of crashed video tasks are left
+            shutil.rmtree(parts_dir, ignore_errors=True)
+
+    if args.format == 'parquet':
+        write_parquet(args.out)
+    print(f'{finished} files in {time.perf_counter() - started:.1f}s, {failed} failed; results in {args.out}',
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
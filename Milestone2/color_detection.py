@@ -0,0 +1,264 @@
+import os
+import json
+import threading
+
+import cv2
+import numpy as np
+
+from apple_detection import APPLE_MIN_AREA
+from metrics import stage
+
+# Several fruit colour classes counted in one pass over the frame.
+#
+# Each profile is a named set of HSV boxes with its own kernel and minimum
+# area. Every box gets a bit (boxes of one profile that share S/V bounds
+# share a bit), and a three-channel table maps H, S and V to the bits whose
+# range they fall in, so one LUT plus two ANDs label every pixel with all
+# classes at once. The class masks are then stacked into one tall buffer, a
+# band per class, with spacer rows between bands. Classes with the same
+# kernel share one opening, one closing and one findContours call. The
+# spacer rows are set to what OpenCV assumes beyond the image edge before
+# each erode or dilate, so the results match running each class on its own.
+
+APPLE_COLOR_PROFILES = os.getenv('APPLE_COLOR_PROFILES', 'red')
+
+# Built-in profiles, selectable by name (e.g. APPLE_COLOR_PROFILES=red,yellow,green)
+PRESET_PROFILES = {
+    'red': {"ranges": [[[0, 100, 100], [10, 255, 255]], [[160, 100, 100], [180, 255, 255]]]},
+    'yellow': {"ranges": [[[20, 100, 100], [34, 255, 255]]]},
+    # Overlaps foliage; best on close-ups or with a larger min_area
+    'green': {"ranges": [[[35, 80, 60], [85, 255, 255]]]},
+}
+# Drawing colours (BGR) used in profile order unless a profile sets "draw"
+_PALETTE = ((0, 255, 0), (255, 0, 255), (255, 255, 0), (0, 165, 255), (255, 0, 0), (0, 255, 255))
+
+MAX_BITS = 16
+# What OpenCV assumes beyond the image edge for each operation; the spacers stand in for it
+_EDGE = {cv2.erode: 255, cv2.dilate: 0}
+
+
+def _hsv(value, name):
+    try:
+        h, s, v = (int(x) for x in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Profile {name} ranges need [h, s, v] bounds")
+    if not (0 <= h <= 255 and 0 <= s <= 255 and 0 <= v <= 255):
+        raise ValueError(f"Profile {name} has an HSV bound outside 0-255")
+    return h, s, v
+
+
+def parse_profiles(value):
+    """Colour profiles from preset names, JSON text, a JSON file path or a decoded list.
+
+    A profile is a preset name or {"name": ..., "ranges": [[[h, s, v], [h, s, v]], ...],
+    "kernel": 5, "min_area": 500, "draw": [b, g, r]}; a dict without ranges
+    extends the preset of the same name. Raises ValueError for anything else.
+    """
+    if isinstance(value, str):
+        text = value.strip()
+        if os.path.isfile(text):
+            with open(text) as f:
+                text = f.read()
+        if text.startswith(('[', '{')):
+            try:
+                value = json.loads(text)
+            except json.JSONDecodeError:
+                raise ValueError("Colour profiles must be valid JSON")
+        else:
+            value = [name.strip() for name in text.split(',') if name.strip()]
+    if isinstance(value, dict):
+        value = [value]
+    if not isinstance(value, list) or not value:
+        raise ValueError("Colour profiles must be a non-empty list")
+    profiles = []
+    for number, profile in enumerate(value, start=1):
+        if isinstance(profile, str):
+            profile = {"name": profile}
+        if not isinstance(profile, dict):
+            raise ValueError("Each colour profile must be a name or an object")
+        name = str(profile.get('name') or f'class{number}')
+        spec = dict(PRESET_PROFILES.get(name, {}), **profile)
+        if 'ranges' not in spec:
+            raise ValueError(f"Unknown colour profile: {name}")
+        ranges = []
+        for box in spec['ranges']:
+            try:
+                lower, upper = box
+            except (TypeError, ValueError):
+                raise ValueError(f"Profile {name} ranges need [lower, upper] pairs")
+            lower, upper = _hsv(lower, name), _hsv(upper, name)
+            if any(lo > hi for lo, hi in zip(lower, upper)):
+                raise ValueError(f"Profile {name} has a lower bound above its upper bound")
+            ranges.append((lower, upper))
+        if not ranges:
+            raise ValueError(f"Profile {name} needs at least one range")
+        try:
+            kernel = int(spec.get('kernel', 5))
+            min_area = float(spec.get('min_area', APPLE_MIN_AREA))
+        except (TypeError, ValueError):
+            raise ValueError(f"Profile {name} kernel and min_area must be numbers")
+        if not 1 <= kernel <= 31:
+            raise ValueError(f"Profile {name} kernel must be between 1 and 31")
+        draw = spec.get('draw') or _PALETTE[(number - 1) % len(_PALETTE)]
+        profiles.append({"name": name, "ranges": ranges, "kernel": kernel, "min_area": min_area,
+                         "draw": tuple(int(c) for c in draw)})
+    names = [p["name"] for p in profiles]
+    if len(set(names)) != len(names):
+        raise ValueError("Colour profile names must be unique")
+    return profiles
+
+
+class ColorDetector:
+    """Counts every colour profile in a frame with one HSV conversion and one label LUT.
+
+    Like AppleDetector, scratch buffers are kept per frame shape and the
+    instance is not thread-safe; use one per thread.
+    """
+
+    def __init__(self, profiles=None):
+        self.profiles = parse_profiles(APPLE_COLOR_PROFILES if profiles is None else profiles)
+        self.names = [p["name"] for p in self.profiles]
+        self._build_lut()
+        # Classes sharing a kernel share the stacked morphology and contour pass
+        self._groups = {}
+        for index, profile in enumerate(self.profiles):
+            self._groups.setdefault(profile["kernel"], []).append(index)
+        self._kernels = {size: np.ones((size, size), np.uint8) for size in self._groups}
+        self._shape = None
+
+    def _build_lut(self):
+        bits = {}  # (class index, S bounds, V bounds) -> bit number
+        for index, profile in enumerate(self.profiles):
+            for lower, upper in profile["ranges"]:
+                bits.setdefault((index, lower[1:], upper[1:]), len(bits))
+        if len(bits) > MAX_BITS:
+            raise ValueError(f"At most {MAX_BITS} distinct HSV boxes are supported")
+        dtype = np.uint8 if len(bits) <= 8 else np.uint16
+        lut = np.zeros((256, 3), dtype)
+        self._class_bits = [0] * len(self.profiles)
+        for index, profile in enumerate(self.profiles):
+            for lower, upper in profile["ranges"]:
+                bit = bits[(index, lower[1:], upper[1:])]
+                flag = dtype(1 << bit)
+                for channel in range(3):
+                    lut[lower[channel]:upper[channel] + 1, channel] |= flag
+                self._class_bits[index] |= 1 << bit
+        self._lut = lut.reshape(1, 256, 3)
+        self._dtype = dtype
+
+    def params(self):
+        """The settings that determine this detector's results (e.g. for result cache keys)."""
+        return [{"name": p["name"], "ranges": [list(map(list, r)) for r in p["ranges"]],
+                 "kernel": p["kernel"], "min_area": p["min_area"]} for p in self.profiles]
+
+    def _ensure_buffers(self, shape):
+        if shape == self._shape:
+            return
+        h, w = shape[:2]
+        self._hsv = np.empty((h, w, 3), np.uint8)
+        self._labels3 = np.empty((h, w, 3), self._dtype)
+        self._labels = np.empty((h, w), self._dtype)
+        self._channel = np.empty((h, w), self._dtype)
+        self._stacks = {}
+        for size, members in self._groups.items():
+            # Spacers at least as tall as the kernel keep bands from touching each other
+            pitch = h + size
+            stack = np.zeros((pitch * len(members) + size, w), np.uint8)
+            self._stacks[size] = (stack, np.empty_like(stack), pitch)
+        self._shape = shape
+
+    def labels(self, bgr_image):
+        """(h, w) array where bit b is set for pixels inside HSV box b. Reused by the next call."""
+        self._ensure_buffers(bgr_image.shape)
+        with stage('hsv'):
+            hsv = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2HSV, dst=self._hsv)
+        with stage('mask'):
+            cv2.LUT(hsv, self._lut, dst=self._labels3)
+            cv2.extractChannel(self._labels3, 0, dst=self._labels)
+            for channel in (1, 2):
+                cv2.extractChannel(self._labels3, channel, dst=self._channel)
+                cv2.bitwise_and(self._labels, self._channel, dst=self._labels)
+        return self._labels
+
+    def _spacers(self, stack, pitch, size, value):
+        h = self._shape[0]
+        stack[:size] = value
+        for top in range(size + h, stack.shape[0], pitch):
+            stack[top:top + size] = value
+
+    def _clean(self, size):
+        """Open then close every band of one kernel group, as morphologyEx would per mask."""
+        stack, scratch, pitch = self._stacks[size]
+        kernel = self._kernels[size]
+        for first, then in ((cv2.erode, cv2.dilate), (cv2.dilate, cv2.erode)):
+            self._spacers(stack, pitch, size, _EDGE[first])
+            first(stack, kernel, dst=scratch)
+            self._spacers(scratch, pitch, size, _EDGE[then])
+            then(scratch, kernel, dst=stack)
+        self._spacers(stack, pitch, size, 0)
+        return stack
+
+    def find(self, bgr_image):
+        """Detections (center, radius, area, bbox, label) for every class, in profile order."""
+        if bgr_image is None or bgr_image.size == 0:
+            return []
+        labels = self.labels(bgr_image)
+        h = self._shape[0]
+        found = {}
+        for size, members in self._groups.items():
+            stack, _, pitch = self._stacks[size]
+            with stage('mask'):
+                for band, index in enumerate(members):
+                    top = size + band * pitch
+                    cv2.bitwise_and(labels, self._class_bits[index], dst=self._channel)
+                    cv2.compare(self._channel, 0, cv2.CMP_GT, dst=stack[top:top + h])
+            with stage('morphology'):
+                self._clean(size)
+            with stage('contours'):
+                contours, _ = cv2.findContours(stack, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                for contour in contours:
+                    bx, by, bw, bh = cv2.boundingRect(contour)
+                    band = (by - size) // pitch
+                    profile = self.profiles[members[band]]
+                    area = cv2.contourArea(contour)
+                    if area <= profile["min_area"]:
+                        continue
+                    offset = size + band * pitch
+                    (x, y), radius = cv2.minEnclosingCircle(contour)
+                    found.setdefault(members[band], []).append({
+                        "center": [int(x), int(y) - offset],
+                        "radius": int(radius),
+                        "area": float(area),
+                        "bbox": [int(bx), int(by) - offset, int(bw), int(bh)],
+                        "label": profile["name"],
+                    })
+        return [det for index in range(len(self.profiles)) for det in found.get(index, [])]
+
+    def counts(self, detections):
+        """{class name: count} for detections from find(), including zero counts."""
+        counts = dict.fromkeys(self.names, 0)
+        for det in detections:
+            counts[det["label"]] += 1
+        return counts
+
+    def draw(self, bgr_image, detections):
+        """Circle each detection in its class colour and list the per-class counts."""
+        colors = {p["name"]: p["draw"] for p in self.profiles}
+        with stage('annotate'):
+            for det in detections:
+                cv2.circle(bgr_image, tuple(det["center"]), det["radius"], colors[det["label"]], 3)
+            for row, (name, count) in enumerate(self.counts(detections).items()):
+                cv2.putText(bgr_image, f"{name}: {count}", (10, 40 + 35 * row),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, colors[name], 3)
+        return bgr_image
+
+
+_local = threading.local()
+
+
+def get_color_detector() -> ColorDetector:
+    """Return this thread's detector for the APPLE_COLOR_PROFILES profiles."""
+    detector = getattr(_local, 'detector', None)
+    if detector is None:
+        detector = _local.detector = ColorDetector()
+    return detector
@@ -0,0 +1,833 @@
+from flask import request, session, url_for, jsonify, Response, stream_with_context
+import os
+import cv2
+import numpy as np
+import base64
+from werkzeug.utils import secure_filename
+import io
+import json
+import time
+import zipfile
+from concurrent.futures import wait, FIRST_COMPLETED
+from apple_detection import find_apples_in_bgr_image, draw_detections, detector_params, APPLE_MIN_AREA
+from color_detection import get_color_detector
+from video_jobs import VideoJobManager, JobQueueFull, JOB_DONE, run_people_video_job
+from uploads import (SessionVideoStore, UploadTooLarge, decode_image_upload,
+                     open_video_upload, hold_upload)
+from webcam_broadcast import CameraBroadcaster
+from stream_state import StreamRegistry
+from file_stream import FileStream
+from frame_channel import FrameChannel
+from tracking import KeyframeTracker, VideoCountSummary, APPLE_DETECT_EVERY
+from people_detection import BatchSizer, PeopleModelUnavailable, draw_people, get_people_detector
+from zones import ZoneLayout, OccupancyCounter
+from model_registry import get_registry
+from result_cache import cache_key, content_digest, get_result_cache, link_or_copy
+from metrics import QueuedExecutor, register_collector, stage
+
+# /apple/* and /people/* views. This module pulls in OpenCV, NumPy and the
+# detection stack, so app.py registers these views lazily (see LazyView there)
+# and it is only imported on the first detection request, or at startup when
+# DETECTION_PRELOAD=1.
+
+# -------- Apple Detection Helpers --------
+
+def _bgr_image_to_base64_png(bgr_image: np.ndarray) -> str:
+    with stage('encode'):
+        success, buf = cv2.imencode('.png', bgr_image)
+    if not success:
+        return ""
+    return base64.b64encode(buf.tobytes()).decode('utf-8')
+
+_IMAGE_FORMATS = {
+    'png': ('.png', 'image/png', None),
+    'jpeg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+    'jpg': ('.jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('.webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+_OPTION_KEYS = ('annotate', 'format', 'quality')
+
+def _encode_bgr_image_base64(bgr_image: np.ndarray, fmt='png', quality=None):
+    """Return (base64_str, mime) for bgr_image encoded as png, jpeg or webp."""
+    ext, mime, quality_flag = _IMAGE_FORMATS[fmt]
+    params = [quality_flag, quality] if quality_flag is not None and quality is not None else []
+    with stage('encode'):
+        success, buf = cv2.imencode(ext, bgr_image, params)
+    if not success:
+        return "", mime
+    return base64.b64encode(buf.tobytes()).decode('utf-8'), mime
+
+def _detection_options(annotate_default=True):
+    """Read annotate/format/quality from the query string, form or JSON body."""
+    data = {k: v for k, v in request.values.items() if k in _OPTION_KEYS}
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        data.update({k: v for k, v in body.items() if k in _OPTION_KEYS})
+    annotate = str(data.get('annotate', annotate_default)).lower() not in ('0', 'false', 'no')
+    fmt = str(data.get('format', 'png')).lower()
+    if fmt not in _IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    quality = data.get('quality')
+    if quality is not None and quality != '':
+        try:
+            quality = int(quality)
+        except (TypeError, ValueError):
+            quality = None
+        if quality is None or not 1 <= quality <= 100:
+            raise ValueError("quality must be an integer between 1 and 100")
+    else:
+        quality = None
+    return {"annotate": annotate, "fmt": fmt, "quality": quality}
+
+def _apple_result(bgr, annotate=True, fmt='png', quality=None, in_place=False):
+    """Count apples in bgr; only draw and encode an image when annotate is set."""
+    detections = find_apples_in_bgr_image(bgr)
+    result = {"count": len(detections), "detections": detections}
+    if annotate:
+        if bgr is None or bgr.size == 0:
+            result["image"] = ""
+        else:
+            annotated = draw_detections(bgr if in_place else bgr.copy(), detections)
+            result["image"], result["image_mime"] = _encode_bgr_image_base64(annotated, fmt, quality)
+    return result
+
+def _cached_json(kind, upload, compute, **params):
+    """JSON response for compute(), answered from the result cache when the same
+    upload (bytes, str or stream) was already seen with the same detector and params.
+
+    compute() returns a result dict, or an error response, which is not cached.
+    """
+    key = cache_key(kind, content_digest(upload), detector=detector_params(), **params)
+    cache = get_result_cache().memory
+    body = cache.get(key)
+    if body is not None:
+        return Response(body, mimetype='application/json', headers={'X-Cache': 'HIT'})
+    result = compute()
+    if not isinstance(result, dict):
+        return result
+    response = jsonify(result)
+    cache.put(key, response.get_data())
+    response.headers['X-Cache'] = 'MISS'
+    return response
+
+def _decode_data_url(data_url):
+    header, b64data = data_url.split(',', 1)
+    with stage('decode'):
+        img_bytes = base64.b64decode(b64data)
+        np_arr = np.frombuffer(img_bytes, np.uint8)
+        return cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+
+def _detect_every_option():
+    """Keyframe interval from detect_every (query/form/JSON); 1 means detect every frame."""
+    value = request.values.get('detect_every', type=int)
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('detect_every')
+    try:
+        value = int(value) if value is not None else APPLE_DETECT_EVERY
+    except (TypeError, ValueError):
+        value = APPLE_DETECT_EVERY
+    return min(max(value, 1), 300)
+
+# -------- Apple Detection Endpoints --------
+
+def apple_detect_image():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file = request.files.get('image')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No image uploaded"}), 400
+    return _cached_json('apple-image', file.stream,
+                        lambda: _apple_result(decode_image_upload(file), in_place=True, **options), **options)
+
+def apple_detect_webcam():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    data_url = request.json.get('image') if request.is_json else None
+    if not data_url:
+        return jsonify({"error": "No image data"}), 400
+    try:
+        bgr = _decode_data_url(data_url)
+    except Exception:
+        return jsonify({"error": "Invalid image data"}), 400
+    return jsonify(_apple_result(bgr, in_place=True, **options))
+
+def open_apple_frame_channel():
+    """(FrameChannel, None) for a /apple/ws connection (see asgi_app), or (None, error response)."""
+    if 'user' not in session:
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    try:
+        return FrameChannel.from_args(request.args), None
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+
+def apple_detect_video():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No video uploaded"}), 400
+
+    def compute():
+        # Only the first frame is needed; the upload is read in place, never copied to disk
+        with open_video_upload(file) as cap:
+            if not cap.isOpened():
+                return jsonify({"error": "Cannot open video"}), 400
+            ret, frame = cap.read()
+        if not ret:
+            return jsonify({"error": "Failed to read video"}), 400
+        return _apple_result(frame, in_place=True, **options)
+
+    return _cached_json('apple-video-frame', file.stream, compute, **options)
+
+# Lightweight count-only endpoint: multipart 'image' file or JSON data URL, no image back
+def apple_count():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    file = request.files.get('image')
+    if file is not None and file.filename != '':
+        upload, decode = file.stream, lambda: decode_image_upload(file)
+    elif request.is_json and request.json.get('image'):
+        upload = request.json['image']
+        decode = lambda: _decode_data_url(upload)
+    else:
+        return jsonify({"error": "No image uploaded"}), 400
+
+    def compute():
+        try:
+            bgr = decode()
+        except Exception:
+            bgr = None
+        if bgr is None:
+            return jsonify({"error": "Invalid image data"}), 400
+        return _apple_result(bgr, annotate=False)
+
+    return _cached_json('apple-count', upload, compute)
+
+# Per-class counts for the APPLE_COLOR_PROFILES colour profiles, all found in one pass
+def apple_detect_colors():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options(annotate_default=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file = request.files.get('image')
+    if file is not None and file.filename != '':
+        upload, decode = file.stream, lambda: decode_image_upload(file)
+    elif request.is_json and request.json.get('image'):
+        upload = request.json['image']
+        decode = lambda: _decode_data_url(upload)
+    else:
+        return jsonify({"error": "No image uploaded"}), 400
+    detector = get_color_detector()
+
+    def compute():
+        try:
+            bgr = decode()
+        except Exception:
+            bgr = None
+        if bgr is None:
+            return jsonify({"error": "Invalid image data"}), 400
+        detections = detector.find(bgr)
+        result = {"counts": detector.counts(detections), "total": len(detections), "detections": detections}
+        if options["annotate"]:
+            result["image"], result["image_mime"] = _encode_bgr_image_base64(
+                detector.draw(bgr, detections), options["fmt"], options["quality"])
+        return result
+
+    return _cached_json('apple-colors', upload, compute, profiles=detector.params(), **options)
+
+# -------- Batch Image Detection --------
+
+APPLE_BATCH_WORKERS = int(os.getenv('APPLE_BATCH_WORKERS', os.cpu_count() or 2))
+APPLE_BATCH_MAX_IMAGE_BYTES = int(os.getenv('APPLE_BATCH_MAX_IMAGE_BYTES', 50 * 1024 * 1024))
+_batch_pool = QueuedExecutor(max_workers=APPLE_BATCH_WORKERS, thread_name_prefix='apple-batch')
+
+def _iter_batch_uploads(uploads):
+    """Yield (name, bytes) for each uploaded image and each member of uploaded zips.
+
+    Nothing is read until it is asked for: zips are opened on the upload's
+    own (seekable) stream and members are inflated one at a time.
+    """
+    for filename, stream in uploads:
+        if filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(stream) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    if info.file_size > APPLE_BATCH_MAX_IMAGE_BYTES:
+                        yield info.filename, None
+                        continue
+                    yield info.filename, archive.read(info)
+        else:
+            yield filename, stream.read()
+
+def _batch_uploads():
+    """(filename, stream) for each 'images' and 'archive' file of a batch request.
+
+    Flask closes request files when the view returns, before a streamed
+    response is generated, so the streams (in memory or spooled to disk by
+    the upload handling) are taken over here and closed by _batch_response.
+    """
+    uploads = []
+    for f in request.files.getlist('images') + request.files.getlist('archive'):
+        if f is not None and f.filename != '':
+            uploads.append((f.filename, f.stream))
+            f.stream = io.BytesIO()
+    return uploads
+
+def _batch_error(index, name, error):
+    return {"index": index, "name": name, "error": error}
+
+def _run_batch(detect, batch):
+    """Decode batch [(index, name, data)] and run detect on the readable images; a result per item."""
+    results = []
+    images = []
+    for index, name, data in batch:
+        bgr = None
+        if data is not None:
+            with stage('decode'):
+                bgr = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            results.append(_batch_error(index, name, "Image too large" if data is None else "Invalid image data"))
+        else:
+            images.append((index, name, bgr))
+    if images:
+        try:
+            results.extend(detect(images))
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            results.extend(_batch_error(index, name, error) for index, name, _ in images)
+    results.sort(key=lambda result: result["index"])
+    return results
+
+def _batch_response(uploads, detect, batch_size=lambda: 1, window=APPLE_BATCH_WORKERS * 2):
+    """Stream detect's results for every image in uploads as NDJSON, ending with a totals line.
+
+    detect([(index, name, bgr), ...]) returns one result dict per image. Up to
+    window batches of batch_size() images are decoded and detected at once on
+    the batch pool, so zips of any size stay bounded.
+    """
+    def generate():
+        items = enumerate(_iter_batch_uploads(uploads))
+        pending = {}  # future -> batch
+        exhausted = False
+        images = 0
+        total = 0
+        try:
+            while True:
+                while not exhausted and len(pending) < window:
+                    batch = []
+                    try:
+                        while len(batch) < batch_size():
+                            index, (name, data) = next(items)
+                            batch.append((index, name, data))
+                    except StopIteration:
+                        exhausted = True
+                    except zipfile.BadZipFile:
+                        exhausted = True
+                        yield json.dumps({"error": "Invalid zip archive"}) + "\n"
+                    if batch:
+                        pending[_batch_pool.submit(_run_batch, detect, batch)] = batch
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:
+                        error = str(e) or e.__class__.__name__
+                        results = [_batch_error(index, name, error) for index, name, _ in batch]
+                    for result in results:
+                        images += 1
+                        total += result.get("count", 0)
+                        yield json.dumps(result) + "\n"
+        finally:
+            # The client may stop reading mid-stream; don't leave its images queued
+            for future in pending:
+                future.cancel()
+            for _, stream in uploads:
+                stream.close()
+        yield json.dumps({"done": True, "images": images, "total_count": total}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def apple_detect_batch():
+    """Detect apples in many images ('images' files and/or zip 'archive'), streamed as NDJSON."""
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options(annotate_default=False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    uploads = _batch_uploads()
+    if not uploads:
+        return jsonify({"error": "No images uploaded"}), 400
+
+    def detect(images):
+        return [{"index": index, "name": name, **_apple_result(bgr, in_place=True, **options)}
+                for index, name, bgr in images]
+
+    return _batch_response(uploads, detect)
+
+_video_jobs = VideoJobManager()
+
+
+def _collect_queue_metrics():
+    jobs = _video_jobs.queue_stats()
+    return [
+        ('video_jobs_active', 'gauge', 'Video jobs queued or running.', [({}, jobs["active"])]),
+        ('video_jobs_max_pending', 'gauge', 'Video jobs accepted before new ones are refused.', [({}, jobs["max_pending"])]),
+        ('executor_queue_depth', 'gauge', 'Work items waiting for a pool thread.',
+         [({"pool": "apple_batch"}, _batch_pool.queue_depth())]),
+    ]
+
+
+register_collector(_collect_queue_metrics)
+
+def _video_job_response(job):
+    data = job.snapshot()
+    if data["status"] == JOB_DONE:
+        data["video_url"] = url_for('static', filename=f'outputs/{job.output_name}', _external=False)
+    return data
+
+def apple_process_video():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No video uploaded"}), 400
+    filename = secure_filename(file.filename)
+    output_dir = os.path.join('static', 'outputs')
+    base_name = os.path.splitext(filename)[0]
+    detect_every = _detect_every_option()
+
+    os.makedirs(output_dir, exist_ok=True)
+    # The same clip with the same settings is answered from the disk cache as an already finished job
+    key = cache_key('apple-process-video', content_digest(file.stream), detector=detector_params(),
+                    detect_every=detect_every)
+    cache = get_result_cache().disk
+    cached = cache.get(key)
+    if cached is not None:
+        path, stored = cached
+        try:
+            job = _video_jobs.add_finished(session.get('user'), output_dir, base_name,
+                                           lambda output_path: link_or_copy(path, output_path),
+                                           stored["summary"], stored["frames"])
+        except OSError:
+            # Evicted between the lookup and the link: process the upload as a miss
+            job = None
+    if cached is not None and job is not None:
+        return jsonify({
+            "job_id": job.job_id,
+            "status_url": url_for('apple_video_job_status', job_id=job.job_id),
+            "cached": True,
+        }), 202
+
+    def store(job):
+        frames = job.snapshot()["frames_done"]
+        cache.put(key, job.output_path, {"summary": job.summary, "frames": frames})
+
+    # The job holds the upload (in memory when possible) and releases it when processing ends
+    input_path, release_input = hold_upload(file, filename)
+    try:
+        job = _video_jobs.submit(session.get('user'), input_path, release_input, output_dir, base_name,
+                                 on_done=store, detect_every=detect_every)
+    except JobQueueFull:
+        release_input()
+        return jsonify({"error": "Too many videos processing. Try again later."}), 503
+
+    return jsonify({
+        "job_id": job.job_id,
+        "status_url": url_for('apple_video_job_status', job_id=job.job_id),
+    }), 202
+
+def apple_cache_stats():
+    """Hit/miss counts and sizes of the detection result cache in this process."""
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return jsonify(get_result_cache().stats())
+
+def apple_video_job_status(job_id):
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    job = _video_jobs.get(job_id, session.get('user'))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(_video_job_response(job))
+
+def apple_video_job_cancel(job_id):
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    job = _video_jobs.get(job_id, session.get('user'))
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    if not _video_jobs.cancel(job):
+        return jsonify({"error": "Job already finished"}), 409
+    return jsonify(_video_job_response(job))
+
+# -------- Apple Webcam Live Stream (start/stop) --------
+
+_webcam = CameraBroadcaster(0, size=(300, 200))
+_session_videos = SessionVideoStore()
+_streams = StreamRegistry()
+
+def _snapshot_response(snap, summary=None):
+    """JSON for a StreamState snapshot, honouring an optional ?frame=N."""
+    if snap is None:
+        return jsonify({"error": "No frame available"}), 400
+    index, frame, count = snap
+    if frame is None or not isinstance(frame, np.ndarray) or frame.size == 0:
+        return jsonify({"error": "No frame available"}), 400
+    b64 = _bgr_image_to_base64_png(frame)
+    payload = {"image": b64, "count": count, "frame": index}
+    if summary is not None:
+        payload["unique_count"] = summary.unique_total
+    return jsonify(payload)
+
+def apple_stream_webcam_start():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    # start() releases any existing handle before opening a new one
+    if not _webcam.start(detect_every=_detect_every_option()):
+        return jsonify({"error": "Cannot open webcam"}), 400
+    return jsonify({"status": "started"})
+
+# The open_*_stream functions check a feed request and return (source, None) or
+# (None, error response). A source has frames() for Flask and aframes() for asgi_app.
+
+_MJPEG_MIMETYPE = 'multipart/x-mixed-replace; boundary=frame'
+
+def _mjpeg_response(opened):
+    source, error = opened
+    if error is not None:
+        return error
+    return Response(source.frames(), mimetype=_MJPEG_MIMETYPE)
+
+def open_apple_webcam_stream():
+    if 'user' not in session:
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    # Viewers only read the shared broadcast; the camera thread does all capture and detection
+    return _webcam, None
+
+def apple_stream_webcam_feed():
+    return _mjpeg_response(open_apple_webcam_stream())
+
+def apple_stream_webcam_stop():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    _webcam.stop()
+    return jsonify({"status": "stopped"})
+
+# Aliases matching the sample-style endpoints
+def apple_webcam_start_alias():
+    return apple_stream_webcam_start()
+
+def apple_video_feed_alias():
+    return _mjpeg_response(open_apple_webcam_stream())
+
+def apple_webcam_stop_alias():
+    return apple_stream_webcam_stop()
+
+# Force reset route in case of stuck camera
+def apple_webcam_reset():
+    return apple_stream_webcam_stop()
+
+def apple_webcam_snapshot():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    return _snapshot_response(_webcam.snapshot(request.args.get('frame', type=int)))
+
+# -------- Video file streaming with cv2 (start/stop + feed) --------
+
+def apple_video_start():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No video uploaded"}), 400
+    filename = secure_filename(file.filename)
+    # Store per-session video; the store's reaper removes it if stop is never called
+    try:
+        _session_videos.put(session.get('user'), file, filename)
+    except UploadTooLarge:
+        return jsonify({"error": "Video too large"}), 413
+    _streams.get(('file', session.get('user'))).reset()
+    return jsonify({"status": "ready"})
+
+class _AppleFileStream(FileStream):
+    metrics_name = 'apple_file'
+
+    def __init__(self, path, state, detect_every=1):
+        # Plays at the file's own FPS and trades resolution/quality for latency as needed
+        super().__init__(path, state, (640, 360))
+        # Apples keep one ID across frames, so the summary counts each only once
+        self.summary = VideoCountSummary(self.fps)
+        self.tracker = KeyframeTracker(detect_every, tracker=self.summary.tracker)
+        if self.opened:
+            state.summary = self.summary
+
+    def annotate(self, frame, frame_index):
+        try:
+            frame = cv2.resize(frame, self.governor.size)
+        except Exception:
+            pass
+        detections = self.tracker.update(frame, min_area=APPLE_MIN_AREA * self.governor.area_scale(),
+                                         frame_index=frame_index)
+        self.summary.observe(frame_index, detections)
+        # annotated is a fresh array each frame, so the snapshot ring keeps it without copying
+        return draw_detections(frame, detections), len(detections)
+
+def open_apple_video_stream():
+    if 'user' not in session:
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    path = _session_videos.get(session.get('user'))
+    if not path or not os.path.exists(path):
+        return None, (jsonify({"error": "No video prepared"}), 400)
+    state = _streams.get(('file', session.get('user')))
+    return _AppleFileStream(path, state, _detect_every_option()), None
+
+def apple_video_feed_file():
+    return _mjpeg_response(open_apple_video_stream())
+
+def apple_video_stop():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    _session_videos.pop(session.get('user'))
+    _streams.discard(('file', session.get('user')))
+    return jsonify({"status": "stopped"})
+
+def apple_video_snapshot():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    state = _streams.get(('file', session.get('user')), create=False)
+    if state is None:
+        return jsonify({"error": "No frame available"}), 400
+    return _snapshot_response(state.snapshot(request.args.get('frame', type=int)), state.summary)
+
+def apple_video_summary():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    state = _streams.get(('file', session.get('user')), create=False)
+    if state is None or state.summary is None:
+        return jsonify({"error": "No video streamed"}), 400
+    # Tracks still on screen are included with their last frame so far
+    return jsonify(state.summary.result(finish=False))
+
+# -------- People Counting (YOLO) --------
+# The model is loaded once per process on first use and stays warm; zones and
+# counting lines are JSON (see zones.parse_zones/parse_lines) in source-frame
+# pixel coordinates.
+
+def _zone_layout_option():
+    values = {key: request.values.get(key) for key in ('zones', 'lines')}
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        values = {key: value if value is not None else body.get(key) for key, value in values.items()}
+    return ZoneLayout.parse(**values)
+
+def _people_result(detector, bgr, layout, annotate=True, fmt='png', quality=None):
+    result = detector.count_batch([bgr], layout)[0]
+    if annotate:
+        result["image"], result["image_mime"] = _encode_bgr_image_base64(draw_people(bgr, result, layout), fmt, quality)
+    return result
+
+def people_detect_image():
+    """Count people in one image: multipart 'image' file or JSON data URL."""
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options()
+        layout = _zone_layout_option()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file = request.files.get('image')
+    try:
+        if file is not None and file.filename != '':
+            bgr = decode_image_upload(file)
+        elif request.is_json and request.json.get('image'):
+            bgr = _decode_data_url(request.json['image'])
+        else:
+            return jsonify({"error": "No image uploaded"}), 400
+    except Exception:
+        return jsonify({"error": "Invalid image data"}), 400
+    if bgr is None:
+        return jsonify({"error": "Invalid image data"}), 400
+    try:
+        detector = get_people_detector()
+    except PeopleModelUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(_people_result(detector, bgr, layout, **options))
+
+def people_detect_batch():
+    """Count people in many images ('images' files and/or zip 'archive'), streamed as NDJSON.
+
+    Images are sent to the model in batches sized to PEOPLE_BATCH_LATENCY_MS.
+    """
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        options = _detection_options(annotate_default=False)
+        layout = _zone_layout_option()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        detector = get_people_detector()
+    except PeopleModelUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    uploads = _batch_uploads()
+    if not uploads:
+        return jsonify({"error": "No images uploaded"}), 400
+    sizer = BatchSizer()
+
+    def detect(images):
+        started = time.perf_counter()
+        counts = detector.count_batch([bgr for _, _, bgr in images], layout)
+        sizer.record(time.perf_counter() - started)
+        results = []
+        for (index, name, bgr), result in zip(images, counts):
+            result = dict(result, index=index, name=name)
+            if options["annotate"]:
+                result["image"], result["image_mime"] = _encode_bgr_image_base64(
+                    draw_people(bgr, result, layout), options["fmt"], options["quality"])
+            results.append(result)
+        return results
+
+    # One batch at a time, so the sizer times each batch on its own
+    return _batch_response(uploads, detect, batch_size=lambda: sizer.size, window=1)
+
+def people_process_video():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    try:
+        layout = _zone_layout_option()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No video uploaded"}), 400
+    filename = secure_filename(file.filename)
+
+    os.makedirs(os.path.join('static', 'outputs'), exist_ok=True)
+    input_path, release_input = hold_upload(file, filename)
+    try:
+        job = _video_jobs.submit(session.get('user'), input_path, release_input,
+                                 os.path.join('static', 'outputs'), os.path.splitext(filename)[0] + '_people',
+                                 task=run_people_video_job, zones=layout.zones, lines=layout.lines)
+    except JobQueueFull:
+        release_input()
+        return jsonify({"error": "Too many videos processing. Try again later."}), 503
+
+    return jsonify({
+        "job_id": job.job_id,
+        "status_url": url_for('people_video_job_status', job_id=job.job_id),
+    }), 202
+
+def people_video_job_status(job_id):
+    return apple_video_job_status(job_id)
+
+def people_video_job_cancel(job_id):
+    return apple_video_job_cancel(job_id)
+
+def people_video_start():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    file = request.files.get('video')
+    if file is None or file.filename == '':
+        return jsonify({"error": "No video uploaded"}), 400
+    filename = secure_filename(file.filename)
+    try:
+        _session_videos.put(('people', session.get('user')), file, filename)
+    except UploadTooLarge:
+        return jsonify({"error": "Video too large"}), 413
+    _streams.get(('people', session.get('user'))).reset()
+    return jsonify({"status": "ready"})
+
+class _PeopleFileStream(FileStream):
+    metrics_name = 'people_file'
+
+    def __init__(self, path, state, detector, layout):
+        # Paced like the apple stream; frames keep their size so zone coordinates stay valid
+        super().__init__(path, state)
+        self.detector = detector
+        self.layout = layout
+        # Tracks people across frames for dwell time and line crossings; kept on the state for /occupancy
+        self.occupancy = OccupancyCounter(layout, self.fps)
+        if self.opened:
+            state.summary = self.occupancy
+
+    def annotate(self, frame, frame_index):
+        result = self.detector.count_batch([frame], self.layout)[0]
+        ids, _ = self.occupancy.update([d["bbox"] for d in result["detections"]], frame.shape, frame_index)
+        for det, track_id in zip(result["detections"], ids):
+            det["id"] = track_id
+        return draw_people(frame, result, self.layout), result["count"]
+
+def open_people_video_stream():
+    if 'user' not in session:
+        return None, (jsonify({"error": "Unauthorized"}), 401)
+    try:
+        layout = _zone_layout_option()
+    except ValueError as e:
+        return None, (jsonify({"error": str(e)}), 400)
+    path = _session_videos.get(('people', session.get('user')))
+    if not path or not os.path.exists(path):
+        return None, (jsonify({"error": "No video prepared"}), 400)
+    try:
+        detector = get_people_detector()
+    except PeopleModelUnavailable as e:
+        return None, (jsonify({"error": str(e)}), 503)
+    state = _streams.get(('people', session.get('user')))
+    return _PeopleFileStream(path, state, detector, layout), None
+
+def people_video_feed_file():
+    return _mjpeg_response(open_people_video_stream())
+
+def people_video_stop():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    _session_videos.pop(('people', session.get('user')))
+    _streams.discard(('people', session.get('user')))
+    return jsonify({"status": "stopped"})
+
+def people_video_snapshot():
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    state = _streams.get(('people', session.get('user')), create=False)
+    if state is None:
+        return jsonify({"error": "No frame available"}), 400
+    return _snapshot_response(state.snapshot(request.args.get('frame', type=int)))
+
+def people_models():
+    """Model backend configuration and per-backend inference latency in this process."""
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    registry = get_registry()
+    return jsonify({
+        "backend": registry.backend,
+        "threads": registry.threads,
+        "pool_size": registry.pool_size,
+        "latency": registry.stats(),
+    })
+
+def people_video_occupancy():
+    """Per-zone occupancy, visits and dwell time plus line in/out counts for the current stream."""
+    if 'user' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    state = _streams.get(('people', session.get('user')), create=False)
+    if state is None or state.summary is None:
+        return jsonify({"error": "No video streamed"}), 400
+    return jsonify(state.summary.result())
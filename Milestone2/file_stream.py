@@ -0,0 +1,108 @@
+import time
+import asyncio
+import threading
+
+import cv2
+
+from stream_governor import StreamGovernor
+from metrics import STREAM_DROPPED, STREAM_FRAMES, STREAMS_ACTIVE, stage
+
+# Paced MJPEG playback of an uploaded video file.
+#
+# next_part() does the blocking work for one frame (skip ahead to real time,
+# decode, annotate, record the snapshot, JPEG-encode) and returns its
+# multipart chunk; pacing and sending are left to the caller. frames() is the
+# generator Flask streams from a worker thread. aframes() is the async
+# generator the ASGI app streams from: it runs next_part() on an executor and
+# awaits the pacing delay, so a viewer between frames costs no thread.
+
+MJPEG_PART = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+
+
+class FileStream:
+    """One viewer's playback of a video file. Subclasses implement annotate()."""
+
+    # Label of this stream's frames/drops/viewers in /metrics
+    metrics_name = 'file'
+
+    def __init__(self, path, state, base_size=(0, 0)):
+        self.cap = cv2.VideoCapture(path)
+        self.opened = self.cap.isOpened()
+        self.fps = (self.cap.get(cv2.CAP_PROP_FPS) or None) if self.opened else None
+        self.state = state
+        self.governor = StreamGovernor(base_size, source_fps=self.fps)
+        self.frame_index = -1
+        self._lock = threading.Lock()
+
+    def annotate(self, frame, frame_index):
+        """Return (annotated_bgr, count) for a decoded frame; the array is handed to the snapshot ring."""
+        raise NotImplementedError
+
+    def next_part(self):
+        """Decode, annotate and encode the next due frame. Returns its MJPEG part, or None at the end."""
+        governor = self.governor
+        with self._lock:
+            while self.cap.isOpened():
+                skip = governor.frames_to_skip()
+                for _ in range(skip):
+                    if not self.cap.grab():
+                        break
+                governor.consumed(skip)
+                STREAM_DROPPED.inc(self.metrics_name, skip)
+                started = time.perf_counter()
+                with stage('decode'):
+                    ret, frame = self.cap.read()
+                if not ret:
+                    return None
+                governor.consumed()
+                self.frame_index += skip + 1
+                annotated, count = self.annotate(frame, self.frame_index)
+                self.state.record(annotated, count)
+                with stage('encode'):
+                    success, buf = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, governor.quality])
+                governor.processed(time.perf_counter() - started)
+                if success:
+                    STREAM_FRAMES.inc(self.metrics_name)
+                    return MJPEG_PART + buf.tobytes() + b"\r\n"
+            return None
+
+    def close(self):
+        with self._lock:
+            self.cap.release()
+
+    def frames(self):
+        """Yield MJPEG parts in real time, sleeping between frames."""
+        STREAMS_ACTIVE.add(self.metrics_name, 1)
+        try:
+            while True:
+                part = self.next_part()
+                if part is None:
+                    break
+                sending = time.perf_counter()
+                yield part
+                self.governor.sent(time.perf_counter() - sending)
+                self.governor.wait()
+        finally:
+            STREAMS_ACTIVE.add(self.metrics_name, -1)
+            self.close()
+
+    async def aframes(self, executor=None):
+        """frames() as an async generator; the per-frame work runs on executor."""
+        loop = asyncio.get_running_loop()
+        STREAMS_ACTIVE.add(self.metrics_name, 1)
+        try:
+            while True:
+                part = await loop.run_in_executor(executor, self.next_part)
+                if part is None:
+                    break
+                sending = time.perf_counter()
+                yield part
+                self.governor.sent(time.perf_counter() - sending)
+                delay = self.governor.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.governor.emitted()
+        finally:
+            STREAMS_ACTIVE.add(self.metrics_name, -1)
+            # A cancelled viewer may leave next_part() running; close() waits for it on the executor
+            loop.run_in_executor(executor, self.close)
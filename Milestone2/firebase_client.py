@@ -0,0 +1,174 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+
+from firebase_config import firebase_config
+from metrics import register_collector
+
+# Firebase Identity Toolkit client over one pooled, keep-alive HTTP session.
+#
+# Every auth call goes through a shared requests.Session, so logins reuse warm
+# TLS connections instead of handshaking per request. Calls have connect/read
+# timeouts and are retried with jittered exponential backoff: 429s and failures
+# to connect always, 5xx responses and dropped connections only for idempotent
+# calls (sign-in, lookup), since a signUp or sendOobCode may already have taken
+# effect upstream. Per-call latency is kept for stats().
+# requests is imported when the client is first created, not at app import.
+
+FIREBASE_CONNECT_TIMEOUT = float(os.getenv('FIREBASE_CONNECT_TIMEOUT', 3.05))
+FIREBASE_READ_TIMEOUT = float(os.getenv('FIREBASE_READ_TIMEOUT', 10))
+FIREBASE_RETRIES = int(os.getenv('FIREBASE_RETRIES', 2))
+FIREBASE_BACKOFF_SECONDS = float(os.getenv('FIREBASE_BACKOFF_SECONDS', 0.2))
+FIREBASE_POOL_SIZE = int(os.getenv('FIREBASE_POOL_SIZE', 20))
+
+_IDENTITY_URL = 'https://identitytoolkit.googleapis.com/v1/accounts:'
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+# Rejected before any work is done, so safe to retry for every call
+_RETRY_STATUS_ANY_CALL = {429}
+# Recent latencies kept per call for stats()
+_LATENCY_HISTORY = 512
+
+
+class IdentityClient:
+    """The subset of pyrebase's Auth API the app uses, on a pooled session.
+
+    Failed calls raise requests.exceptions.HTTPError with .response set, so
+    callers can read Firebase's error code from the JSON body.
+    """
+
+    def __init__(self, api_key, connect_timeout=FIREBASE_CONNECT_TIMEOUT, read_timeout=FIREBASE_READ_TIMEOUT,
+                 retries=FIREBASE_RETRIES, backoff=FIREBASE_BACKOFF_SECONDS, pool_size=FIREBASE_POOL_SIZE):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+        self.api_key = api_key
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self._connection_error = requests.exceptions.ConnectionError
+        self._connect_timeout = requests.exceptions.ConnectTimeout
+        self._connect_reasons = (ConnectTimeoutError, NewConnectionError)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _never_sent(self, error):
+        """True if a ConnectionError happened while connecting, before the request went out."""
+        if isinstance(error, self._connect_timeout):
+            return True
+        # requests wraps urllib3's MaxRetryError, whose reason is the underlying failure
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, self._connect_reasons)
+
+    def _post(self, method, payload, idempotent=False):
+        """POST to an Identity Toolkit method, retrying what is safe to repeat.
+
+        Non-idempotent calls are retried only on 429 and on failures to
+        connect; idempotent ones also on 5xx and dropped connections.
+        """
+        url = f'{_IDENTITY_URL}{method}?key={self.api_key}'
+        retry_status = _RETRY_STATUS if idempotent else _RETRY_STATUS_ANY_CALL
+        started = time.perf_counter()
+        attempt = 0
+        failed = True
+        try:
+            while True:
+                try:
+                    response = self.session.post(url, json=payload, timeout=self.timeout)
+                except self._connection_error as e:
+                    # Read timeouts are not caught: the call may already have been applied upstream
+                    if attempt >= self.retries or not (idempotent or self._never_sent(e)):
+                        raise
+                else:
+                    if response.status_code not in retry_status or attempt >= self.retries:
+                        response.raise_for_status()
+                        failed = False
+                        return response.json()
+                attempt += 1
+                # Full jitter: sleep anywhere up to the exponential step
+                time.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+        finally:
+            self._record(method, time.perf_counter() - started, attempt, failed)
+
+    def _record(self, method, seconds, retries, failed=False):
+        with self._lock:
+            stats = self._stats.get(method)
+            if stats is None:
+                stats = self._stats[method] = {"calls": 0, "errors": 0, "retries": 0,
+                                               "recent": deque(maxlen=_LATENCY_HISTORY)}
+            stats["calls"] += 1
+            stats["errors"] += failed
+            stats["retries"] += retries
+            stats["recent"].append(seconds)
+
+    def sign_in_with_email_and_password(self, email, password):
+        return self._post('signInWithPassword', {"email": email, "password": password, "returnSecureToken": True},
+                          idempotent=True)
+
+    def create_user_with_email_and_password(self, email, password):
+        return self._post('signUp', {"email": email, "password": password, "returnSecureToken": True})
+
+    def get_account_info(self, id_token):
+        return self._post('lookup', {"idToken": id_token}, idempotent=True)
+
+    def send_email_verification(self, id_token):
+        return self._post('sendOobCode', {"requestType": "VERIFY_EMAIL", "idToken": id_token})
+
+    def send_password_reset_email(self, email):
+        return self._post('sendOobCode', {"requestType": "PASSWORD_RESET", "email": email})
+
+    def stats(self):
+        """{call: {calls, errors, retries, p50_ms, p95_ms, max_ms}} over recent calls."""
+        with self._lock:
+            snapshot = {method: dict(s, recent=sorted(s["recent"])) for method, s in self._stats.items()}
+        report = {}
+        for method, s in snapshot.items():
+            recent = s["recent"]
+            report[method] = {
+                "calls": s["calls"],
+                "errors": s["errors"],
+                "retries": s["retries"],
+                "p50_ms": round(recent[len(recent) // 2] * 1000, 1) if recent else 0.0,
+                "p95_ms": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)] * 1000, 1) if recent else 0.0,
+                "max_ms": round(recent[-1] * 1000, 1) if recent else 0.0,
+            }
+        return report
+
+
+_auth = None
+_lock = threading.Lock()
+
+
+def get_auth():
+    """The shared IdentityClient, created on first call."""
+    global _auth
+    if _auth is None:
+        with _lock:
+            if _auth is None:
+                _auth = IdentityClient(firebase_config['apiKey'])
+    return _auth
+
+
+def _collect_metrics():
+    if _auth is None:
+        return []
+    stats = _auth.stats()
+    return [
+        ('firebase_calls_total', 'counter', 'Identity Toolkit calls per method.',
+         [({"method": m}, s["calls"]) for m, s in stats.items()]),
+        ('firebase_errors_total', 'counter', 'Identity Toolkit calls that failed, per method.',
+         [({"method": m}, s["errors"]) for m, s in stats.items()]),
+        ('firebase_retries_total', 'counter', 'Identity Toolkit retries per method.',
+         [({"method": m}, s["retries"]) for m, s in stats.items()]),
+        ('firebase_call_seconds', 'summary', 'Seconds per Identity Toolkit call over recent calls.',
+         [({"method": m, "quantile": q}, s[key] / 1000) for m, s in stats.items()
+          for q, key in ((0.5, "p50_ms"), (0.95, "p95_ms"))]),
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+
+import cv2
+import numpy as np
+
+from apple_detection import AppleDetector, draw_detections
+from metrics import stage
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary webcam frame channel, served as the /apple/ws WebSocket by asgi_app.py.
+#
+# The browser sends each frame as a binary message holding the raw JPEG
+# bytes, rather than a base64 data URL inside JSON. Each frame gets one
+# reply: a msgpack map {seq, count, boxes, size, dropped, ms[, image]}. The
+# reply is JSON text instead when msgpack is not installed or the client
+# connects with ?encoding=json; the annotated JPEG then follows as its own
+# binary message. Boxes are [x, y, w, h], and the image is only encoded for
+# ?annotate=1. A text message {"annotate": bool, "quality": int} changes the
+# options mid-stream. Each connection owns one detector, so the HSV and mask
+# scratch buffers are reused for every frame of the same size.
+
+WS_MAX_FRAME_BYTES = int(os.getenv('WS_MAX_FRAME_BYTES', 4 * 1024 * 1024))
+WS_JPEG_QUALITY = int(os.getenv('WS_JPEG_QUALITY', 80))
+
+ENCODINGS = ('msgpack', 'json')
+
+
+def _flag(value):
+    return str(value).lower() not in ('0', 'false', 'no')
+
+
+class FrameChannel:
+    """One WebSocket connection's options, detector and frame counters.
+
+    process() is called for one frame at a time (the socket handler never
+    overlaps them), so the private detector needs no locking.
+    """
+
+    def __init__(self, encoding=None, annotate=False, quality=WS_JPEG_QUALITY):
+        encoding = encoding or ('msgpack' if msgpack is not None else 'json')
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        if encoding == 'msgpack' and msgpack is None:
+            raise ValueError("msgpack is not installed on the server; use encoding=json")
+        self.encoding = encoding
+        self.annotate = False
+        self.quality = WS_JPEG_QUALITY
+        self.configure({"annotate": annotate, "quality": quality})
+        self.detector = AppleDetector()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_args(cls, args):
+        """Build from request query arguments (encoding, annotate, quality); raises ValueError."""
+        return cls(args.get('encoding') or None, _flag(args.get('annotate', '0')),
+                   args.get('quality', WS_JPEG_QUALITY))
+
+    def configure(self, options):
+        """Apply {"annotate": ..., "quality": ...} from the client; raises ValueError."""
+        if not isinstance(options, dict):
+            raise ValueError("Options must be a JSON object")
+        if 'annotate' in options:
+            self.annotate = _flag(options['annotate'])
+        if 'quality' in options:
+            try:
+                quality = int(options['quality'])
+            except (TypeError, ValueError):
+                raise ValueError("quality must be an integer")
+            if not 1 <= quality <= 100:
+                raise ValueError("quality must be between 1 and 100")
+            self.quality = quality
+
+    def process(self, data):
+        """Detect apples in one JPEG frame. Returns the reply as a list of messages (see encode())."""
+        started = time.perf_counter()
+        if len(data) > WS_MAX_FRAME_BYTES:
+            return self.encode({"error": "Frame too large"})
+        # frombuffer wraps the received bytes without copying them
+        with stage('decode'):
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            return self.encode({"error": "Invalid image data"})
+        detections = self.detector.find(frame)
+        result = {
+            "seq": self.processed,
+            "count": len(detections),
+            "boxes": [det["bbox"] for det in detections],
+            "size": [frame.shape[1], frame.shape[0]],
+            "dropped": self.dropped,
+        }
+        self.processed += 1
+        image = None
+        if self.annotate:
+            # The decoded frame belongs to this call, so draw on it directly
+            annotated = draw_detections(frame, detections)
+            with stage('encode'):
+                success, buf = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+            image = buf.tobytes() if success else None
+        result["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return self.encode(result, image)
+
+    def encode(self, result, image=None):
+        """Outgoing messages as ('bytes' | 'text', payload) pairs."""
+        if self.encoding == 'msgpack':
+            if image is not None:
+                result["image"] = image
+            return [('bytes', msgpack.packb(result))]
+        messages = [('text', json.dumps(result, separators=(',', ':')))]
+        if image is not None:
+            messages.append(('bytes', image))
+        return messages
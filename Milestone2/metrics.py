@@ -0,0 +1,296 @@
+import os
+import time
+import random
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# In-process metrics, rendered in the Prometheus text format by GET /metrics.
+#
+# Stage timers wrap the hot path (decode, HSV conversion, masking,
+# morphology, contours, annotation, encoding, inference) at about a
+# microsecond each. Each series keeps its count, sum and a window of recent
+# observations, and the p50/p95/p99 are computed only when /metrics is
+# scraped. Counters and gauges cover stream frames, drops and viewers.
+# Collectors registered by other modules (model registry, Firebase client,
+# result cache, job queues) add their own figures at render time. This
+# module only uses the standard library, so video worker processes can
+# import it cheaply; their figures simply stay in that process.
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+# Recent observations per series used for quantiles
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', 1024))
+# Allow ?profile=1 to profile that one request
+METRICS_PROFILE = os.getenv('METRICS_PROFILE', '0') == '1'
+# Fraction of requests profiled without being asked (0 disables)
+METRICS_PROFILE_SAMPLE_RATE = float(os.getenv('METRICS_PROFILE_SAMPLE_RATE', 0))
+METRICS_PROFILE_DIR = os.getenv('METRICS_PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'app_profiles')
+
+QUANTILES = (0.5, 0.95, 0.99)
+# Seconds of history behind the *_fps gauges
+_RATE_WINDOW = 10
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Timer:
+    __slots__ = ('summary', 'label', 'started')
+
+    def __init__(self, summary, label):
+        self.summary = summary
+        self.label = label
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.summary.observe(self.label, time.perf_counter() - self.started)
+        return False
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Summary:
+    """Count, sum and recent observations per value of one label."""
+
+    kind = 'summary'
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._series = {}  # label value -> [count, sum, recent]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, amount):
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0, 0.0, deque(maxlen=METRICS_WINDOW)]
+            series[0] += 1
+            series[1] += amount
+            series[2].append(amount)
+
+    def time(self, value):
+        """Context manager observing the seconds spent inside it."""
+        return _Timer(self, value) if METRICS_ENABLED else _NULL_TIMER
+
+    def samples(self):
+        with self._lock:
+            snapshot = {value: (count, total, sorted(recent)) for value, (count, total, recent) in self._series.items()}
+        for value, (count, total, recent) in sorted(snapshot.items()):
+            for q in QUANTILES:
+                yield '', {self.label: value, "quantile": q}, recent[min(int(len(recent) * q), len(recent) - 1)]
+            yield '_sum', {self.label: value}, total
+            yield '_count', {self.label: value}, count
+
+
+class Counter:
+    """Monotonic count per label value, plus an optional <name>_fps-style rate gauge."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label, rate_name=None):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.rate_name = rate_name
+        self._values = {}
+        self._buckets = {}  # label value -> {whole second: count}, for the rate
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, value, amount=1):
+        if not METRICS_ENABLED or not amount:
+            return
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+            if self.rate_name is not None:
+                second = int(time.monotonic())
+                buckets = self._buckets.setdefault(value, {})
+                buckets[second] = buckets.get(second, 0) + amount
+                if len(buckets) > _RATE_WINDOW + 1:
+                    for old in [s for s in buckets if s < second - _RATE_WINDOW]:
+                        del buckets[old]
+
+    def rate(self, value):
+        """Per-second rate over the last full seconds of the window."""
+        now = int(time.monotonic())
+        with self._lock:
+            buckets = self._buckets.get(value, {})
+            return sum(n for s, n in buckets.items() if now - _RATE_WINDOW <= s < now) / _RATE_WINDOW
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for value, count in sorted(values.items()):
+            yield '', {self.label: value}, count
+
+
+class Gauge:
+    """Current value per label value, moved up and down by callers."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, label):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def add(self, value, amount):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def set(self, value, amount):
+        with self._lock:
+            self._values[value] = amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for value, amount in sorted(values.items()):
+            yield '', {self.label: value}, amount
+
+
+class QueuedExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that counts the work items still waiting for a thread."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiting = 0
+        self._count_lock = threading.Lock()
+
+    def _leave(self):
+        with self._count_lock:
+            self._waiting -= 1
+
+    def _left_if_cancelled(self, future):
+        # A cancelled item never started, so it leaves the queue here instead
+        if future.cancelled():
+            self._leave()
+
+    def submit(self, fn, /, *args, **kwargs):
+        def run():
+            self._leave()
+            return fn(*args, **kwargs)
+
+        with self._count_lock:
+            self._waiting += 1
+        try:
+            future = super().submit(run)
+        except BaseException:
+            self._leave()
+            raise
+        future.add_done_callback(self._left_if_cancelled)
+        return future
+
+    def queue_depth(self):
+        """Work items submitted but not yet picked up by a thread."""
+        return self._waiting
+
+
+STAGE_SECONDS = Summary('detection_stage_seconds', 'Seconds per detection or streaming stage.', 'stage')
+REQUEST_SECONDS = Summary('http_request_seconds', 'Seconds until a response is returned, per endpoint.', 'endpoint')
+STREAM_FRAMES = Counter('stream_frames_total', 'Frames sent to stream viewers.', 'stream', rate_name='stream_fps')
+STREAM_DROPPED = Counter('stream_dropped_frames_total', 'Source frames skipped or never sent to a viewer.', 'stream')
+STREAMS_ACTIVE = Gauge('streams_active', 'Stream viewers currently connected.', 'stream')
+
+
+def stage(name):
+    """Time a block as detection stage name: with stage('hsv'): ..."""
+    return STAGE_SECONDS.time(name)
+
+
+def register_collector(collect):
+    """Add a callable returning [(name, type, help, [(labels dict, value), ...]), ...] at render time."""
+    _collectors.append(collect)
+
+
+def _families():
+    for metric in _metrics:
+        yield metric.name, metric.kind, metric.help, [(metric.name + suffix, labels, value)
+                                                     for suffix, labels, value in metric.samples()]
+        if isinstance(metric, Counter) and metric.rate_name is not None:
+            yield metric.rate_name, 'gauge', f'Per-second rate of {metric.name} over the last {_RATE_WINDOW}s.', [
+                (metric.rate_name, {metric.label: value}, metric.rate(value)) for value in list(metric._values)]
+    for collect in list(_collectors):
+        try:
+            families = list(collect())
+        except Exception:
+            continue
+        for name, kind, help_text, samples in families:
+            yield name, kind, help_text, [(name, labels, value) for labels, value in samples]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for name, kind, help_text, samples in _families():
+        if not samples:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample_name, labels, value in samples:
+            lines.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+# -------- Request profiling --------
+
+def should_profile(requested):
+    """True when this request should run under the profiler."""
+    if requested and METRICS_PROFILE:
+        return True
+    return METRICS_PROFILE_SAMPLE_RATE > 0 and random.random() < METRICS_PROFILE_SAMPLE_RATE
+
+
+def start_profile():
+    """Start a cProfile profiler on this thread, or return None if another profiler is active."""
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None
+    return profiler
+
+
+def finish_profile(profiler, label):
+    """Stop profiler and dump it to METRICS_PROFILE_DIR. Returns the .prof path."""
+    profiler.disable()
+    os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+    safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in label)
+    path = os.path.join(METRICS_PROFILE_DIR, f'{safe}-{int(time.time() * 1000)}.prof')
+    profiler.dump_stats(path)
+    return path
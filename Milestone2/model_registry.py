@@ -0,0 +1,330 @@
+import os
+import ast
+import time
+import queue
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from metrics import register_collector
+
+# Process-wide registry of detection models.
+#
+# Each model is loaded lazily on first use and then kept warm. A pool of
+# MODEL_POOL_SIZE instances is checked out per call, so one instance is
+# never used by two threads at once and several requests can run in
+# parallel when the pool is larger than one. Besides the ultralytics
+# PyTorch path, YOLO models exported to ONNX or OpenVINO run directly on
+# ONNX Runtime / OpenVINO, which is usually much faster on CPU-only nodes
+# and lets the inference thread count be set explicitly.
+
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'torch')
+# Inference threads per model instance; 0 keeps each library's default
+MODEL_THREADS = int(os.getenv('MODEL_THREADS', 0))
+MODEL_POOL_SIZE = int(os.getenv('MODEL_POOL_SIZE', 1))
+# Recent call latencies kept per backend for stats()
+_LATENCY_HISTORY = 512
+
+_NMS_IOU = 0.45
+_DEFAULT_INPUT_SIZE = 640
+_BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+class ModelUnavailable(Exception):
+    pass
+
+
+def _letterbox(frame, size):
+    """Resize keeping aspect ratio and pad to size x size. Returns (image, scale, (pad_x, pad_y))."""
+    h, w = frame.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    pad_x, pad_y = (size - nw) // 2, (size - nh) // 2
+    canvas = np.full((size, size, 3), 114, np.uint8)
+    canvas[pad_y:pad_y + nh, pad_x:pad_x + nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return canvas, scale, (pad_x, pad_y)
+
+
+class TorchYolo:
+    """ultralytics YOLO on PyTorch."""
+
+    backend = 'torch'
+
+    def __init__(self, path, threads=MODEL_THREADS):
+        try:
+            from ultralytics import YOLO
+        except ImportError:
+            raise ModelUnavailable("ultralytics is not installed")
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        self.model = YOLO(path)
+        self.names = self.model.names
+
+    def predict(self, frames, conf):
+        """[(xyxy float32 (N, 4), class ids (N,), scores (N,))] per frame."""
+        results = self.model(list(frames), verbose=False, conf=conf)
+        return [(r.boxes.xyxy.cpu().numpy(), r.boxes.cls.cpu().numpy().astype(np.int64),
+                 r.boxes.conf.cpu().numpy()) for r in results]
+
+
+class _ExportedYolo:
+    """Shared pre/post-processing for YOLOv8 graphs exported by ultralytics.
+
+    The graph takes (B, 3, S, S) RGB floats in [0, 1] and returns
+    (B, 4 + classes, anchors) of centre/size boxes and class scores.
+    """
+
+    def _setup(self, input_shape, names):
+        batch, _, size = input_shape[0], input_shape[1], input_shape[2]
+        self.input_size = size if isinstance(size, int) and size > 0 else _DEFAULT_INPUT_SIZE
+        # Static batch-1 exports are fed one frame at a time
+        self.max_batch = batch if isinstance(batch, int) and batch > 0 else None
+        self.names = names or {0: 'person'}
+
+    def _run(self, blob):
+        raise NotImplementedError
+
+    def predict(self, frames, conf):
+        frames = list(frames)
+        step = self.max_batch or len(frames)
+        outputs = []
+        for start in range(0, len(frames), step):
+            chunk = frames[start:start + step]
+            boxed = [_letterbox(frame, self.input_size) for frame in chunk]
+            blob = cv2.dnn.blobFromImages([image for image, _, _ in boxed], 1 / 255.0, swapRB=True)
+            raw = self._run(blob)
+            for frame, prediction, (_, scale, pad) in zip(chunk, raw, boxed):
+                outputs.append(self._postprocess(prediction, scale, pad, conf, frame.shape))
+        return outputs
+
+    @staticmethod
+    def _postprocess(prediction, scale, pad, conf, shape):
+        prediction = prediction.T  # (anchors, 4 + classes)
+        class_scores = prediction[:, 4:]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        keep = scores >= conf
+        if not keep.any():
+            return np.zeros((0, 4), np.float32), np.zeros(0, np.int64), np.zeros(0, np.float32)
+        cxcywh, classes, scores = prediction[keep, :4], classes[keep], scores[keep]
+        xywh = np.column_stack([cxcywh[:, 0] - cxcywh[:, 2] / 2, cxcywh[:, 1] - cxcywh[:, 3] / 2,
+                                cxcywh[:, 2], cxcywh[:, 3]])
+        picked = np.asarray(cv2.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(), classes.tolist(),
+                                                    conf, _NMS_IOU), np.int64).reshape(-1)
+        xywh, classes, scores = xywh[picked], classes[picked], scores[picked]
+        xyxy = np.column_stack([xywh[:, 0], xywh[:, 1], xywh[:, 0] + xywh[:, 2], xywh[:, 1] + xywh[:, 3]])
+        xyxy -= (pad[0], pad[1], pad[0], pad[1])
+        xyxy /= scale
+        np.clip(xyxy, 0, [shape[1], shape[0], shape[1], shape[0]], out=xyxy)
+        return xyxy.astype(np.float32), classes.astype(np.int64), scores.astype(np.float32)
+
+
+class OnnxYolo(_ExportedYolo):
+    """YOLO exported with format='onnx', run on ONNX Runtime's CPU provider."""
+
+    backend = 'onnx'
+
+    def __init__(self, path, threads=MODEL_THREADS):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ModelUnavailable("onnxruntime is not installed")
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        names = ast.literal_eval(metadata['names']) if 'names' in metadata else None
+        self._setup(model_input.shape, names)
+
+    def _run(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoYolo(_ExportedYolo):
+    """YOLO exported with format='openvino' (a directory holding the .xml/.bin and metadata.yaml)."""
+
+    backend = 'openvino'
+
+    def __init__(self, path, threads=MODEL_THREADS):
+        try:
+            import openvino as ov
+        except ImportError:
+            raise ModelUnavailable("openvino is not installed")
+        xml = path
+        if os.path.isdir(path):
+            xml = next((os.path.join(path, f) for f in os.listdir(path) if f.endswith('.xml')), path)
+        core = ov.Core()
+        model = core.read_model(xml)
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if threads:
+            config['INFERENCE_NUM_THREADS'] = threads
+        self.compiled = core.compile_model(model, 'CPU', config)
+        shape = [d.get_length() if d.is_static else None for d in model.input(0).get_partial_shape()]
+        self._setup(shape, self._read_names(os.path.dirname(xml)))
+
+    @staticmethod
+    def _read_names(directory):
+        try:
+            import yaml
+            with open(os.path.join(directory, 'metadata.yaml')) as f:
+                return yaml.safe_load(f).get('names')
+        except (ImportError, OSError, AttributeError):
+            return None
+
+    def _run(self, blob):
+        # A fresh infer request per call keeps concurrent callers independent
+        return self.compiled.create_infer_request().infer({0: blob})[self.compiled.output(0)]
+
+
+_BACKEND_CLASSES = {'torch': TorchYolo, 'onnx': OnnxYolo, 'openvino': OpenVinoYolo}
+
+
+class ModelPool:
+    """Up to size lazily created instances of one model, checked out one caller at a time."""
+
+    def __init__(self, factory, size=MODEL_POOL_SIZE):
+        self.factory = factory
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _take(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            # Reserve a slot under the lock but load outside it; loading can take seconds
+            with self._lock:
+                build = self._created < self.size
+                if build:
+                    self._created += 1
+            if build:
+                try:
+                    return self.factory()
+                except BaseException:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            try:
+                # Wake now and then in case a failed load gave its slot back
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    @contextmanager
+    def checkout(self):
+        model = self._take()
+        try:
+            yield model
+        finally:
+            self._idle.put(model)
+
+    def warm(self):
+        """Create one instance now (e.g. at startup) so the first request skips loading."""
+        with self.checkout():
+            pass
+
+
+class ModelRegistry:
+    """Named model pools plus per-backend latency statistics."""
+
+    def __init__(self, backend=MODEL_BACKEND, threads=MODEL_THREADS, pool_size=MODEL_POOL_SIZE):
+        if backend not in _BACKENDS:
+            raise ValueError(f"Unknown model backend: {backend}")
+        self.backend = backend
+        self.threads = threads
+        self.pool_size = pool_size
+        self._pools = {}
+        self._latency = {}
+        self._lock = threading.Lock()
+
+    def pool(self, path, backend=None):
+        backend = backend or self.backend
+        key = (backend, path)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                cls = _BACKEND_CLASSES[backend]
+                pool = self._pools[key] = ModelPool(lambda: cls(path, self.threads), self.pool_size)
+            return pool
+
+    def predict(self, path, frames, conf, backend=None):
+        """Run frames through a pooled instance of the model at path and record the latency."""
+        pool = self.pool(path, backend)
+        with pool.checkout() as model:
+            started = time.perf_counter()
+            outputs = model.predict(frames, conf)
+            elapsed = time.perf_counter() - started
+        self.record(model.backend, elapsed, len(frames))
+        return outputs
+
+    def names(self, path, backend=None):
+        with self.pool(path, backend).checkout() as model:
+            return model.names
+
+    def record(self, backend, seconds, frames=1):
+        with self._lock:
+            stats = self._latency.get(backend)
+            if stats is None:
+                stats = self._latency[backend] = {"calls": 0, "frames": 0, "recent": deque(maxlen=_LATENCY_HISTORY)}
+            stats["calls"] += 1
+            stats["frames"] += frames
+            stats["recent"].append((seconds, frames))
+
+    def stats(self):
+        """{backend: {calls, frames, p50_ms, p95_ms, ms_per_frame}} over recent calls."""
+        with self._lock:
+            snapshot = {backend: (s["calls"], s["frames"], list(s["recent"])) for backend, s in self._latency.items()}
+        report = {}
+        for backend, (calls, frames, recent) in snapshot.items():
+            seconds = np.array([s for s, _ in recent])
+            counts = np.array([n for _, n in recent])
+            report[backend] = {
+                "calls": calls,
+                "frames": frames,
+                "p50_ms": round(float(np.percentile(seconds, 50)) * 1000, 2),
+                "p95_ms": round(float(np.percentile(seconds, 95)) * 1000, 2),
+                "ms_per_frame": round(float(seconds.sum() / max(counts.sum(), 1)) * 1000, 2),
+            }
+        return report
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide ModelRegistry, configured from the MODEL_* environment."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry()
+    return _registry
+
+
+def _collect_metrics():
+    if _registry is None:
+        return []
+    stats = _registry.stats()
+    return [
+        ('model_inference_calls_total', 'counter', 'Model calls per backend.',
+         [({"backend": b}, s["calls"]) for b, s in stats.items()]),
+        ('model_inference_frames_total', 'counter', 'Frames run through the model per backend.',
+         [({"backend": b}, s["frames"]) for b, s in stats.items()]),
+        ('model_inference_seconds', 'summary', 'Seconds per model call over recent calls.',
+         [({"backend": b, "quantile": q}, s[key] / 1000) for b, s in stats.items()
+          for q, key in ((0.5, "p50_ms"), (0.95, "p95_ms"))]),
+    ]
+
+
+register_collector(_collect_metrics)
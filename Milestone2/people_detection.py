@@ -0,0 +1,147 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from model_registry import MODEL_BACKEND, ModelUnavailable, get_registry
+from metrics import stage
+
+# Headless YOLO people counter shared by the /people/* routes and video jobs.
+#
+# The model comes from the process-wide model registry: loaded on first use
+# (or at import with PEOPLE_PRELOAD=1), warmed with one dummy inference and
+# then reused by every request, on whichever backend MODEL_BACKEND selects.
+# Inference libraries are imported lazily so the rest of the app runs without them.
+
+_DEFAULT_MODELS = {'torch': 'yolov8n.pt', 'onnx': 'yolov8n.onnx', 'openvino': 'yolov8n_openvino_model'}
+PEOPLE_MODEL = os.getenv('PEOPLE_MODEL') or _DEFAULT_MODELS.get(MODEL_BACKEND, 'yolov8n.pt')
+PEOPLE_PRELOAD = os.getenv('PEOPLE_PRELOAD', '0') == '1'
+PEOPLE_CONFIDENCE = float(os.getenv('PEOPLE_CONFIDENCE', 0.25))
+# Classes counted as people (whichever of these the model knows)
+PEOPLE_CLASSES = ("person", "face")
+# Frames per model call adapt so one batch stays near this latency
+PEOPLE_BATCH_LATENCY_MS = float(os.getenv('PEOPLE_BATCH_LATENCY_MS', 500))
+PEOPLE_MAX_BATCH = int(os.getenv('PEOPLE_MAX_BATCH', 16))
+
+_ZONE_COLOR = (255, 0, 0)
+_INSIDE_COLOR = (0, 0, 255)
+_OUTSIDE_COLOR = (0, 255, 0)
+
+
+PeopleModelUnavailable = ModelUnavailable
+
+
+class BatchSizer:
+    """Grows the batch while a batch finishes under the latency target, halves it when over."""
+
+    def __init__(self, target_ms=PEOPLE_BATCH_LATENCY_MS, max_size=PEOPLE_MAX_BATCH):
+        self.target = target_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self.size = 1
+
+    def record(self, seconds):
+        if seconds > self.target and self.size > 1:
+            self.size = max(1, self.size // 2)
+        elif seconds < self.target * 0.7 and self.size < self.max_size:
+            self.size += 1
+
+
+class PeopleDetector:
+    """A registry-pooled YOLO model plus vectorized person filtering and zone counting.
+
+    Each call checks an instance out of the registry pool, so threads never
+    share one at the same time; callers still get the most throughput by
+    passing several frames per call to detect_batch.
+    """
+
+    def __init__(self, model_path=PEOPLE_MODEL, confidence=PEOPLE_CONFIDENCE, registry=None, backend=None):
+        self.registry = registry or get_registry()
+        self.model_path = model_path
+        self.backend = backend
+        self.names = self.registry.names(model_path, backend)
+        self.confidence = confidence
+        self.class_ids = np.array([i for i, name in self.names.items() if name in PEOPLE_CLASSES], np.int64)
+        # The first call initialises the predictor; do it now rather than in a request
+        self.detect_batch([np.zeros((64, 64, 3), np.uint8)])
+
+    def detect_batch(self, frames):
+        """Run one model call over frames. Returns [(boxes, classes, scores)] per frame.
+
+        boxes is an (N, 4) int32 array of x1, y1, x2, y2, already filtered to
+        people with a vectorized class mask.
+        """
+        if not frames:
+            return []
+        with stage('inference'):
+            outputs = self.registry.predict(self.model_path, frames, self.confidence, self.backend)
+        detections = []
+        for xyxy, classes, scores in outputs:
+            keep = np.isin(classes, self.class_ids)
+            detections.append((xyxy[keep].astype(np.int32), classes[keep], scores[keep].astype(np.float32)))
+        return detections
+
+    def count(self, detection, shape, layout=None):
+        """Structured counts for one frame's (boxes, classes, scores); shape is the frame's."""
+        boxes, classes, scores = detection
+        centers = (boxes[:, :2] + boxes[:, 2:]) // 2
+        names = layout.names if layout else []
+        membership = layout.membership(centers, shape) if layout else np.zeros((len(boxes), 0), bool)
+        return {
+            "count": len(boxes),
+            "zones": {name: int(n) for name, n in zip(names, membership.sum(axis=0))},
+            "detections": [
+                {"bbox": box, "label": self.names[cls_id], "confidence": round(score, 3),
+                 "zones": [name for name, hit in zip(names, inside) if hit]}
+                for box, cls_id, score, inside in zip(boxes.tolist(), classes.tolist(), scores.tolist(),
+                                                      membership.tolist())
+            ],
+        }
+
+    def count_batch(self, frames, layout=None):
+        return [self.count(detection, frame.shape, layout)
+                for frame, detection in zip(frames, self.detect_batch(frames))]
+
+
+def draw_people(bgr_image, result, layout=None):
+    """Draw zones, lines, boxes and totals from a count() result onto bgr_image. Returns it."""
+    if layout:
+        layout.draw(bgr_image, _ZONE_COLOR)
+        for zone in layout.zones:
+            x, y = zone["points"][0]
+            cv2.putText(bgr_image, f'{zone["name"]}: {result["zones"].get(zone["name"], 0)}', (x, y - 5),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, _ZONE_COLOR, 2)
+    for det in result["detections"]:
+        x1, y1, x2, y2 = det["bbox"]
+        color = _INSIDE_COLOR if det["zones"] else _OUTSIDE_COLOR
+        label = f'{det["label"]} {det["id"]}' if det.get("id") is not None else det["label"]
+        cv2.rectangle(bgr_image, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(bgr_image, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+    cv2.putText(bgr_image, f"Total Detected: {result['count']}", (20, 40),
+                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 3)
+    return bgr_image
+
+
+_detector = None
+_detector_lock = threading.Lock()
+
+
+def get_people_detector():
+    """The process-wide PeopleDetector, loaded on first call."""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = PeopleDetector()
+    return _detector
+
+
+def _preload():
+    try:
+        get_people_detector()
+    except PeopleModelUnavailable:
+        pass
+
+
+if PEOPLE_PRELOAD:
+    threading.Thread(target=_preload, name='people-model-preload', daemon=True).start()
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from metrics import register_collector
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+# Content-addressed cache for detection results.
+#
+# Keys combine a fast hash of the uploaded bytes (xxh3-128 when xxhash is
+# installed, else BLAKE2b-128) with the detector settings and request
+# options, so re-uploading the same file with the same options is answered
+# from the cache and any settings change misses. JSON responses, including
+# their encoded images, go in a byte-bounded in-memory LRU. Processed videos
+# go in a byte-bounded directory with a JSON summary beside each file. Both
+# tiers expire entries after a TTL and count hits, misses and evictions.
+
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL_SECONDS', 3600))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'apple_result_cache')
+RESULT_CACHE_DISK_MAX_BYTES = int(os.getenv('RESULT_CACHE_DISK_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+RESULT_CACHE_DISK_TTL_SECONDS = int(os.getenv('RESULT_CACHE_DISK_TTL_SECONDS', 7 * 24 * 3600))
+
+_READ_CHUNK = 1024 * 1024
+
+
+def _hasher():
+    return xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+
+
+def content_digest(source):
+    """Hex digest of bytes/str, or of a seekable stream's whole content (rewound afterwards)."""
+    hasher = _hasher()
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        hasher.update(source)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(_READ_CHUNK), b''):
+            hasher.update(chunk)
+        source.seek(0)
+    return hasher.hexdigest()
+
+
+def cache_key(kind, digest, **params):
+    """Key for one kind of result computed from content digest under params (JSON-able)."""
+    encoded = json.dumps([kind, digest, params], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst, copying when they are on different filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class MemoryCache:
+    """LRU of bytes values bounded by their total size, with a TTL per entry."""
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _pop(self, key):
+        value, _ = self._entries.pop(key)
+        self.bytes -= len(value)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._pop(key)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+            self.bytes += len(value)
+            while self.bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+
+class DiskCache:
+    """Files (e.g. processed videos) plus a JSON summary per key in one directory.
+
+    Least recently used entries are evicted past max_bytes and entries unused
+    for the TTL are dropped. The index is rebuilt from the directory on first
+    use, so the cache survives restarts.
+    """
+
+    def __init__(self, root=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_DISK_MAX_BYTES,
+                 ttl_seconds=RESULT_CACHE_DISK_TTL_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._index = None  # key -> [data path, size, last_used], least recently used first
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, key + '.json')
+
+    def _load(self):
+        if self._index is not None:
+            return
+        entries = []
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            try:
+                with open(self._meta_path(key)) as f:
+                    path = os.path.join(self.root, key + json.load(f)["ext"])
+                entries.append((os.path.getmtime(self._meta_path(key)), key, path, os.path.getsize(path)))
+            except (OSError, ValueError, KeyError):
+                continue
+        self._index = OrderedDict((key, [path, size, used]) for used, key, path, size in sorted(entries))
+        self.bytes = sum(entry[1] for entry in self._index.values())
+
+    def _remove(self, key):
+        path, size, _ = self._index.pop(key)
+        self.bytes -= size
+        for victim in (path, self._meta_path(key)):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+
+    def get(self, key):
+        """Return (data path, summary dict) and mark the entry used, or None."""
+        now = time.time()
+        with self._lock:
+            self._load()
+            entry = self._index.get(key)
+            if entry is not None and now - entry[2] > self.ttl_seconds:
+                self._remove(key)
+                self.evictions += 1
+                entry = None
+            meta = None
+            if entry is not None:
+                try:
+                    with open(self._meta_path(key)) as f:
+                        meta = json.load(f)
+                    os.utime(self._meta_path(key))
+                except (OSError, ValueError):
+                    self._remove(key)
+            if meta is None:
+                self.misses += 1
+                return None
+            entry[2] = now
+            self._index.move_to_end(key)
+            self.hits += 1
+            return entry[0], meta["summary"]
+
+    def put(self, key, src_path, summary):
+        """Add src_path (linked when possible, else copied) with a JSON-able summary."""
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        ext = os.path.splitext(src_path)[1]
+        path = os.path.join(self.root, key + ext)
+        staging = os.path.join(self.root, f'.{key}.{threading.get_ident()}')
+        link_or_copy(src_path, staging)
+        os.replace(staging, path)
+        with open(staging, 'w') as f:
+            json.dump({"ext": ext, "summary": summary}, f)
+        os.replace(staging, self._meta_path(key))
+        with self._lock:
+            self._load()
+            if key in self._index:
+                self.bytes -= self._index.pop(key)[1]
+            self._index[key] = [path, size, time.time()]
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._index)))
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            self._load()
+            lookups = self.hits + self.misses
+            return {"entries": len(self._index), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "hit_rate": round(self.hits / lookups, 3) if lookups else None}
+
+
+class ResultCache:
+    """The memory tier for JSON responses and the disk tier for processed videos."""
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory or MemoryCache()
+        self.disk = disk or DiskCache()
+
+    def stats(self):
+        return {"hash": 'xxh3_128' if xxhash is not None else 'blake2b_128',
+                "memory": self.memory.stats(), "disk": self.disk.stats()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """The process-wide ResultCache, configured from the RESULT_CACHE_* environment."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+    return _cache
+
+
+def _collect_metrics():
+    if _cache is None:
+        return []
+    tiers = {"memory": _cache.memory.stats(), "disk": _cache.disk.stats()}
+    return [
+        ('result_cache_' + field + suffix, kind, help_text,
+         [({"tier": tier}, stats[field]) for tier, stats in tiers.items()])
+        for field, suffix, kind, help_text in (
+            ('hits', '_total', 'counter', 'Result cache hits per tier.'),
+            ('misses', '_total', 'counter', 'Result cache misses per tier.'),
+            ('evictions', '_total', 'counter', 'Result cache evictions per tier.'),
+            ('entries', '', 'gauge', 'Entries held per tier.'),
+            ('bytes', '', 'gauge', 'Bytes held per tier.'),
+        )
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,139 @@
+import os
+import time
+
+# Pacing and adaptive quality for the MJPEG generators.
+#
+# A governor plays file sources in real time (dropping frames when it falls
+# behind), caps output at STREAM_MAX_FPS, and keeps moving averages of how
+# long each frame takes to process and to send. Over the latency budget it
+# lowers JPEG quality when the client is the bottleneck and the detection
+# resolution when the CPU is; with headroom it steps both back up.
+
+STREAM_MAX_FPS = float(os.getenv('STREAM_MAX_FPS', 30))
+STREAM_LATENCY_BUDGET_MS = float(os.getenv('STREAM_LATENCY_BUDGET_MS', 80))
+STREAM_MIN_SCALE = float(os.getenv('STREAM_MIN_SCALE', 0.4))
+STREAM_JPEG_QUALITY = int(os.getenv('STREAM_JPEG_QUALITY', 90))
+STREAM_MIN_JPEG_QUALITY = int(os.getenv('STREAM_MIN_JPEG_QUALITY', 50))
+
+_EWMA_ALPHA = 0.2
+_SCALE_STEP = 0.9
+_QUALITY_STEP = 5
+# Consecutive slow/fast frames required before stepping down/up, to avoid oscillating
+_DEGRADE_AFTER = 3
+_RECOVER_AFTER = 15
+
+
+class StreamGovernor:
+    """Per-stream pacing plus adaptive detection size and JPEG quality."""
+
+    def __init__(self, base_size, source_fps=None, max_fps=STREAM_MAX_FPS,
+                 latency_budget_ms=STREAM_LATENCY_BUDGET_MS, min_scale=STREAM_MIN_SCALE,
+                 quality=STREAM_JPEG_QUALITY, min_quality=STREAM_MIN_JPEG_QUALITY):
+        self.base_size = base_size
+        # source_fps is only given for files; live cameras pace themselves
+        self.source_interval = 1.0 / source_fps if source_fps else 0.0
+        self.output_interval = 1.0 / max_fps if max_fps else 0.0
+        self.budget = latency_budget_ms / 1000.0
+        self.min_scale = min_scale
+        self.max_quality = quality
+        self.min_quality = min_quality
+        self.scale = 1.0
+        self.quality = quality
+        self.latency = 0.0
+        self.send_time = 0.0
+        self._fast_frames = 0
+        self._slow_frames = 0
+        self._start = None
+        self._last_emit = None
+        self._consumed = 0
+        self._emitted = 0
+
+    @property
+    def size(self):
+        """Detection/output size for the next frame."""
+        w, h = self.base_size
+        return max(int(w * self.scale), 16), max(int(h * self.scale), 16)
+
+    def area_scale(self):
+        """Factor to apply to pixel-area thresholds at the current resolution."""
+        return self.scale * self.scale
+
+    def frames_to_skip(self):
+        """Source frames to drop so file playback keeps to real time (0 when on schedule)."""
+        if not self.source_interval or self._start is None:
+            return 0
+        due = (time.monotonic() - self._start) / self.source_interval
+        return max(int(due) - self._consumed, 0)
+
+    def consumed(self, n=1):
+        """Record n source frames read or skipped."""
+        if self._start is None:
+            self._start = time.monotonic()
+        self._consumed += n
+
+    def processed(self, seconds):
+        """Record decode+detect+encode time for the frame just produced."""
+        self.latency = self.latency + _EWMA_ALPHA * (seconds - self.latency) if self._emitted else seconds
+        self._adjust()
+
+    def sent(self, seconds):
+        """Record how long the client took to accept the frame (socket backpressure)."""
+        self.send_time += _EWMA_ALPHA * (seconds - self.send_time)
+
+    def _adjust(self):
+        total = self.latency + self.send_time
+        if total > self.budget:
+            self._fast_frames = 0
+            self._slow_frames += 1
+            if self._slow_frames < _DEGRADE_AFTER:
+                return
+            self._slow_frames = 0
+            # Slow links are helped most by smaller JPEGs; slow CPUs by smaller frames
+            if self.send_time > self.latency and self.quality > self.min_quality:
+                self.quality = max(self.quality - _QUALITY_STEP, self.min_quality)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.scale * _SCALE_STEP, self.min_scale)
+            else:
+                self.quality = max(self.quality - _QUALITY_STEP, self.min_quality)
+        elif total < self.budget * 0.6:
+            self._slow_frames = 0
+            self._fast_frames += 1
+            if self._fast_frames >= _RECOVER_AFTER:
+                self._fast_frames = 0
+                if self.scale < 1.0:
+                    self.scale = min(self.scale / _SCALE_STEP, 1.0)
+                elif self.quality < self.max_quality:
+                    self.quality = min(self.quality + _QUALITY_STEP, self.max_quality)
+        else:
+            self._fast_frames = 0
+            self._slow_frames = 0
+
+    def ready(self):
+        """For live sources: True once the output cap allows another frame.
+
+        Camera loops use this to drop frames instead of sleeping, so the
+        capture buffer never fills with stale frames.
+        """
+        return (not self.output_interval or self._last_emit is None
+                or time.monotonic() - self._last_emit >= self.output_interval)
+
+    def emitted(self):
+        self._emitted += 1
+        self._last_emit = time.monotonic()
+
+    def delay(self):
+        """Seconds until the next frame may be emitted (output cap and file presentation time)."""
+        now = time.monotonic()
+        target = now
+        if self.output_interval and self._last_emit is not None:
+            target = max(target, self._last_emit + self.output_interval)
+        if self.source_interval and self._start is not None:
+            target = max(target, self._start + self._consumed * self.source_interval)
+        return target - now
+
+    def wait(self):
+        """Sleep for delay(), then record the emit. Async servers await the delay instead."""
+        delay = self.delay()
+        if delay > 0:
+            time.sleep(delay)
+        self.emitted()
@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Per-stream snapshot state for the MJPEG generators.
+#
+# Each stream keeps short ring buffers of its recent annotated frames and
+# counts. Generators hand over the frame array they just produced (no copy);
+# they never touch it again, so snapshot readers can encode it directly.
+
+STREAM_FRAME_HISTORY = int(os.getenv('STREAM_FRAME_HISTORY', 4))
+STREAM_COUNT_HISTORY = int(os.getenv('STREAM_COUNT_HISTORY', 256))
+STREAM_IDLE_TTL_SECONDS = int(os.getenv('STREAM_IDLE_TTL_SECONDS', 1800))
+
+
+class StreamState:
+    """Recent (index, frame, count) history for one stream."""
+
+    def __init__(self, frame_history=STREAM_FRAME_HISTORY, count_history=STREAM_COUNT_HISTORY):
+        self._lock = threading.Lock()
+        self._frames = deque(maxlen=frame_history)
+        self._counts = deque(maxlen=count_history)
+        self._next_index = 0
+        # Unique-count summary, set by generators that track objects (see tracking.VideoCountSummary)
+        self.summary = None
+        self.last_active = time.monotonic()
+
+    def record(self, frame, count):
+        """Store a reference to frame; the caller must not modify it afterwards."""
+        with self._lock:
+            index = self._next_index
+            self._next_index += 1
+            self._frames.append((index, frame, count))
+            self._counts.append((index, count))
+            self.last_active = time.monotonic()
+        return index
+
+    def reset(self):
+        with self._lock:
+            self._frames.clear()
+            self._counts.clear()
+            self._next_index = 0
+            self.summary = None
+            self.last_active = time.monotonic()
+
+    def snapshot(self, index=None):
+        """Return (index, frame, count) for the latest frame or frame index, else None."""
+        with self._lock:
+            if not self._frames:
+                return None
+            if index is None:
+                return self._frames[-1]
+            offset = index - self._frames[0][0]
+            if 0 <= offset < len(self._frames):
+                return self._frames[offset]
+            return None
+
+    def counts(self):
+        """Return the recent (index, count) pairs, oldest first."""
+        with self._lock:
+            return list(self._counts)
+
+
+class StreamRegistry:
+    """Maps a stream key (e.g. ('file', user)) to its StreamState."""
+
+    def __init__(self, idle_ttl=STREAM_IDLE_TTL_SECONDS, **state_options):
+        self.idle_ttl = idle_ttl
+        self._state_options = state_options
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, create=True):
+        with self._lock:
+            state = self._states.get(key)
+            if state is None and create:
+                self._prune()
+                state = self._states[key] = StreamState(**self._state_options)
+            return state
+
+    def discard(self, key):
+        with self._lock:
+            self._states.pop(key, None)
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for key in [k for k, state in self._states.items() if state.last_active < cutoff]:
+            del self._states[key]
+
+    def __len__(self):
+        return len(self._states)
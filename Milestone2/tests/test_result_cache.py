@@ -0,0 +1,163 @@
+import io
+import os
+import types
+
+import pytest
+
+import result_cache
+from result_cache import DiskCache, MemoryCache, cache_key, content_digest, link_or_copy
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake time.time() and time.monotonic() for result_cache only."""
+    clock = types.SimpleNamespace(now=1_700_000_000.0)
+    monkeypatch.setattr(result_cache, 'time', types.SimpleNamespace(time=lambda: clock.now,
+                                                                    monotonic=lambda: clock.now))
+    return clock
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+def test_content_digest_rewinds_stream():
+    data = b'apple' * 300_000
+    stream = io.BytesIO(data)
+    stream.seek(17)
+    assert content_digest(stream) == content_digest(data)
+    assert stream.tell() == 0
+    assert stream.read() == data
+    assert content_digest('text') == content_digest(b'text')
+    assert content_digest(b'a') != content_digest(b'b')
+
+
+def test_cache_key_depends_on_kind_digest_and_params():
+    base = cache_key('image', 'abc', fmt='png', quality=90)
+    assert base == cache_key('image', 'abc', quality=90, fmt='png')
+    assert base != cache_key('image', 'abc', fmt='jpeg', quality=90)
+    assert base != cache_key('video', 'abc', fmt='png', quality=90)
+    assert base != cache_key('image', 'abd', fmt='png', quality=90)
+
+
+def test_memory_lru_eviction_by_bytes(clock):
+    cache = MemoryCache(max_bytes=10, ttl_seconds=60)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    assert cache.get('a') == b'1234'  # b is now least recently used
+    cache.put('c', b'1234')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1234' and cache.get('c') == b'1234'
+    assert cache.stats()["bytes"] == 8
+    assert cache.evictions == 1
+
+
+def test_memory_replacing_a_key_updates_bytes(clock):
+    cache = MemoryCache(max_bytes=10, ttl_seconds=60)
+    cache.put('a', b'123456')
+    cache.put('a', b'12')
+    assert cache.bytes == 2
+    assert cache.get('a') == b'12'
+
+
+def test_memory_skips_values_larger_than_the_cache(clock):
+    cache = MemoryCache(max_bytes=4, ttl_seconds=60)
+    cache.put('a', b'12')
+    cache.put('big', b'12345')
+    assert cache.get('big') is None
+    assert cache.get('a') == b'12'
+
+
+def test_memory_ttl_expiry(clock):
+    cache = MemoryCache(max_bytes=100, ttl_seconds=60)
+    cache.put('a', b'v')
+    clock.now += 59
+    assert cache.get('a') == b'v'
+    clock.now += 2
+    assert cache.get('a') is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (1, 1, 1, 0)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_disk_put_get_and_lru_eviction(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=250, ttl_seconds=3600)
+    for key in ('a', 'b'):
+        cache.put(key, write(tmp_path / f'{key}.mp4', 100), {"key": key})
+        clock.now += 1
+    path, summary = cache.get('a')
+    assert summary == {"key": 'a'}
+    assert path.endswith('a.mp4') and os.path.getsize(path) == 100
+    cache.put('c', write(tmp_path / 'c.mp4', 100), {"key": 'c'})
+    assert cache.get('b') is None
+    assert not os.path.exists(tmp_path / 'cache' / 'b.mp4')
+    assert not os.path.exists(tmp_path / 'cache' / 'b.json')
+    assert cache.stats()["bytes"] == 200
+    assert cache.evictions == 1
+
+
+def test_disk_ttl_expiry(tmp_path, clock):
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=1000, ttl_seconds=60)
+    cache.put('a', write(tmp_path / 'a.mp4', 10), {})
+    clock.now += 61
+    assert cache.get('a') is None
+    assert os.listdir(tmp_path / 'cache') == []
+
+
+def test_disk_index_rebuilt_after_restart(tmp_path):
+    root = str(tmp_path / 'cache')
+    first = DiskCache(root, max_bytes=250, ttl_seconds=3600)
+    for key in ('old', 'new'):
+        first.put(key, write(tmp_path / f'{key}.mp4', 100), {"key": key})
+    # The summary file's mtime records last use
+    os.utime(first._meta_path('old'), (1, 1))
+    # Stray files without a valid summary are ignored
+    write(tmp_path / 'cache' / 'junk.json', 3)
+    write(tmp_path / 'cache' / 'orphan.mp4', 50)
+
+    second = DiskCache(root, max_bytes=250, ttl_seconds=10 ** 10)
+    assert second.stats()["entries"] == 2
+    assert second.stats()["bytes"] == 200
+    assert second.get('new')[1] == {"key": 'new'}
+    # 'old' is least recently used, so it goes first
+    second.put('third', write(tmp_path / 'third.mp4', 100), {})
+    assert second.get('old') is None
+    assert second.get('new') is not None
+
+
+def test_disk_skips_files_larger_than_the_cache(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'), max_bytes=10)
+    cache.put('a', write(tmp_path / 'a.mp4', 11), {})
+    assert cache.get('a') is None
+
+
+def test_disk_entry_with_missing_summary_is_a_miss(tmp_path):
+    cache = DiskCache(str(tmp_path / 'cache'))
+    cache.put('a', write(tmp_path / 'a.mp4', 10), {})
+    os.remove(cache._meta_path('a'))
+    assert cache.get('a') is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_link_or_copy_links(tmp_path):
+    src = write(tmp_path / 'src', 5)
+    link_or_copy(src, str(tmp_path / 'dst'))
+    assert os.path.samefile(src, tmp_path / 'dst')
+
+
+def test_link_or_copy_falls_back_to_copy(tmp_path, monkeypatch):
+    def cross_device(src, dst):
+        raise OSError(18, 'Invalid cross-device link')
+
+    monkeypatch.setattr(result_cache.os, 'link', cross_device)
+    src = write(tmp_path / 'src', 5)
+    link_or_copy(src, str(tmp_path / 'dst'))
+    assert not os.path.samefile(src, tmp_path / 'dst')
+    assert (tmp_path / 'dst').read_bytes() == b'x' * 5
+
+
+def test_link_or_copy_raises_when_source_is_gone(tmp_path):
+    with pytest.raises(OSError):
+        link_or_copy(str(tmp_path / 'missing'), str(tmp_path / 'dst'))
@@ -0,0 +1,249 @@
+import json
+import base64
+import threading
+import types
+
+import pytest
+
+pytest.importorskip('Crypto')
+from Crypto.Hash import SHA256
+from Crypto.PublicKey import RSA
+from Crypto.Signature import pkcs1_15
+
+import token_verifier
+from token_verifier import InvalidToken, TokenVerifier
+
+PROJECT = 'demo-project'
+ISSUER = f'https://securetoken.google.com/{PROJECT}'
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def jwk(key, kid):
+    return {"kty": "RSA", "kid": kid, "alg": "RS256",
+            "n": b64(key.n.to_bytes((key.n.bit_length() + 7) // 8, 'big')),
+            "e": b64(key.e.to_bytes((key.e.bit_length() + 7) // 8, 'big'))}
+
+
+def sign(key, claims, kid='k1', header=None):
+    header_b64 = b64(json.dumps(header if header is not None else {"alg": "RS256", "kid": kid}).encode())
+    payload_b64 = b64(json.dumps(claims).encode())
+    signature = pkcs1_15.new(key).sign(SHA256.new(f'{header_b64}.{payload_b64}'.encode('ascii')))
+    return f'{header_b64}.{payload_b64}.{b64(signature)}'
+
+
+@pytest.fixture(scope='module')
+def key():
+    return RSA.generate(2048)
+
+
+@pytest.fixture(scope='module')
+def other_key():
+    return RSA.generate(2048)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake time.time() for token_verifier only."""
+    clock = types.SimpleNamespace(now=1_700_000_000.0)
+    monkeypatch.setattr(token_verifier, 'time', types.SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+class Keys:
+    """fetch_keys stand-in serving a mutable JWK set and counting fetches."""
+
+    def __init__(self, *jwks, max_age=3600):
+        self.jwks = list(jwks)
+        self.max_age = max_age
+        self.fetches = 0
+
+    def __call__(self, url):
+        self.fetches += 1
+        return {"keys": list(self.jwks)}, self.max_age
+
+
+def claims(clock, **overrides):
+    values = {"aud": PROJECT, "iss": ISSUER, "sub": 'uid-1', "email": 'a@example.com',
+              "email_verified": True, "iat": clock.now - 10, "auth_time": clock.now - 10, "exp": clock.now + 3600}
+    values.update(overrides)
+    return values
+
+
+@pytest.fixture
+def keys(key):
+    return Keys(jwk(key, 'k1'))
+
+
+@pytest.fixture
+def verifier(keys, clock):
+    return TokenVerifier(PROJECT, fetch_keys=keys)
+
+
+def test_valid_token(verifier, key, clock, keys):
+    result = verifier.verify(sign(key, claims(clock)))
+    assert result["sub"] == 'uid-1'
+    assert result["email_verified"] is True
+    assert keys.fetches == 1
+
+
+def test_bad_signature(verifier, other_key, clock):
+    with pytest.raises(InvalidToken, match='Bad signature'):
+        verifier.verify(sign(other_key, claims(clock)))
+
+
+def test_tampered_payload(verifier, key, clock):
+    header, _, signature = sign(key, claims(clock)).split('.')
+    payload = b64(json.dumps(claims(clock, sub='someone-else')).encode())
+    with pytest.raises(InvalidToken, match='Bad signature'):
+        verifier.verify(f'{header}.{payload}.{signature}')
+
+
+@pytest.mark.parametrize('overrides', [{"aud": 'other-project'}, {"iss": 'https://securetoken.google.com/other'}])
+def test_wrong_audience_or_issuer(verifier, key, clock, overrides):
+    with pytest.raises(InvalidToken, match='another project'):
+        verifier.verify(sign(key, claims(clock, **overrides)))
+
+
+def test_expired_token(verifier, key, clock):
+    token = sign(key, claims(clock, exp=clock.now - verifier.clock_skew - 1))
+    with pytest.raises(InvalidToken, match='expired'):
+        verifier.verify(token)
+    # Session checks accept a past exp
+    assert verifier.verify(token, check_expiry=False)["sub"] == 'uid-1'
+
+
+def test_expiry_within_clock_skew(verifier, key, clock):
+    assert verifier.verify(sign(key, claims(clock, exp=clock.now - verifier.clock_skew + 1)))
+
+
+def test_issued_in_the_future(verifier, key, clock):
+    with pytest.raises(InvalidToken, match='future'):
+        verifier.verify(sign(key, claims(clock, iat=clock.now + verifier.clock_skew + 60)))
+
+
+def test_unknown_kid_refetch_is_rate_limited(verifier, key, other_key, clock, keys):
+    verifier.verify(sign(key, claims(clock)))
+    assert keys.fetches == 1
+    # Keys rotate upstream; the first fetch was just now, so no refetch yet
+    keys.jwks.append(jwk(other_key, 'k2'))
+    rotated = sign(other_key, claims(clock), kid='k2')
+    with pytest.raises(InvalidToken, match='Unknown signing key'):
+        verifier.verify(rotated)
+    assert keys.fetches == 1
+    clock.now += token_verifier._MIN_REFETCH_SECONDS
+    assert verifier.verify(rotated)["sub"] == 'uid-1'
+    assert keys.fetches == 2
+    # A kid that is still unknown does not refetch again within the window
+    with pytest.raises(InvalidToken, match='Unknown signing key'):
+        verifier.verify(sign(other_key, claims(clock), kid='k3'))
+    assert keys.fetches == 2
+
+
+def test_keys_refetched_after_max_age(key, clock):
+    keys = Keys(jwk(key, 'k1'), max_age=60)
+    verifier = TokenVerifier(PROJECT, fetch_keys=keys, cache_ttl=0)
+    verifier.verify(sign(key, claims(clock)))
+    clock.now += 30
+    verifier.verify(sign(key, claims(clock, sub='uid-2')))
+    assert keys.fetches == 1
+    clock.now += 31
+    verifier.verify(sign(key, claims(clock, sub='uid-3')))
+    assert keys.fetches == 2
+
+
+@pytest.mark.parametrize('header', [[], 'RS256', 7])
+def test_non_object_header(verifier, key, clock, header):
+    with pytest.raises(InvalidToken, match='Malformed'):
+        verifier.verify(sign(key, claims(clock), header=header))
+
+
+@pytest.mark.parametrize('payload', [[1, 2], '"text"', '3'])
+def test_non_object_payload(verifier, key, payload):
+    header_b64 = b64(json.dumps({"alg": "RS256", "kid": 'k1'}).encode())
+    payload_b64 = b64(payload.encode() if isinstance(payload, str) else json.dumps(payload).encode())
+    signature = pkcs1_15.new(key).sign(SHA256.new(f'{header_b64}.{payload_b64}'.encode('ascii')))
+    with pytest.raises(InvalidToken, match='Malformed'):
+        verifier.verify(f'{header_b64}.{payload_b64}.{b64(signature)}')
+
+
+@pytest.mark.parametrize('token', ['', 'a.b', 'a.b.c.d', '!!.??.**'])
+def test_malformed_token(verifier, token):
+    with pytest.raises(InvalidToken):
+        verifier.verify(token)
+
+
+def test_wrong_algorithm(verifier, key, clock):
+    with pytest.raises(InvalidToken, match='algorithm'):
+        verifier.verify(sign(key, claims(clock), header={"alg": 'none', "kid": 'k1'}))
+
+
+def test_claims_cache_hit(verifier, key, clock, keys, monkeypatch):
+    token = sign(key, claims(clock))
+    verifier.verify(token)
+    assert (verifier.hits, verifier.misses) == (0, 1)
+
+    def fail(token):
+        raise AssertionError("signature checked again")
+
+    monkeypatch.setattr(verifier, '_verify_uncached', fail)
+    assert verifier.verify(token)["sub"] == 'uid-1'
+    assert (verifier.hits, verifier.misses) == (1, 1)
+    assert keys.fetches == 1
+
+
+def test_cached_claims_still_checked_for_expiry(verifier, key, clock):
+    token = sign(key, claims(clock, exp=clock.now + 10))
+    verifier.verify(token)
+    clock.now += 10 + verifier.clock_skew + 1
+    with pytest.raises(InvalidToken, match='expired'):
+        verifier.verify(token)
+    assert verifier.hits == 1
+
+
+def test_claims_cache_ttl_and_forget(verifier, key, clock):
+    token = sign(key, claims(clock))
+    verifier.verify(token)
+    clock.now += verifier.cache_ttl + 1
+    verifier.verify(token)
+    assert (verifier.hits, verifier.misses) == (0, 2)
+    verifier.forget(token)
+    verifier.verify(token)
+    assert verifier.misses == 3
+
+
+def test_claims_cache_is_bounded(key, clock):
+    verifier = TokenVerifier(PROJECT, fetch_keys=Keys(jwk(key, 'k1')), cache_size=2)
+    tokens = [sign(key, claims(clock, sub=f'uid-{n}')) for n in range(3)]
+    for token in tokens:
+        verifier.verify(token)
+    verifier.verify(tokens[0])
+    assert verifier.misses == 4
+
+
+def test_stale_keys_served_while_refetching(key, clock):
+    release = threading.Event()
+    started = threading.Event()
+    keys = Keys(jwk(key, 'k1'), max_age=60)
+
+    def slow_fetch(url):
+        if keys.fetches:
+            started.set()
+            assert release.wait(5)
+        return keys(url)
+
+    verifier = TokenVerifier(PROJECT, fetch_keys=slow_fetch, cache_ttl=0)
+    verifier.verify(sign(key, claims(clock)))
+    clock.now += 61
+    refresher = threading.Thread(target=verifier.verify, args=(sign(key, claims(clock, sub='uid-2')),))
+    refresher.start()
+    try:
+        assert started.wait(5)
+        # The refresh is stuck upstream; a known kid still verifies
+        assert verifier.verify(sign(key, claims(clock, sub='uid-3')))["sub"] == 'uid-3'
+    finally:
+        release.set()
+        refresher.join(5)
+    assert keys.fetches == 2
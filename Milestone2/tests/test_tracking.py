@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+
+from tracking import MultiObjectTracker, VideoCountSummary, _greedy_assign, _hungarian_assign
+
+
+def det(x, y=50, radius=10):
+    return {"center": [x, y], "radius": radius, "area": 3.14 * radius * radius,
+            "bbox": [x - radius, y - radius, 2 * radius, 2 * radius]}
+
+
+def frames(*xs_per_frame):
+    """One detection list per frame from x positions."""
+    return [[det(x) for x in xs] for xs in xs_per_frame]
+
+
+def test_greedy_takes_cheapest_pair_first():
+    cost = np.array([[1.0, 2.0], [2.0, 10.0]])
+    assert _greedy_assign(cost) == ([0, 1], [0, 1])
+
+
+def test_hungarian_minimises_total_cost():
+    pytest.importorskip('scipy')
+    cost = np.array([[1.0, 2.0], [2.0, 10.0]])
+    rows, cols = _hungarian_assign(cost)
+    assert sorted(zip(rows, cols)) == [(0, 1), (1, 0)]
+
+
+@pytest.mark.parametrize('assign', [_greedy_assign, _hungarian_assign])
+def test_assignment_skips_gated_pairs(assign):
+    cost = np.array([[np.inf, 0.5], [np.inf, np.inf]])
+    assert assign(cost) == ([0], [1])
+
+
+@pytest.mark.parametrize('matcher', ['greedy', 'hungarian'])
+def test_ids_follow_moving_objects(matcher):
+    tracker = MultiObjectTracker(matcher=matcher)
+    ids = [[d["id"] for d in tracker.update(dets, i)] for i, dets in enumerate(frames([100, 300], [105, 295], [110, 290]))]
+    assert ids == [[1, 2], [1, 2], [1, 2]]
+    assert tracker.confirmed_total == 2
+
+
+def test_hungarian_matcher_avoids_greedy_steal():
+    pytest.importorskip('scipy')
+    # The second track is closest to the first detection; greedy gives it that one,
+    # leaving the first track nothing within its 10 px gate, so a new track is born
+    trackers = {m: MultiObjectTracker(matcher=m, gate=1.0, min_gate_px=0) for m in ('greedy', 'hungarian')}
+    for tracker in trackers.values():
+        tracker.update([det(100), det(110)], 0)
+        tracker.update([det(108), det(119)], 1)
+    assert trackers['greedy']._next_key == 3
+    assert trackers['hungarian']._next_key == 2
+    assert [d["id"] for d in trackers['hungarian'].update([det(108), det(119)], 2)] == [1, 2]
+
+
+def test_centroid_gate():
+    tracker = MultiObjectTracker()
+    tracker.update([det(100)], 0)
+    # Gate is max(radius * 1.5, 20 px)
+    assert tracker.update([det(119)], 1)[0]["id"] == 1
+    assert tracker.update([det(140)], 2)[0]["id"] == 2
+
+
+def test_iou_metric():
+    tracker = MultiObjectTracker(metric='iou', min_iou=0.3)
+    tracker.update([det(100)], 0)
+    assert tracker.update([det(104)], 1)[0]["id"] == 1
+    # 20 px boxes 15 px apart overlap far less than min_iou
+    assert tracker.update([det(119)], 2)[0]["id"] == 2
+
+
+def test_confirmation_after_min_hits():
+    tracker = MultiObjectTracker(min_hits=3)
+    results = [tracker.update(dets, i) for i, dets in enumerate(frames([100], [102], [104], [106]))]
+    assert ["id" in r[0] for r in results] == [False, False, True, True]
+    assert all(r[0]["track"] == 0 for r in results)
+    assert tracker.confirmed_total == 1
+    assert [t.id for t in tracker.live_tracks()] == [1]
+
+
+def test_unconfirmed_track_is_never_counted():
+    ended = []
+    tracker = MultiObjectTracker(min_hits=3, max_missed=1, on_track_end=ended.append)
+    for i, dets in enumerate(frames([100], [102], [], [])):
+        tracker.update(dets, i)
+    assert tracker.confirmed_total == 0
+    assert ended == []
+    assert tracker.active_count == 0
+
+
+def test_retirement_after_max_missed():
+    ended = []
+    tracker = MultiObjectTracker(max_missed=2, on_track_end=ended.append)
+    tracker.update([det(100)], 0)
+    tracker.update([], 1)
+    tracker.update([], 2)
+    assert tracker.active_count == 1 and ended == []
+    # Seen again within max_missed: same ID
+    assert tracker.update([det(100)], 3)[0]["id"] == 1
+    for i in range(4, 7):
+        tracker.update([], i)
+    assert [(t.id, t.first_frame, t.last_frame) for t in ended] == [(1, 0, 3)]
+    assert tracker.active_count == 0
+    assert tracker.update([det(100)], 7)[0]["id"] == 2
+
+
+def test_move_updates_unconfirmed_tracks():
+    tracker = MultiObjectTracker(min_hits=3)
+    first = tracker.update([det(100)], 0)[0]
+    # Propagated 30 px per frame, further than one gate from the keyframe position
+    tracker.move([dict(first, center=[130, 50], bbox=[120, 40, 20, 20])])
+    tracker.move([dict(first, center=[160, 50], bbox=[150, 40, 20, 20])])
+    assert tracker.update([det(165)], 3)[0]["track"] == first["track"]
+    assert tracker._next_key == 1
+
+
+def test_finish_reports_live_confirmed_tracks():
+    ended = []
+    tracker = MultiObjectTracker(min_hits=2, on_track_end=ended.append)
+    tracker.update([det(100), det(300)], 0)
+    tracker.update([det(100)], 1)
+    tracker.finish()
+    assert [t.id for t in ended] == [1]
+    assert tracker.active_count == 0
+
+
+def test_summary_timeline_and_cumulative_totals():
+    summary = VideoCountSummary(fps=2)
+    # Seconds: 0 = frames 0-1, 1 = frames 2-3, 2 = frames 4-5
+    for i, dets in enumerate(frames([100], [100], [100, 300], [100, 300], [300, 500], [300, 500])):
+        summary.update(i, dets)
+    result = summary.result()
+    # min_hits is 3, so each apple counts in the second of its third sighting
+    assert result["timeline"] == [
+        {"second": 0, "visible": 1, "new": 0, "cumulative": 0},
+        {"second": 1, "visible": 2, "new": 1, "cumulative": 1},
+        {"second": 2, "visible": 2, "new": 1, "cumulative": 2},
+    ]
+    assert result["unique_total"] == 2
+    assert [(t["id"], t["first_frame"], t["last_frame"]) for t in result["tracks"]] == [(1, 0, 3), (2, 2, 5)]
+    assert result["tracks"][1]["first_seconds"] == 1.0
+    assert result["tracks"][1]["last_seconds"] == 2.5
+
+
+def test_summary_snapshot_leaves_tracks_running():
+    summary = VideoCountSummary(fps=10)
+    for i, dets in enumerate(frames([100], [100], [100])):
+        summary.update(i, dets)
+    snapshot = summary.result(finish=False)
+    assert [t["id"] for t in snapshot["tracks"]] == [1]
+    assert summary.tracks == []
+    assert summary.tracker.active_count == 1
+    # The same track keeps its ID after the snapshot
+    assert summary.update(3, [det(100)])[0]["id"] == 1
+    final = summary.result()
+    assert [(t["id"], t["last_frame"]) for t in final["tracks"]] == [(1, 3)]
+    assert summary.tracker.active_count == 0
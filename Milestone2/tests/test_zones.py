@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from zones import MAX_ZONES, OccupancyCounter, ZoneLayout, parse_lines, parse_zones
+
+SHAPE = (200, 300)
+
+
+def box(cx, cy, w=60, h=40):
+    return [cx - w // 2, cy - h // 2, cx + w // 2, cy + h // 2]
+
+
+def test_parse_zones_forms():
+    zones = parse_zones('[{"name": "door", "points": [[0, 0], [10, 0], [10, 10]]},'
+                        ' {"rect": [5, 6, 7, 8]}, [1, 2, 3, 4]]')
+    assert zones == [
+        {"name": 'door', "points": [(0, 0), (10, 0), (10, 10)]},
+        {"name": 'zone2', "points": [(5, 6), (7, 6), (7, 8), (5, 8)]},
+        {"name": 'zone3', "points": [(1, 2), (3, 2), (3, 4), (1, 4)]},
+    ]
+    assert parse_zones(None) == [] and parse_zones('') == []
+
+
+@pytest.mark.parametrize('value, message', [
+    ('{bad', 'valid JSON'),
+    ('{"name": "a"}', 'must be a list'),
+    ('[{"name": "a"}]', 'points or rect'),
+    ('[[1, 2, 3]]', 'points or rect'),
+    ('[{"points": [[0, 0], [1, 1]]}]', 'at least 3 points'),
+    ('[{"points": [[0, 0], [1], [2, 2]]}]', r'\[x, y\] points'),
+])
+def test_parse_zones_rejects(value, message):
+    with pytest.raises(ValueError, match=message):
+        parse_zones(value)
+
+
+def test_parse_zones_limit():
+    rects = [[i, 0, i + 1, 1] for i in range(MAX_ZONES)]
+    assert len(parse_zones(rects)) == MAX_ZONES
+    with pytest.raises(ValueError, match=f'At most {MAX_ZONES}'):
+        parse_zones(rects + [[0, 0, 1, 1]])
+
+
+def test_parse_lines():
+    assert parse_lines([{"name": 'gate', "points": [[0, 0], [10, 0], [20, 0]]}, [[1, 1], [2, 2]]]) == [
+        {"name": 'gate', "points": [(0, 0), (10, 0)]},
+        {"name": 'line2', "points": [(1, 1), (2, 2)]},
+    ]
+    with pytest.raises(ValueError, match='at least 2 points'):
+        parse_lines([[[0, 0]]])
+    with pytest.raises(ValueError, match='must be a list'):
+        parse_lines('{"points": []}')
+
+
+def test_overlapping_zone_membership():
+    layout = ZoneLayout.parse([{"name": 'left', "rect": [0, 0, 150, 200]},
+                               {"name": 'middle', "rect": [100, 0, 200, 200]},
+                               {"name": 'triangle', "points": [[200, 0], [299, 0], [299, 199]]}])
+    centers = [[50, 100], [120, 100], [180, 100], [290, 10], [210, 150], [-5, 100], [50, 250]]
+    assert layout.membership(centers, SHAPE).tolist() == [
+        [True, False, False],
+        [True, True, False],
+        [False, True, False],
+        [False, False, True],
+        [False, False, False],
+        # Outside the frame: in no zone, even though clipping would land inside one
+        [False, False, False],
+        [False, False, False],
+    ]
+    assert layout.counts(centers, SHAPE) == {"left": 2, "middle": 2, "triangle": 1}
+
+
+def test_mask_uses_every_bit_up_to_the_limit():
+    # Overlapping vertical strips: pixel x lies in zones x-1, x and x+1 (where they exist)
+    layout = ZoneLayout(parse_zones([[max(i - 1, 0), 0, i + 1, 0] for i in range(MAX_ZONES)]))
+    membership = layout.membership([[x, 0] for x in range(MAX_ZONES)], (1, MAX_ZONES + 1))
+    expected = np.zeros((MAX_ZONES, MAX_ZONES), bool)
+    for x in range(MAX_ZONES):
+        expected[x, max(x - 1, 0):x + 2] = True
+    assert membership.tolist() == expected.tolist()
+    assert layout.mask((1, MAX_ZONES + 1)).dtype == np.uint64
+    assert layout.membership([[63, 0]], (1, MAX_ZONES + 1))[0, MAX_ZONES - 1]
+
+
+def test_mask_is_cached_per_frame_size():
+    layout = ZoneLayout.parse([[0, 0, 10, 10]])
+    first = layout.mask(SHAPE)
+    assert layout.mask(SHAPE + (3,)) is first
+    assert layout.mask((100, 100)) is not first
+
+
+def test_empty_layout():
+    layout = ZoneLayout.parse()
+    assert not layout
+    assert layout.membership([[1, 1]], SHAPE).shape == (1, 0)
+
+
+def test_dwell_time_and_visits():
+    layout = ZoneLayout.parse([{"name": 'desk', "rect": [100, 0, 200, 200]}])
+    counter = OccupancyCounter(layout, fps=10)
+    path = [60, 80, 110, 130, 150, 170, 190, 210, 230]
+    for frame, x in enumerate(path):
+        ids, result = counter.update([box(x, 100)], SHAPE, frame)
+        assert ids == [1]
+        if frame == 4:
+            # In since frame 2
+            assert result["zones"]["desk"] == {"count": 1, "visits": 0, "mean_dwell_seconds": 0.0,
+                                               "current_mean_dwell_seconds": 0.2}
+    # Inside for frames 2-6, so 5 frames at 10 fps
+    assert result["zones"]["desk"] == {"count": 0, "visits": 1, "mean_dwell_seconds": 0.5,
+                                       "current_mean_dwell_seconds": 0.0}
+
+
+def test_track_ending_closes_visit():
+    layout = ZoneLayout.parse([[0, 0, 300, 200]])
+    counter = OccupancyCounter(layout, fps=10)
+    for frame in range(3):
+        counter.update([box(100, 100)], SHAPE, frame)
+    result = counter.finish()
+    # Last seen at frame 2, so the visit covers frames 0-2
+    assert result["zones"]["zone1"]["visits"] == 1
+    assert result["zones"]["zone1"]["mean_dwell_seconds"] == 0.3
+    assert result["zones"]["zone1"]["count"] == 0
+
+
+def test_line_crossings_in_and_out():
+    # Pointing down the image; moving from larger x to smaller x crosses left to right
+    layout = ZoneLayout.parse(lines=[{"name": 'door', "points": [[150, 50], [150, 150]]}])
+    counter = OccupancyCounter(layout)
+    for frame, x in enumerate([170, 160, 145, 135]):
+        _, result = counter.update([box(x, 100)], SHAPE, frame)
+    assert result["lines"] == {"door": {"in": 1, "out": 0}}
+    for frame, x in enumerate([135, 145, 155, 165], start=4):
+        _, result = counter.update([box(x, 100)], SHAPE, frame)
+    assert result["lines"] == {"door": {"in": 1, "out": 1}}
+
+
+def test_crossing_beside_the_segment_is_ignored():
+    layout = ZoneLayout.parse(lines=[[[150, 0], [150, 40]]])
+    counter = OccupancyCounter(layout)
+    for frame, x in enumerate([170, 160, 145, 135]):
+        _, result = counter.update([box(x, 150)], SHAPE, frame)
+    assert result["lines"] == {"line1": {"in": 0, "out": 0}}
+
+
+def test_two_people_tracked_separately():
+    layout = ZoneLayout.parse([[0, 0, 150, 200], [150, 0, 300, 200]])
+    counter = OccupancyCounter(layout)
+    for frame in range(3):
+        ids, result = counter.update([box(60, 100), box(240, 100)], SHAPE, frame)
+    assert ids == [1, 2]
+    assert [z["count"] for z in result["zones"].values()] == [1, 1]
@@ -0,0 +1,217 @@
+import os
+import time
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from metrics import register_collector
+
+# Local verification of Firebase ID tokens.
+#
+# ID tokens are RS256 JWTs signed with Google's rotating securetoken keys.
+# The public keys are fetched as JWKs and cached for as long as the response's
+# Cache-Control max-age allows, and verified claims are kept in a small
+# TTL/LRU cache keyed by a hash of the token. Logins and session checks can
+# then confirm a token (and read claims such as email_verified) without a
+# round-trip to the Identity Toolkit.
+
+FIREBASE_JWKS_URL = os.getenv(
+    'FIREBASE_JWKS_URL',
+    'https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com')
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 4096))
+TOKEN_CACHE_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_TTL_SECONDS', 300))
+# Allowed clock skew when checking exp/iat/auth_time
+TOKEN_CLOCK_SKEW_SECONDS = int(os.getenv('TOKEN_CLOCK_SKEW_SECONDS', 60))
+
+# Used when the key response has no usable max-age
+_DEFAULT_KEYS_MAX_AGE = 3600
+# An unknown kid triggers at most one refetch per this many seconds
+_MIN_REFETCH_SECONDS = 30
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _b64decode(segment):
+    return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+
+
+def _max_age(cache_control):
+    for directive in (cache_control or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        if name.lower() == 'max-age' and value.isdigit():
+            return int(value)
+    return _DEFAULT_KEYS_MAX_AGE
+
+
+def _fetch_keys(url):
+    """GET the JWK set. Returns (jwks dict, max-age seconds)."""
+    import requests
+
+    response = requests.get(url, timeout=(3.05, 10))
+    response.raise_for_status()
+    return response.json(), _max_age(response.headers.get('Cache-Control'))
+
+
+class TokenVerifier:
+    """Verifies Firebase ID tokens for one project against cached Google JWKs.
+
+    fetch_keys(url) -> (jwks, max_age) can be replaced, e.g. to test against
+    a locally generated key set.
+    """
+
+    def __init__(self, project_id, jwks_url=FIREBASE_JWKS_URL, fetch_keys=_fetch_keys,
+                 cache_size=TOKEN_CACHE_SIZE, cache_ttl=TOKEN_CACHE_TTL_SECONDS,
+                 clock_skew=TOKEN_CLOCK_SKEW_SECONDS):
+        self.project_id = project_id
+        self.issuer = f'https://securetoken.google.com/{project_id}'
+        self.jwks_url = jwks_url
+        self.fetch_keys = fetch_keys
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.clock_skew = clock_skew
+        self._keys = {}
+        self._keys_expire = 0.0
+        self._last_fetch = 0.0
+        self._claims = OrderedDict()  # sha256(token) -> (claims, cache expiry)
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _load_keys(self):
+        from Crypto.PublicKey import RSA
+
+        jwks, max_age = self.fetch_keys(self.jwks_url)
+        keys = {}
+        for jwk in jwks.get('keys', []):
+            if jwk.get('kty') == 'RSA' and 'kid' in jwk:
+                n = int.from_bytes(_b64decode(jwk['n']), 'big')
+                e = int.from_bytes(_b64decode(jwk['e']), 'big')
+                keys[jwk['kid']] = RSA.construct((n, e))
+        return keys, max_age
+
+    def _public_key(self, kid):
+        with self._lock:
+            key = self._keys.get(kid)
+            fresh = time.time() < self._keys_expire
+            fetched = self._last_fetch
+        if key is not None and fresh:
+            return key
+        if key is None and fresh and time.time() - fetched < _MIN_REFETCH_SECONDS:
+            return None
+        # One caller fetches at a time, outside self._lock so cached keys stay readable.
+        # While stale keys are refreshed, callers whose key is known keep using it.
+        if not self._fetch_lock.acquire(blocking=key is None):
+            return key
+        try:
+            with self._lock:
+                if self._last_fetch != fetched:
+                    # Fetched by another caller while this one waited
+                    return self._keys.get(kid)
+            keys, max_age = self._load_keys()
+            now = time.time()
+            with self._lock:
+                self._keys = keys
+                self._keys_expire = now + max_age
+                self._last_fetch = now
+            return keys.get(kid)
+        finally:
+            self._fetch_lock.release()
+
+    def _verify_uncached(self, token):
+        from Crypto.Hash import SHA256
+        from Crypto.Signature import pkcs1_15
+
+        try:
+            header_b64, payload_b64, signature_b64 = token.split('.')
+            header = json.loads(_b64decode(header_b64))
+            claims = json.loads(_b64decode(payload_b64))
+            signature = _b64decode(signature_b64)
+            if not isinstance(header, dict) or not isinstance(claims, dict):
+                raise ValueError("JWT header and payload must be objects")
+        except (ValueError, AttributeError):
+            raise InvalidToken("Malformed token")
+        if header.get('alg') != 'RS256':
+            raise InvalidToken("Unexpected signing algorithm")
+        key = self._public_key(header.get('kid'))
+        if key is None:
+            raise InvalidToken("Unknown signing key")
+        try:
+            pkcs1_15.new(key).verify(SHA256.new(f'{header_b64}.{payload_b64}'.encode('ascii')), signature)
+        except ValueError:
+            raise InvalidToken("Bad signature")
+        if claims.get('aud') != self.project_id or claims.get('iss') != self.issuer:
+            raise InvalidToken("Token is for another project")
+        if not claims.get('sub'):
+            raise InvalidToken("Token has no subject")
+        return claims
+
+    def _check_times(self, claims):
+        now = time.time()
+        if claims.get('exp', 0) < now - self.clock_skew:
+            raise InvalidToken("Token expired")
+        if claims.get('iat', 0) > now + self.clock_skew or claims.get('auth_time', 0) > now + self.clock_skew:
+            raise InvalidToken("Token issued in the future")
+
+    def verify(self, token, check_expiry=True):
+        """Return the token's claims or raise InvalidToken.
+
+        check_expiry=False accepts an otherwise valid token past its exp,
+        for session checks where the Flask session's own lifetime applies.
+        """
+        digest = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        with self._lock:
+            cached = self._claims.get(digest)
+            if cached is not None and cached[1] > now:
+                self._claims.move_to_end(digest)
+                self.hits += 1
+                claims = cached[0]
+            else:
+                claims = None
+                self.misses += 1
+        if claims is None:
+            claims = self._verify_uncached(token)
+            with self._lock:
+                self._claims[digest] = (claims, now + self.cache_ttl)
+                self._claims.move_to_end(digest)
+                while len(self._claims) > self.cache_size:
+                    self._claims.popitem(last=False)
+        if check_expiry:
+            self._check_times(claims)
+        return claims
+
+    def forget(self, token):
+        """Drop a token's cached claims (e.g. on logout)."""
+        with self._lock:
+            self._claims.pop(hashlib.sha256(token.encode('utf-8')).digest(), None)
+
+
+_verifier = None
+_verifier_lock = threading.Lock()
+
+
+def get_verifier():
+    """The shared TokenVerifier for this app's Firebase project."""
+    global _verifier
+    if _verifier is None:
+        with _verifier_lock:
+            if _verifier is None:
+                from firebase_config import firebase_config
+                _verifier = TokenVerifier(firebase_config['projectId'])
+    return _verifier
+
+
+def _collect_metrics():
+    if _verifier is None:
+        return []
+    return [
+        ('token_cache_hits_total', 'counter', 'ID tokens answered from the verified-claims cache.', [({}, _verifier.hits)]),
+        ('token_cache_misses_total', 'counter', 'ID tokens verified by signature.', [({}, _verifier.misses)]),
+    ]
+
+
+register_collector(_collect_metrics)
@@ -0,0 +1,331 @@
+import os
+
+import cv2
+import numpy as np
+
+from apple_detection import find_apples_in_bgr_image, draw_detections
+
+# Keyframe detection with cheap tracking in between.
+#
+# The full HSV/morphology/contour pass runs every APPLE_DETECT_EVERY frames,
+# or sooner when the scene changes. On the frames in between, apple centres
+# are carried forward with sparse Lucas-Kanade optical flow. A multi-object
+# tracker gives every apple an ID that stays stable across frames, which also
+# yields unique-apple totals for a whole video in one streaming pass.
+
+APPLE_DETECT_EVERY = int(os.getenv('APPLE_DETECT_EVERY', 1))
+# Mean absolute difference (0-255) between tiny grey thumbnails that forces a keyframe
+APPLE_SCENE_CHANGE = float(os.getenv('APPLE_SCENE_CHANGE', 25))
+
+_THUMB_SIZE = (64, 36)
+# Flow runs on a half-size grey frame; apples are large, smooth blobs so little accuracy is lost
+_FLOW_SCALE = 0.5
+_LK_PARAMS = dict(winSize=(15, 15), maxLevel=2,
+                  criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+
+def _box_iou(a, b):
+    """Pairwise IoU between (N, 4) and (M, 4) arrays of x, y, w, h boxes."""
+    ax1, ay1 = a[:, 0:1], a[:, 1:2]
+    ax2, ay2 = ax1 + a[:, 2:3], ay1 + a[:, 3:4]
+    bx1, by1 = b[:, 0], b[:, 1]
+    bx2, by2 = bx1 + b[:, 2], by1 + b[:, 3]
+    iw = np.clip(np.minimum(ax2, bx2) - np.maximum(ax1, bx1), 0, None)
+    ih = np.clip(np.minimum(ay2, by2) - np.maximum(ay1, by1), 0, None)
+    inter = iw * ih
+    union = (a[:, 2:3] * a[:, 3:4]) + (b[:, 2] * b[:, 3]) - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def _greedy_assign(cost):
+    rows, cols = [], []
+    used_rows, used_cols = set(), set()
+    for flat in np.argsort(cost, axis=None):
+        r, c = divmod(int(flat), cost.shape[1])
+        if not np.isfinite(cost[r, c]):
+            break
+        if r in used_rows or c in used_cols:
+            continue
+        used_rows.add(r)
+        used_cols.add(c)
+        rows.append(r)
+        cols.append(c)
+    return rows, cols
+
+
+def _hungarian_assign(cost):
+    try:
+        from scipy.optimize import linear_sum_assignment
+    except ImportError:
+        return _greedy_assign(cost)
+    finite = np.where(np.isfinite(cost), cost, 1e6)
+    rows, cols = linear_sum_assignment(finite)
+    keep = [i for i, (r, c) in enumerate(zip(rows, cols)) if np.isfinite(cost[r, c])]
+    return [int(rows[i]) for i in keep], [int(cols[i]) for i in keep]
+
+
+class _Track:
+    __slots__ = ('key', 'id', 'center', 'radius', 'bbox', 'hits', 'missed', 'first_frame', 'last_frame')
+
+    def __init__(self, key, det, frame_index):
+        self.key = key
+        self.id = None
+        self.hits = 0
+        self.missed = 0
+        self.first_frame = frame_index
+        self.observe(det, frame_index)
+
+    def observe(self, det, frame_index):
+        self.center = det["center"]
+        self.radius = det["radius"]
+        self.bbox = det["bbox"]
+        self.hits += 1
+        self.missed = 0
+        self.last_frame = frame_index
+
+
+class MultiObjectTracker:
+    """Associates per-frame detections into tracks with persistent IDs.
+
+    metric is 'centroid' (centres within gate times the larger radius) or
+    'iou' (bbox IoU of at least min_iou); matcher is 'greedy' or 'hungarian'
+    (scipy if installed, otherwise greedy). A track gets its public ID once it
+    has min_hits detections, and dies after more than max_missed updates
+    without one. on_track_end(track) is called for every confirmed track
+    that dies, so callers can keep summaries without the tracker holding
+    finished tracks.
+    """
+
+    def __init__(self, metric='centroid', matcher='greedy', gate=1.5, min_gate_px=20, min_iou=0.3,
+                 max_missed=2, min_hits=1, on_track_end=None):
+        self.metric = metric
+        self.matcher = matcher
+        self.gate = gate
+        self.min_gate_px = min_gate_px
+        self.min_iou = min_iou
+        self.max_missed = max_missed
+        self.min_hits = min_hits
+        self.on_track_end = on_track_end
+        self._tracks = []
+        self._next_key = 0
+        self._next_id = 1
+        self.confirmed_total = 0
+
+    @property
+    def active_count(self):
+        return len(self._tracks)
+
+    def _cost(self, detections):
+        if self.metric == 'iou':
+            t_boxes = np.array([t.bbox for t in self._tracks], np.float32)
+            d_boxes = np.array([d["bbox"] for d in detections], np.float32)
+            iou = _box_iou(t_boxes, d_boxes)
+            return np.where(iou >= self.min_iou, 1.0 - iou, np.inf)
+        t_centers = np.array([t.center for t in self._tracks], np.float32)
+        t_radii = np.array([t.radius for t in self._tracks], np.float32)
+        d_centers = np.array([d["center"] for d in detections], np.float32)
+        d_radii = np.array([d["radius"] for d in detections], np.float32)
+        dist = np.linalg.norm(t_centers[:, None, :] - d_centers[None, :, :], axis=2)
+        gate = np.maximum(np.maximum(t_radii[:, None], d_radii[None, :]) * self.gate, self.min_gate_px)
+        return np.where(dist <= gate, dist / gate, np.inf)
+
+    def update(self, detections, frame_index=None):
+        """Match detections to tracks and set "id" on those belonging to confirmed tracks.
+
+        Every detection also gets "track", the internal key of its track
+        (confirmed or not), which move() uses.
+        """
+        matched_tracks = set()
+        matched_dets = {}
+        if self._tracks and detections:
+            assign = _hungarian_assign if self.matcher == 'hungarian' else _greedy_assign
+            rows, cols = assign(self._cost(detections))
+            for r, c in zip(rows, cols):
+                matched_tracks.add(r)
+                matched_dets[c] = self._tracks[r]
+        survivors = []
+        for i, track in enumerate(self._tracks):
+            if i in matched_tracks:
+                survivors.append(track)
+                continue
+            track.missed += 1
+            if track.missed <= self.max_missed:
+                survivors.append(track)
+            elif track.id is not None and self.on_track_end is not None:
+                self.on_track_end(track)
+        for di, det in enumerate(detections):
+            track = matched_dets.get(di)
+            if track is None:
+                track = _Track(self._next_key, det, frame_index)
+                self._next_key += 1
+                survivors.append(track)
+            else:
+                track.observe(det, frame_index)
+            det["track"] = track.key
+            if track.id is None and track.hits >= self.min_hits:
+                track.id = self._next_id
+                self._next_id += 1
+                self.confirmed_total += 1
+            if track.id is not None:
+                det["id"] = track.id
+        self._tracks = survivors
+        return detections
+
+    def move(self, detections):
+        """Update track positions from propagated detections carrying "track" from update()."""
+        by_key = {t.key: t for t in self._tracks}
+        for det in detections:
+            track = by_key.get(det.get("track"))
+            if track is not None:
+                track.center = det["center"]
+                track.bbox = det["bbox"]
+
+    def live_tracks(self):
+        """Confirmed tracks that are still active."""
+        return [t for t in self._tracks if t.id is not None]
+
+    def finish(self):
+        """End every live track (e.g. at end of video), reporting confirmed ones."""
+        if self.on_track_end is not None:
+            for track in self._tracks:
+                if track.id is not None:
+                    self.on_track_end(track)
+        self._tracks = []
+
+
+class VideoCountSummary:
+    """Unique-apple totals, per-track spans and a per-second timeline for one video.
+
+    Fed one frame at a time; only finished-track records and one timeline
+    entry per second are kept, never frames or per-frame detections.
+    """
+
+    def __init__(self, fps, tracker=None):
+        self.fps = fps or 24.0
+        self.tracker = tracker or MultiObjectTracker(min_hits=3, on_track_end=self._track_ended)
+        if self.tracker.on_track_end is None:
+            self.tracker.on_track_end = self._track_ended
+        self.tracks = []
+        self._seconds = {}  # second -> [max visible, new confirmed]
+        self._last_confirmed = 0
+
+    def _track_record(self, track):
+        return {
+            "id": track.id,
+            "first_frame": track.first_frame,
+            "last_frame": track.last_frame,
+            "first_seconds": round(track.first_frame / self.fps, 2),
+            "last_seconds": round(track.last_frame / self.fps, 2),
+        }
+
+    def _track_ended(self, track):
+        self.tracks.append(self._track_record(track))
+
+    def observe(self, frame_index, detections):
+        """Record detections already passed through the tracker for frame_index."""
+        second = int(frame_index / self.fps)
+        entry = self._seconds.setdefault(second, [0, 0])
+        entry[0] = max(entry[0], len(detections))
+        confirmed = self.tracker.confirmed_total
+        entry[1] += confirmed - self._last_confirmed
+        self._last_confirmed = confirmed
+
+    def update(self, frame_index, detections):
+        """Track detections for frame_index, record them, and return them with IDs."""
+        self.tracker.update(detections, frame_index)
+        self.observe(frame_index, detections)
+        return detections
+
+    @property
+    def unique_total(self):
+        return self.tracker.confirmed_total
+
+    def result(self, finish=True):
+        """Summary dict. finish=False leaves tracks running (for a snapshot mid-video)."""
+        if finish:
+            self.tracker.finish()
+            tracks = list(self.tracks)
+        else:
+            tracks = list(self.tracks) + [self._track_record(t) for t in self.tracker.live_tracks()]
+        cumulative = 0
+        timeline = []
+        # Copied first so a snapshot from another thread never iterates a changing dict
+        for second, (visible, new) in sorted(dict(self._seconds).items()):
+            cumulative += new
+            timeline.append({"second": second, "visible": visible, "new": new, "cumulative": cumulative})
+        return {
+            "unique_total": self.unique_total,
+            "tracks": sorted(tracks, key=lambda t: t["id"]),
+            "timeline": timeline,
+        }
+
+
+class KeyframeTracker:
+    """Detect on keyframes, propagate with optical flow in between. One per stream."""
+
+    def __init__(self, detect_every=APPLE_DETECT_EVERY, scene_change=APPLE_SCENE_CHANGE, tracker=None):
+        self.detect_every = max(1, int(detect_every))
+        self.scene_change = scene_change
+        self.tracker = tracker or MultiObjectTracker()
+        self._prev_gray = None
+        self._prev_thumb = None
+        self._detections = []
+        self._since_keyframe = 0
+        self.keyframes = 0
+
+    def _is_keyframe(self, gray, thumb):
+        if self._prev_gray is None or gray.shape != self._prev_gray.shape:
+            return True
+        if self._since_keyframe >= self.detect_every:
+            return True
+        diff = cv2.absdiff(thumb, self._prev_thumb)
+        return float(diff.mean()) > self.scene_change
+
+    def _propagate(self, gray):
+        if not self._detections:
+            return []
+        points = np.array([d["center"] for d in self._detections], np.float32).reshape(-1, 1, 2)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points * _FLOW_SCALE, None,
+                                                    **_LK_PARAMS)
+        moved /= _FLOW_SCALE
+        h, w = gray.shape[0] / _FLOW_SCALE, gray.shape[1] / _FLOW_SCALE
+        propagated = []
+        for det, (nx, ny), ok in zip(self._detections, moved.reshape(-1, 2), status.ravel()):
+            if not ok or not (0 <= nx < w and 0 <= ny < h):
+                continue
+            cx, cy = int(nx), int(ny)
+            dx, dy = cx - det["center"][0], cy - det["center"][1]
+            bx, by, bw, bh = det["bbox"]
+            propagated.append(dict(det, center=[cx, cy], bbox=[bx + dx, by + dy, bw, bh]))
+        self.tracker.move(propagated)
+        return propagated
+
+    def update(self, bgr_image, min_area=None, frame_index=None):
+        """Return detections (with "id") for this frame."""
+        if bgr_image is None or bgr_image.size == 0:
+            return []
+        if self.detect_every == 1:
+            return self.tracker.update(find_apples_in_bgr_image(bgr_image, min_area), frame_index)
+        small = cv2.resize(bgr_image, None, fx=_FLOW_SCALE, fy=_FLOW_SCALE, interpolation=cv2.INTER_LINEAR)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, _THUMB_SIZE, interpolation=cv2.INTER_AREA)
+        if self._is_keyframe(gray, thumb):
+            detections = self.tracker.update(find_apples_in_bgr_image(bgr_image, min_area), frame_index)
+            self._since_keyframe = 1
+            self.keyframes += 1
+        else:
+            detections = self._propagate(gray)
+            self._since_keyframe += 1
+        self._prev_gray = gray
+        self._prev_thumb = thumb
+        self._detections = detections
+        return detections
+
+    def detect(self, bgr_image, in_place=False, min_area=None, frame_index=None):
+        """Drop-in for detect_apples_in_bgr_image that labels apples by track ID."""
+        if bgr_image is None or bgr_image.size == 0:
+            return 0, None
+        detections = self.update(bgr_image, min_area, frame_index)
+        annotated = bgr_image if in_place else bgr_image.copy()
+        draw_detections(annotated, detections)
+        return len(detections), annotated
@@ -0,0 +1,232 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from flask import Request
+
+from metrics import stage
+
+# Upload handling that keeps detection traffic off the local disk.
+#
+# Multipart bodies are spooled into anonymous memory files (memfd) instead of
+# werkzeug's on-disk temp files, and OpenCV opens them straight from
+# /proc/<pid>/fd/<n>. Videos that must outlive a request (the file stream
+# routes) go to a managed directory with a byte quota and an idle TTL.
+# OpenCV/NumPy are imported inside the decode helpers so app.py can install
+# MemoryUploadRequest without loading them.
+
+APPLE_MEMORY_UPLOAD_MAX_BYTES = int(os.getenv('APPLE_MEMORY_UPLOAD_MAX_BYTES', 256 * 1024 * 1024))
+APPLE_UPLOAD_DIR = os.getenv('APPLE_UPLOAD_DIR') or os.path.join(tempfile.gettempdir(), 'apple_uploads')
+APPLE_UPLOAD_QUOTA_BYTES = int(os.getenv('APPLE_UPLOAD_QUOTA_BYTES', 2 * 1024 * 1024 * 1024))
+APPLE_UPLOAD_TTL_SECONDS = int(os.getenv('APPLE_UPLOAD_TTL_SECONDS', 3600))
+APPLE_UPLOAD_REAP_INTERVAL = int(os.getenv('APPLE_UPLOAD_REAP_INTERVAL', 60))
+
+_HAS_MEMFD = hasattr(os, 'memfd_create') and os.path.isdir('/proc/self/fd')
+_COPY_CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class MemoryUploadRequest(Request):
+    """Request that spools file uploads into memfd instead of a disk temp file.
+
+    Only bodies with a known length within APPLE_MEMORY_UPLOAD_MAX_BYTES go to
+    memory; chunked or larger bodies are spooled to disk as werkzeug does.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if _HAS_MEMFD and total_content_length is not None and total_content_length <= APPLE_MEMORY_UPLOAD_MAX_BYTES:
+            return open(os.memfd_create('apple-upload', os.MFD_CLOEXEC), 'w+b')
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+def _upload_fd(file_storage):
+    try:
+        return file_storage.stream.fileno()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _is_memfd(fd):
+    try:
+        return os.readlink(f'/proc/self/fd/{fd}').startswith('/memfd:')
+    except OSError:
+        return False
+
+
+def decode_image_upload(file_storage):
+    """Decode an uploaded image in memory. Returns None for unreadable data."""
+    import cv2
+    import numpy as np
+
+    data = file_storage.read()
+    if not data:
+        return None
+    with stage('decode'):
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+@contextmanager
+def open_video_upload(file_storage):
+    """Yield a cv2.VideoCapture over an upload, released on exit.
+
+    Uploads that already live in a file descriptor (memfd or werkzeug's
+    unnamed temp file) are opened in place with no extra copy.
+    """
+    import cv2
+
+    fd = _upload_fd(file_storage)
+    tmpdir = None
+    if fd is not None and os.path.isdir('/proc/self/fd'):
+        file_storage.stream.flush()
+        path = f'/proc/self/fd/{fd}'
+    else:
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'upload')
+        file_storage.save(path)
+    cap = cv2.VideoCapture(path)
+    try:
+        yield cap
+    finally:
+        cap.release()
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def hold_upload(file_storage, filename):
+    """Keep an upload alive past the request. Returns (path, release).
+
+    A memfd upload is kept in RAM by duplicating its descriptor; the returned
+    /proc/<pid>/fd path can be opened by worker processes too. Anything else
+    is saved to a private temp directory.
+    """
+    fd = _upload_fd(file_storage)
+    if fd is not None and _is_memfd(fd):
+        file_storage.stream.flush()
+        held = os.dup(fd)
+        return f'/proc/{os.getpid()}/fd/{held}', lambda: os.close(held)
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, filename)
+    file_storage.save(path)
+    return path, lambda: shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+class SessionVideoStore:
+    """Per-user uploaded videos on disk, bounded by a byte quota and an idle TTL.
+
+    A reaper thread deletes entries that have not been touched within the
+    TTL, plus files orphaned by earlier runs. When the quota is exceeded the
+    least recently used entries are evicted first. Files already open in a
+    stream keep playing after eviction (the inode lives until closed).
+    """
+
+    def __init__(self, root=APPLE_UPLOAD_DIR, quota_bytes=APPLE_UPLOAD_QUOTA_BYTES,
+                 ttl_seconds=APPLE_UPLOAD_TTL_SECONDS, reap_interval=APPLE_UPLOAD_REAP_INTERVAL):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.ttl_seconds = ttl_seconds
+        self.reap_interval = reap_interval
+        self._entries = {}  # owner -> [path, size, last_used]
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.reap_interval)
+                try:
+                    self.reap()
+                except Exception:
+                    pass
+
+        self._reaper = threading.Thread(target=loop, name='upload-reaper', daemon=True)
+        self._reaper.start()
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def put(self, owner, file_storage, filename):
+        """Store owner's upload, replacing any previous one. Returns its path."""
+        os.makedirs(self.root, exist_ok=True)
+        ext = os.path.splitext(filename)[1]
+        path = os.path.join(self.root, uuid.uuid4().hex + ext)
+        if file_storage.content_length and file_storage.content_length > self.quota_bytes:
+            raise UploadTooLarge()
+        # Counted while copying, so an oversized upload stops at the quota instead of filling the disk
+        size = 0
+        try:
+            with open(path, 'wb') as out:
+                for chunk in iter(lambda: file_storage.stream.read(_COPY_CHUNK), b''):
+                    size += len(chunk)
+                    if size > self.quota_bytes:
+                        raise UploadTooLarge()
+                    out.write(chunk)
+        except BaseException:
+            self._remove(path)
+            raise
+        with self._lock:
+            self._start_reaper()
+            previous = self._entries.pop(owner, None)
+            if previous is not None:
+                self._remove(previous[0])
+            self._entries[owner] = [path, size, time.time()]
+            self._enforce_quota()
+        return path
+
+    def get(self, owner):
+        """Return owner's video path (refreshing its TTL), or None."""
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is None:
+                return None
+            entry[2] = time.time()
+            return entry[0]
+
+    def pop(self, owner):
+        with self._lock:
+            entry = self._entries.pop(owner, None)
+        if entry is not None:
+            self._remove(entry[0])
+
+    def _enforce_quota(self):
+        total = sum(entry[1] for entry in self._entries.values())
+        for owner, entry in sorted(self._entries.items(), key=lambda item: item[1][2]):
+            if total <= self.quota_bytes:
+                break
+            del self._entries[owner]
+            self._remove(entry[0])
+            total -= entry[1]
+
+    def reap(self):
+        """Drop idle entries and any file in root no entry refers to."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            for owner, entry in list(self._entries.items()):
+                if entry[2] < cutoff:
+                    del self._entries[owner]
+                    self._remove(entry[0])
+            live = {entry[0] for entry in self._entries.values()}
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                if path not in live and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,354 @@
+import os
+import time
+import uuid
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError
+
+import cv2
+
+from video_pipeline import process_video
+from apple_detection import find_apples_in_bgr_image, draw_detections
+from tracking import KeyframeTracker, VideoCountSummary
+
+# Background processing for /apple/process-video and /people/process-video.
+# The frame loop runs in a bounded process pool so long clips never hold a
+# request thread, and the worker processes run at lower priority so auth
+# routes stay responsive.
+
+VIDEO_JOB_WORKERS = int(os.getenv('VIDEO_JOB_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+VIDEO_JOB_MAX_PENDING = int(os.getenv('VIDEO_JOB_MAX_PENDING', 8))
+VIDEO_JOB_TTL_SECONDS = int(os.getenv('VIDEO_JOB_TTL_SECONDS', 3600))
+VIDEO_JOB_NICE = int(os.getenv('VIDEO_JOB_NICE', 10))
+# Detector threads per job; by default the cores are shared out between job workers
+VIDEO_JOB_THREADS = int(os.getenv('VIDEO_JOB_THREADS', max(1, (os.cpu_count() or 1) // VIDEO_JOB_WORKERS)))
+
+# Progress is pushed to the parent at most this often to keep IPC off the hot loop
+_PROGRESS_EVERY_FRAMES = 10
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _init_video_worker(nice_increment):
+    """Leave threading to the pipeline and run below the web workers' priority."""
+    try:
+        cv2.setNumThreads(1)
+    except Exception:
+        pass
+    if nice_increment and hasattr(os, 'nice'):
+        try:
+            os.nice(nice_increment)
+        except OSError:
+            pass
+
+
+def _run_video_job(input_path, output_path, progress, cancel_event, detect_every=1):
+    """Annotate every frame of input_path into output_path. Runs in a worker process.
+
+    Returns (status, summary) where summary holds unique-apple totals from tracking.
+    """
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError("Cannot open video")
+    writer = None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        progress['frames_total'] = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        progress['started_at'] = time.time()
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+        def report(frames_done):
+            if frames_done % _PROGRESS_EVERY_FRAMES == 0:
+                progress['frames_done'] = frames_done
+
+        summary = VideoCountSummary(fps)
+        frame_numbers = iter(range(1 << 62))
+        if detect_every > 1:
+            # Keyframe tracking carries state from frame to frame, so it runs serially
+            keyframes = KeyframeTracker(detect_every, tracker=summary.tracker)
+
+            def annotate(frame):
+                index = next(frame_numbers)
+                detections = keyframes.update(frame, frame_index=index)
+                summary.observe(index, detections)
+                return draw_detections(frame, detections)
+
+            frames_done = process_video(cap, writer, annotate=annotate, workers=1,
+                                        on_progress=report, stop_event=cancel_event)
+        else:
+            # Detection fans out across threads; tracking and drawing run in frame order
+            def finalize(item):
+                frame, detections = item
+                summary.update(next(frame_numbers), detections)
+                return draw_detections(frame, detections)
+
+            frames_done = process_video(cap, writer, annotate=lambda f: (f, find_apples_in_bgr_image(f)),
+                                        finalize=finalize, workers=VIDEO_JOB_THREADS,
+                                        on_progress=report, stop_event=cancel_event)
+        if cancel_event.is_set():
+            return JOB_CANCELLED, None
+        progress['frames_done'] = frames_done
+        return JOB_DONE, summary.result()
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+
+
+def run_people_video_job(input_path, output_path, progress, cancel_event, zones=(), lines=()):
+    """Count people in every frame of input_path, writing annotated frames to output_path.
+
+    Frames go to the model in adaptive batches; the worker process loads the
+    model once and keeps it for later jobs. People are tracked across frames
+    for zone dwell time and line crossings. Returns (status, summary).
+    """
+    from people_detection import BatchSizer, draw_people, get_people_detector
+    from zones import ZoneLayout, OccupancyCounter
+
+    detector = get_people_detector()
+    cap = cv2.VideoCapture(input_path)
+    if not cap.isOpened():
+        raise RuntimeError("Cannot open video")
+    writer = None
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24.0
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        progress['frames_total'] = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        progress['started_at'] = time.time()
+        writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+        layout = ZoneLayout(zones, lines)
+        occupancy = OccupancyCounter(layout, fps)
+        sizer = BatchSizer()
+        frames_done = 0
+        total = 0
+        peak = 0
+        zone_peaks = {name: 0 for name in layout.names}
+        seconds = {}  # second -> peak count
+        ended = False
+        while not ended:
+            if cancel_event.is_set():
+                return JOB_CANCELLED, None
+            started = time.perf_counter()
+            frames = []
+            while len(frames) < sizer.size:
+                ok, frame = cap.read()
+                if not ok:
+                    ended = True
+                    break
+                frames.append(frame)
+            if not frames:
+                break
+            results = detector.count_batch(frames, layout)
+            sizer.record(time.perf_counter() - started)
+            for frame, result in zip(frames, results):
+                ids, _ = occupancy.update([d["bbox"] for d in result["detections"]], frame.shape, frames_done)
+                for det, track_id in zip(result["detections"], ids):
+                    det["id"] = track_id
+                writer.write(draw_people(frame, result, layout))
+                second = int(frames_done / fps)
+                seconds[second] = max(seconds.get(second, 0), result["count"])
+                total += result["count"]
+                peak = max(peak, result["count"])
+                for name, n in result["zones"].items():
+                    zone_peaks[name] = max(zone_peaks[name], n)
+                frames_done += 1
+                if frames_done % _PROGRESS_EVERY_FRAMES == 0:
+                    progress['frames_done'] = frames_done
+        progress['frames_done'] = frames_done
+        return JOB_DONE, {
+            "frames": frames_done,
+            "peak_count": peak,
+            "mean_count": round(total / frames_done, 2) if frames_done else 0.0,
+            "zone_peaks": zone_peaks,
+            "unique_people": occupancy.tracker.confirmed_total,
+            "occupancy": occupancy.finish(),
+            "timeline": [{"second": s, "peak_count": n} for s, n in sorted(seconds.items())],
+        }
+    finally:
+        cap.release()
+        if writer is not None:
+            writer.release()
+
+
+class VideoJob:
+    def __init__(self, job_id, owner, input_path, release_input, output_path, output_name,
+                 progress, cancel_event):
+        self.job_id = job_id
+        self.owner = owner
+        self.input_path = input_path
+        self.release_input = release_input
+        self.output_path = output_path
+        self.output_name = output_name
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.status = JOB_QUEUED
+        self.error = None
+        self.summary = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self.on_done = None
+
+    def snapshot(self):
+        """Return a JSON-friendly view of the job's state."""
+        try:
+            progress = dict(self.progress)
+        except Exception:
+            progress = {}
+        frames_done = progress.get('frames_done', 0)
+        frames_total = progress.get('frames_total', 0)
+        started_at = progress.get('started_at')
+        if self.status == JOB_QUEUED and started_at is not None:
+            self.status = JOB_RUNNING
+        eta = None
+        if self.status == JOB_RUNNING and started_at and frames_done and frames_total:
+            elapsed = time.time() - started_at
+            eta = max(elapsed / frames_done * (frames_total - frames_done), 0.0)
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "frames_done": frames_done,
+            "frames_total": frames_total,
+            "progress": (frames_done / frames_total) if frames_total else None,
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+            "error": self.error,
+            "summary": self.summary,
+        }
+
+
+class VideoJobManager:
+    """Bounded process pool plus an in-memory registry of submitted video jobs."""
+
+    def __init__(self, max_workers=VIDEO_JOB_WORKERS, max_pending=VIDEO_JOB_MAX_PENDING,
+                 ttl_seconds=VIDEO_JOB_TTL_SECONDS):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._manager = None
+
+    def _ensure_pool(self):
+        # Created on first submit so importing the app never forks workers
+        if self._executor is None:
+            self._manager = multiprocessing.Manager()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 initializer=_init_video_worker,
+                                                 initargs=(VIDEO_JOB_NICE,))
+
+    def _prune(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl_seconds]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _active_count(self):
+        return sum(1 for job in self._jobs.values() if job.finished_at is None)
+
+    def queue_stats(self):
+        """{"active": unfinished jobs, "max_pending": limit}."""
+        with self._lock:
+            return {"active": self._active_count(), "max_pending": self.max_pending}
+
+    def _output(self, output_dir, base_name, job_id):
+        output_name = f"{base_name}_{job_id[:8]}_processed.mp4"
+        return output_name, os.path.abspath(os.path.join(output_dir, output_name))
+
+    def submit(self, owner, input_path, release_input, output_dir, base_name, task=_run_video_job,
+               on_done=None, **task_options):
+        """Queue input_path for processing. release_input() is called once the job ends.
+
+        task runs in a worker as task(input_path, output_path, progress, cancel_event,
+        **task_options) and returns (status, summary). on_done(job) is called
+        in this process after a job finishes successfully.
+        """
+        with self._lock:
+            self._prune()
+            if self._active_count() >= self.max_pending:
+                raise JobQueueFull()
+            self._ensure_pool()
+            job_id = uuid.uuid4().hex
+            output_name, output_path = self._output(output_dir, base_name, job_id)
+            progress = self._manager.dict(frames_done=0, frames_total=0)
+            cancel_event = self._manager.Event()
+            job = VideoJob(job_id, owner, input_path, release_input, output_path, output_name,
+                           progress, cancel_event)
+            job.on_done = on_done
+            self._jobs[job_id] = job
+            job.future = self._executor.submit(task, input_path, output_path,
+                                               progress, cancel_event, **task_options)
+        job.future.add_done_callback(lambda fut, job=job: self._on_done(job, fut))
+        return job
+
+    def add_finished(self, owner, output_dir, base_name, place_output, summary, frames):
+        """Register an already finished job (e.g. from a cache) without running anything.
+
+        place_output(output_path) must create the output file.
+        """
+        job_id = uuid.uuid4().hex
+        output_name, output_path = self._output(output_dir, base_name, job_id)
+        place_output(output_path)
+        job = VideoJob(job_id, owner, None, lambda: None, output_path, output_name,
+                       {"frames_done": frames, "frames_total": frames}, None)
+        job.status = JOB_DONE
+        job.summary = summary
+        job.finished_at = time.time()
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+        return job
+
+    def _on_done(self, job, future):
+        try:
+            job.status, job.summary = future.result()
+        except CancelledError:
+            job.status = JOB_CANCELLED
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e) or e.__class__.__name__
+        job.finished_at = time.time()
+        try:
+            job.release_input()
+        except OSError:
+            pass
+        if job.status != JOB_DONE:
+            try:
+                os.remove(job.output_path)
+            except OSError:
+                pass
+        elif job.on_done is not None:
+            try:
+                job.on_done(job)
+            except Exception:
+                pass
+
+    def get(self, job_id, owner):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        return job
+
+    def cancel(self, job):
+        """Cancel a queued job outright, or signal a running one to stop at the next frame."""
+        if job.finished_at is not None:
+            return False
+        if job.future is not None and job.future.cancel():
+            return True
+        job.cancel_event.set()
+        return True
@@ -0,0 +1,139 @@
+import os
+import queue
+import threading
+
+from apple_detection import detect_apples_in_bgr_image
+
+# Staged decode -> detect -> encode engine for whole-video processing.
+#
+# One thread decodes frames, a pool of detector threads annotates them in
+# whatever order they finish, and the calling thread writes them back in
+# frame order. OpenCV releases the GIL inside cvtColor/inRange/morphology/
+# findContours, so detector threads scale across cores. A semaphore caps the
+# number of frames in flight, which bounds memory and gives backpressure to
+# the decoder when the writer falls behind.
+
+VIDEO_PIPELINE_WORKERS = int(os.getenv('VIDEO_PIPELINE_WORKERS', os.cpu_count() or 1))
+
+_END = object()
+
+
+def _annotate(frame):
+    _, annotated = detect_apples_in_bgr_image(frame, in_place=True)
+    return annotated
+
+
+def _process_serial(cap, writer, annotate, finalize, on_progress, stop_event):
+    frames_done = 0
+    while True:
+        if stop_event is not None and stop_event.is_set():
+            break
+        ret, frame = cap.read()
+        if not ret:
+            break
+        result = annotate(frame)
+        writer.write(finalize(result) if finalize is not None else result)
+        frames_done += 1
+        if on_progress is not None:
+            on_progress(frames_done)
+    return frames_done
+
+
+def process_video(cap, writer, annotate=_annotate, workers=None, max_in_flight=None,
+                  on_progress=None, stop_event=None, finalize=None):
+    """Read every frame from cap, annotate it and write it to writer in order.
+
+    annotate runs on the worker threads, in any order. If finalize is given
+    it is called on each annotate() result in frame order on the writing
+    thread and must return the frame to write; stateful steps such as
+    tracking belong there. Output is frame-for-frame identical to the serial
+    loop. on_progress is called with the number of frames written;
+    stop_event (anything with is_set()) aborts early. Returns the number of
+    frames written.
+    """
+    workers = max(1, workers or VIDEO_PIPELINE_WORKERS)
+    if workers == 1:
+        return _process_serial(cap, writer, annotate, finalize, on_progress, stop_event)
+    max_in_flight = max(workers, max_in_flight or workers * 4)
+
+    slots = threading.Semaphore(max_in_flight)
+    decoded = queue.Queue()
+    annotated = queue.Queue()
+    abort = threading.Event()
+    errors = []
+
+    def fail(exc):
+        errors.append(exc)
+        abort.set()
+
+    def decode_stage():
+        total = 0
+        try:
+            while not abort.is_set():
+                if stop_event is not None and stop_event.is_set():
+                    abort.set()
+                    break
+                if not slots.acquire(timeout=0.1):
+                    continue
+                ret, frame = cap.read()
+                if not ret:
+                    slots.release()
+                    break
+                decoded.put((total, frame))
+                total += 1
+        except Exception as e:
+            fail(e)
+        finally:
+            for _ in range(workers):
+                decoded.put(_END)
+            annotated.put((_END, total))
+
+    def detect_stage():
+        while True:
+            item = decoded.get()
+            if item is _END:
+                return
+            index, frame = item
+            if abort.is_set():
+                continue
+            try:
+                annotated.put((index, annotate(frame)))
+            except Exception as e:
+                fail(e)
+
+    threads = [threading.Thread(target=decode_stage, name='video-decode', daemon=True)]
+    threads += [threading.Thread(target=detect_stage, name=f'video-detect-{i}', daemon=True)
+                for i in range(workers)]
+    for t in threads:
+        t.start()
+
+    # Encode stage: reorder finished frames and write them in sequence
+    pending = {}
+    next_index = 0
+    total = None
+    try:
+        while total is None or next_index < total:
+            try:
+                index, frame = annotated.get(timeout=0.1)
+            except queue.Empty:
+                if abort.is_set():
+                    break
+                continue
+            if index is _END:
+                total = frame
+                continue
+            pending[index] = frame
+            while next_index in pending:
+                result = pending.pop(next_index)
+                writer.write(finalize(result) if finalize is not None else result)
+                next_index += 1
+                slots.release()
+                if on_progress is not None:
+                    on_progress(next_index)
+    finally:
+        abort.set()
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+    return next_index
@@ -0,0 +1,230 @@
+import time
+import asyncio
+import threading
+
+import cv2
+
+from apple_detection import detect_apples_in_bgr_image
+from stream_state import StreamState
+from stream_governor import StreamGovernor
+from apple_detection import APPLE_MIN_AREA
+from tracking import KeyframeTracker
+from metrics import STREAM_DROPPED, STREAM_FRAMES, STREAMS_ACTIVE, stage
+
+# One capture-and-detect thread per camera, fanned out to any number of MJPEG
+# viewers. The thread publishes each annotated JPEG once; viewers always take
+# the newest frame, so a slow client skips frames instead of holding up the
+# camera or the other viewers. Viewers can wait from threads (WSGI) or from
+# coroutines (ASGI, see asgi_app.py); an async viewer holds no thread at all.
+
+_MJPEG_PART = b"--frame\r\nContent-Type: image/jpeg\r\n\r\n"
+
+
+def _count_delivery(seq, newest):
+    """Count one frame sent to a webcam viewer, and the published frames it skipped."""
+    STREAM_FRAMES.inc('webcam')
+    if seq:
+        STREAM_DROPPED.inc('webcam', newest - seq - 1)
+
+
+class FrameBroadcast:
+    """Single-slot buffer holding the latest published frame and a sequence number."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._chunk = None
+        self._closed = False
+        self._async_waiters = set()  # (loop, asyncio.Event) of coroutines in wait_newer_async
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # loop already closed
+
+    def publish(self, chunk):
+        with self._cond:
+            self._seq += 1
+            self._chunk = chunk
+            self._notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._notify()
+
+    def wait_newer(self, seq, timeout=None):
+        """Return (seq, chunk) newer than seq, None once closed, or (seq, None) on timeout."""
+        with self._cond:
+            while self._seq <= seq and not self._closed:
+                if not self._cond.wait(timeout):
+                    return seq, None
+            if self._seq <= seq:
+                return None
+            return self._seq, self._chunk
+
+    async def wait_newer_async(self, seq, timeout=None):
+        """wait_newer() for coroutines: awaits the publisher without blocking the event loop."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            waiting = self._seq <= seq and not self._closed
+            if waiting:
+                self._async_waiters.add(waiter)
+        if waiting:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                return seq, None
+            finally:
+                with self._cond:
+                    self._async_waiters.discard(waiter)
+        with self._cond:
+            if self._seq <= seq:
+                return None
+            return self._seq, self._chunk
+
+
+class CameraBroadcaster:
+    """Owns one cv2.VideoCapture and shares its annotated frames with all subscribers."""
+
+    def __init__(self, source=0, size=(300, 200)):
+        self.source = source
+        self.size = size
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = None
+        self._broadcast = None
+        self._subscribers = 0
+        self.state = StreamState()
+
+    @property
+    def running(self):
+        thread = self._thread
+        return thread is not None and thread.is_alive()
+
+    def start(self, detect_every=1):
+        """(Re)open the camera and start the capture thread. Returns False if it cannot open.
+
+        detect_every > 1 runs full detection only on keyframes and tracks apples in between.
+        """
+        with self._lock:
+            self._stop_locked()
+            cam = cv2.VideoCapture(self.source)
+            if not cam.isOpened():
+                return False
+            self._stop = threading.Event()
+            self._broadcast = FrameBroadcast()
+            detect = KeyframeTracker(detect_every).detect if detect_every > 1 else detect_apples_in_bgr_image
+            self._thread = threading.Thread(target=self._run, args=(cam, self._stop, self._broadcast, detect),
+                                            name=f'camera-{self.source}', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            self._stop_locked()
+
+    def _stop_locked(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self, cam, stop, broadcast, detect):
+        # Viewers drop frames on their own, so only processing time drives adaptation here
+        governor = StreamGovernor(self.size)
+        try:
+            while not stop.is_set():
+                with stage('capture'):
+                    ok, frame = cam.read()
+                if not ok:
+                    break
+                # Nobody watching: keep the camera drained but skip detection and encoding
+                if self._subscribers == 0 and self.state.snapshot() is not None:
+                    continue
+                # Over the FPS cap: drop the frame rather than let the capture buffer go stale
+                if not governor.ready():
+                    STREAM_DROPPED.inc('webcam_camera')
+                    continue
+                started = time.perf_counter()
+                try:
+                    frame = cv2.resize(frame, governor.size)
+                except Exception:
+                    pass
+                count, annotated = detect(frame, in_place=True, min_area=APPLE_MIN_AREA * governor.area_scale())
+                # The thread never touches a recorded frame again, so readers share it as-is
+                self.state.record(annotated, count)
+                with stage('encode'):
+                    success, buf = cv2.imencode('.jpg', annotated, [cv2.IMWRITE_JPEG_QUALITY, governor.quality])
+                governor.processed(time.perf_counter() - started)
+                governor.emitted()
+                if success:
+                    broadcast.publish(_MJPEG_PART + buf.tobytes() + b"\r\n")
+        finally:
+            try:
+                cam.release()
+            except Exception:
+                pass
+            broadcast.close()
+
+    def _join(self):
+        with self._lock:
+            self._subscribers += 1
+        STREAMS_ACTIVE.add('webcam', 1)
+
+    def _leave(self):
+        with self._lock:
+            self._subscribers -= 1
+        STREAMS_ACTIVE.add('webcam', -1)
+
+    def snapshot(self, index=None):
+        """Return (index, annotated_bgr, count) for the latest or a recent frame, else None."""
+        return self.state.snapshot(index)
+
+    def frames(self):
+        """Yield MJPEG parts for one viewer until the camera stops."""
+        broadcast = self._broadcast
+        if broadcast is None or not self.running:
+            return
+        self._join()
+        try:
+            seq = 0
+            while True:
+                item = broadcast.wait_newer(seq, timeout=1.0)
+                if item is None:
+                    break
+                newest, chunk = item
+                if chunk is not None:
+                    _count_delivery(seq, newest)
+                    yield chunk
+                seq = newest
+        finally:
+            self._leave()
+
+    async def aframes(self, executor=None):
+        """frames() as an async generator, for ASGI servers.
+
+        executor is accepted for symmetry with FileStream.aframes; the camera
+        thread already does all the work.
+        """
+        broadcast = self._broadcast
+        if broadcast is None or not self.running:
+            return
+        self._join()
+        try:
+            seq = 0
+            while True:
+                item = await broadcast.wait_newer_async(seq, timeout=1.0)
+                if item is None:
+                    break
+                newest, chunk = item
+                if chunk is not None:
+                    _count_delivery(seq, newest)
+                    yield chunk
+                seq = newest
+        finally:
+            self._leave()
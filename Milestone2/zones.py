@@ -0,0 +1,249 @@
+import json
+
+import cv2
+import numpy as np
+
+from tracking import MultiObjectTracker
+
+# Named polygon zones and counting lines for the people counter.
+#
+# Zones are rasterised once per frame size into an integer mask where bit i
+# of a pixel is set when it lies inside zone i, so overlapping zones work and
+# testing every detection centre against every zone is a single fancy-indexed
+# lookup plus a bit unpack, however many zones a camera has.
+
+MAX_ZONES = 64
+
+
+def _points(value, name, minimum):
+    try:
+        points = [(int(x), int(y)) for x, y in value]
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} needs a list of [x, y] points")
+    if len(points) < minimum:
+        raise ValueError(f"{name} needs at least {minimum} points")
+    return points
+
+
+def _load(value, what):
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            raise ValueError(f"{what} must be valid JSON")
+    if not isinstance(value, list):
+        raise ValueError(f"{what} must be a list")
+    return value
+
+
+def parse_zones(value):
+    """Named zones from JSON text or an already-decoded list.
+
+    Each zone is {"name": ..., "points": [[x, y], ...]} for a polygon or
+    {"name": ..., "rect": [x1, y1, x2, y2]}; a bare [x1, y1, x2, y2] is
+    named zone1, zone2, ... by position. Raises ValueError for anything else.
+    """
+    zones = []
+    for number, zone in enumerate(_load(value, "zones"), start=1):
+        if isinstance(zone, dict):
+            name = str(zone.get('name') or f'zone{number}')
+            rect, points = zone.get('rect'), zone.get('points')
+        else:
+            name, rect, points = f'zone{number}', zone, None
+        if points is None:
+            try:
+                x1, y1, x2, y2 = (int(v) for v in rect)
+            except (TypeError, ValueError):
+                raise ValueError(f"Zone {name} needs points or rect [x1, y1, x2, y2]")
+            points = [(x1, y1), (x2, y1), (x2, y2), (x1, y2)]
+        zones.append({"name": name, "points": _points(points, f"Zone {name}", 3)})
+    if len(zones) > MAX_ZONES:
+        raise ValueError(f"At most {MAX_ZONES} zones are supported")
+    return zones
+
+
+def parse_lines(value):
+    """Counting lines: [{"name": ..., "points": [[x1, y1], [x2, y2]]}, ...].
+
+    Crossing from the left of the first->second point direction to its right
+    counts as "in", the other way as "out".
+    """
+    lines = []
+    for number, line in enumerate(_load(value, "lines"), start=1):
+        if isinstance(line, dict):
+            name, points = str(line.get('name') or f'line{number}'), line.get('points')
+        else:
+            name, points = f'line{number}', line
+        points = _points(points, f"Line {name}", 2)
+        lines.append({"name": name, "points": points[:2]})
+    return lines
+
+
+class ZoneLayout:
+    """Polygon zones and counting lines for one camera, with a cached bit mask per frame size."""
+
+    def __init__(self, zones=(), lines=()):
+        self.zones = list(zones)
+        self.lines = list(lines)
+        self.names = [zone["name"] for zone in self.zones]
+        self._bits = np.left_shift(np.uint64(1), np.arange(len(self.zones), dtype=np.uint64))
+        self._mask = None
+
+    @classmethod
+    def parse(cls, zones=None, lines=None):
+        """Build from request values; raises ValueError on malformed JSON or geometry."""
+        return cls(parse_zones(zones), parse_lines(lines))
+
+    def __bool__(self):
+        return bool(self.zones or self.lines)
+
+    def mask(self, shape):
+        """(h, w) uint64 array; bit i is set inside zone i. Rebuilt only when the size changes."""
+        h, w = shape[:2]
+        if self._mask is None or self._mask.shape != (h, w):
+            mask = np.zeros((h, w), np.uint64)
+            scratch = np.empty((h, w), np.uint8)
+            for bit, zone in zip(self._bits, self.zones):
+                scratch.fill(0)
+                cv2.fillPoly(scratch, [np.array(zone["points"], np.int32)], 1)
+                mask[scratch.view(bool)] |= bit
+            self._mask = mask
+        return self._mask
+
+    def membership(self, centers, shape):
+        """(N, zones) bool array saying which zones each (x, y) centre is in."""
+        centers = np.asarray(centers, np.int64).reshape(-1, 2)
+        if not self.zones or not len(centers):
+            return np.zeros((len(centers), len(self.zones)), bool)
+        h, w = shape[:2]
+        xs = np.clip(centers[:, 0], 0, w - 1)
+        ys = np.clip(centers[:, 1], 0, h - 1)
+        # Centres outside the frame are in no zone
+        in_frame = (xs == centers[:, 0]) & (ys == centers[:, 1])
+        labels = np.where(in_frame, self.mask(shape)[ys, xs], np.uint64(0))
+        return (labels[:, None] & self._bits[None, :]) != 0
+
+    def counts(self, centers, shape):
+        """{zone name: number of centres inside}."""
+        per_zone = self.membership(centers, shape).sum(axis=0)
+        return {name: int(n) for name, n in zip(self.names, per_zone)}
+
+    def draw(self, bgr_image, color=(255, 0, 0)):
+        for zone in self.zones:
+            cv2.polylines(bgr_image, [np.array(zone["points"], np.int32)], True, color, 2)
+        for line in self.lines:
+            cv2.line(bgr_image, tuple(line["points"][0]), tuple(line["points"][1]), (0, 255, 255), 2)
+        return bgr_image
+
+
+def _side(line, points):
+    """Sign of each point relative to line: >0 right of first->second, <0 left (image coords)."""
+    (ax, ay), (bx, by) = line["points"]
+    return np.sign((bx - ax) * (points[:, 1] - ay) - (by - ay) * (points[:, 0] - ax))
+
+
+def _within_segment(line, points):
+    """True where a point projects onto the line segment itself rather than its extension."""
+    a = np.array(line["points"][0], np.float64)
+    d = np.array(line["points"][1], np.float64) - a
+    t = ((points - a) @ d) / max(float(d @ d), 1e-9)
+    return (t >= 0) & (t <= 1)
+
+
+class OccupancyCounter:
+    """Per-stream zone occupancy, dwell time and line crossings over tracked people.
+
+    Boxes are associated into tracks by IoU; each track remembers which
+    zones it is in and since which frame, so leaving a zone (or the track
+    ending) closes a visit and adds its dwell time. A track whose centre
+    moves across a counting line between two updates counts one in or out.
+    """
+
+    def __init__(self, layout, fps=None, tracker=None):
+        self.layout = layout
+        self.fps = fps or 24.0
+        self.tracker = tracker or MultiObjectTracker(metric='iou', max_missed=5)
+        self.tracker.on_track_end = self._track_ended
+        n = len(layout.zones)
+        self._state = {}  # track id -> (center, membership, entered_at)
+        self.visits = np.zeros(n, np.int64)
+        self.dwell_frames = np.zeros(n, np.int64)
+        self.crossings = {line["name"]: {"in": 0, "out": 0} for line in layout.lines}
+        self._frame_index = 0
+
+    def _close_visits(self, left, entered_at, frame_index):
+        self.visits += left
+        self.dwell_frames += np.where(left, frame_index - entered_at, 0)
+
+    def _track_ended(self, track):
+        state = self._state.pop(track.id, None)
+        if state is not None:
+            _, inside, entered_at = state
+            self._close_visits(inside, entered_at, track.last_frame + 1)
+
+    def update(self, boxes, shape, frame_index=None):
+        """Feed one frame's (N, 4) x1, y1, x2, y2 boxes. Returns (ids, occupancy dict)."""
+        frame_index = self._frame_index if frame_index is None else frame_index
+        self._frame_index = frame_index + 1
+        boxes = np.asarray(boxes, np.int64).reshape(-1, 4)
+        centers = (boxes[:, :2] + boxes[:, 2:]) // 2
+        detections = [
+            {"center": center, "radius": 0, "bbox": [x1, y1, x2 - x1, y2 - y1]}
+            for center, (x1, y1, x2, y2) in zip(centers.tolist(), boxes.tolist())
+        ]
+        self.tracker.update(detections, frame_index)
+        ids = [det.get("id") for det in detections]
+        membership = self.layout.membership(centers, shape)
+
+        previous = []
+        current = []
+        for det_id, center, inside in zip(ids, centers, membership):
+            if det_id is None:
+                continue
+            state = self._state.get(det_id)
+            if state is None:
+                entered_at = np.full(len(inside), frame_index, np.int64)
+            else:
+                prev_center, was_inside, entered_at = state
+                self._close_visits(was_inside & ~inside, entered_at, frame_index)
+                entered_at = np.where(inside & ~was_inside, frame_index, entered_at)
+                previous.append(prev_center)
+                current.append(center)
+            self._state[det_id] = (center, inside, entered_at)
+
+        if previous and self.layout.lines:
+            previous = np.array(previous, np.float64)
+            current = np.array(current, np.float64)
+            for line in self.layout.lines:
+                before, after = _side(line, previous), _side(line, current)
+                crossed = (before != after) & (before != 0) & _within_segment(line, (previous + current) / 2)
+                self.crossings[line["name"]]["in"] += int(np.count_nonzero(crossed & (before < 0)))
+                self.crossings[line["name"]]["out"] += int(np.count_nonzero(crossed & (before > 0)))
+        return ids, self.result(frame_index)
+
+    def result(self, frame_index=None):
+        frame_index = self._frame_index if frame_index is None else frame_index
+        n = len(self.layout.zones)
+        occupants = np.zeros(n, np.int64)
+        current_dwell = np.zeros(n, np.int64)
+        for _, inside, entered_at in self._state.values():
+            occupants += inside
+            current_dwell += np.where(inside, frame_index - entered_at, 0)
+        zones = {}
+        for i, name in enumerate(self.layout.names):
+            zones[name] = {
+                "count": int(occupants[i]),
+                "visits": int(self.visits[i]),
+                "mean_dwell_seconds": round(float(self.dwell_frames[i] / self.visits[i] / self.fps), 2)
+                if self.visits[i] else 0.0,
+                "current_mean_dwell_seconds": round(float(current_dwell[i] / occupants[i] / self.fps), 2)
+                if occupants[i] else 0.0,
+            }
+        return {"zones": zones, "lines": {name: dict(counts) for name, counts in self.crossings.items()}}
+
+    def finish(self):
+        """Close every open visit (end of video) and return the final occupancy."""
+        self.tracker.finish()
+        return self.result()